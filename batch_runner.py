@@ -0,0 +1,218 @@
+import os
+import sys
+import csv
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import traceback
+from typing import Any, Dict, List, Optional, Set
+from gift_suggestion_workflow import GiftSuggestionWorkflow, Context
+from llm_cache import LLMResponseCache
+from product_cache import ProductSearchCache
+from cassette import Cassette
+
+DEFAULT_PRICE_CEILING = 30
+
+
+def load_recipients(input_path: str) -> List[Dict[str, Any]]:
+    """Reads recipients from a .csv or .jsonl file with twitter_handle, additional_text and price_ceiling columns."""
+    if input_path.endswith(".csv"):
+        with open(input_path, newline="") as input_file:
+            rows = list(csv.DictReader(input_file))
+    else:
+        with open(input_path) as input_file:
+            rows = [json.loads(line) for line in input_file if line.strip()]
+
+    recipients = []
+    content_ids = {}
+    for row in rows:
+        price_ceiling = row.get("price_ceiling") or DEFAULT_PRICE_CEILING
+        if row.get("id") not in (None, ""):
+            row_id = str(row["id"])
+        else:
+            # Rows without an explicit id are identified by their content, so editing the input keeps
+            # finished results with their recipients; repeated rows are told apart by occurrence
+            content_id = hashlib.sha256(json.dumps(row, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+            content_ids[content_id] = content_ids.get(content_id, 0) + 1
+            row_id = content_id if content_ids[content_id] == 1 else f"{content_id}-{content_ids[content_id]}"
+        recipients.append({
+            "row_id": row_id,
+            "twitter_handle": (row.get("twitter_handle") or "").strip().lstrip("@"),
+            "additional_text": row.get("additional_text") or "",
+            "price_ceiling": float(price_ceiling),
+        })
+    return recipients
+
+
+def load_finished_row_ids(output_path: str) -> Set[str]:
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path) as output_file:
+        for line in output_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a partially written last line behind
+                continue
+            if isinstance(record, dict) and record.get("status") == "ok" and "row_id" in record:
+                finished.add(record["row_id"])
+    return finished
+
+
+def drop_partial_last_line(output_path: str):
+    """Cuts off a last line left without its newline by a run killed mid-write, so appends start on a fresh line."""
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as output_file:
+        size = output_file.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        output_file.seek(size - 1)
+        if output_file.read(1) == b"\n":
+            return
+        output_file.seek(0)
+        content = output_file.read()
+        output_file.truncate(content.rfind(b"\n") + 1)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_recipient(recipient: Dict[str, Any], llm_cache: Optional[LLMResponseCache], product_cache: Optional[ProductSearchCache], verbose: bool, cassette: Optional[Cassette] = None) -> Dict[str, Any]:
+    def log_print(*args, **kwargs):
+        if verbose:
+            print(f"[{recipient['row_id']}]", *args, flush=True)
+
+    workflow = GiftSuggestionWorkflow(
+        price_ceiling=recipient["price_ceiling"],
+        log_print_func=log_print,
+        timeout=600,
+        concurrent_debates=True,
+        llm_cache=llm_cache,
+        product_cache=product_cache,
+        batch_product_lookups=True,
+        collect_metrics=True,
+        cassette=cassette,
+    )
+    ctx = Context(workflow)
+
+    if recipient["twitter_handle"]:
+        from searchx import search_tweets
+
+        tweet_data = await asyncio.to_thread(search_tweets, recipient["twitter_handle"], cassette=cassette)
+        ctx.data["tweets"] = [tweet["text"] for tweet in tweet_data]
+    else:
+        ctx.data["tweets"] = []
+    ctx.data["twitter_handle"] = recipient["twitter_handle"]
+    ctx.data["additional_text"] = recipient["additional_text"]
+
+    return await workflow.run_pipeline(ctx)
+
+
+async def run_batch(recipients: List[Dict[str, Any]], output_path: str, workers: int, verbose: bool = False, cassette: Optional[Cassette] = None, use_cache: bool = True) -> List[Dict[str, Any]]:
+    llm_cache = LLMResponseCache() if use_cache else None
+    product_cache = ProductSearchCache() if use_cache else None
+    queue = asyncio.Queue()
+    for recipient in recipients:
+        queue.put_nowait(recipient)
+
+    records = []
+    write_lock = asyncio.Lock()
+
+    drop_partial_last_line(output_path)
+    with open(output_path, "a") as output_file:
+        async def worker():
+            while True:
+                try:
+                    recipient = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+
+                start = time.perf_counter()
+                record = dict(recipient)
+                try:
+                    record["result"] = await run_recipient(recipient, llm_cache, product_cache, verbose, cassette)
+                    record["status"] = "ok"
+                except Exception as e:
+                    record["status"] = "error"
+                    record["error"] = str(e)
+                    traceback.print_exc()
+                record["latency_seconds"] = round(time.perf_counter() - start, 3)
+
+                # Stream every finished run to disk so a restart can skip it
+                async with write_lock:
+                    output_file.write(json.dumps(record, default=str) + "\n")
+                    output_file.flush()
+                    records.append(record)
+                print(f"[{recipient['row_id']}] {record['status']} in {record['latency_seconds']}s ({len(records)}/{len(recipients)})", flush=True)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+
+    return records
+
+
+def print_summary(records: List[Dict[str, Any]], elapsed: float, skipped: int, cassette: Optional[Cassette] = None):
+    latencies = [record["latency_seconds"] for record in records if record["status"] == "ok"]
+    failures = [record for record in records if record["status"] != "ok"]
+    runs_per_minute = len(records) / elapsed * 60 if elapsed > 0 else 0.0
+
+    print("\n--- Batch Summary ---")
+    print(f"Runs: {len(records)} ({len(latencies)} ok, {len(failures)} failed, {skipped} skipped as already finished)")
+    print(f"Wall time: {elapsed:.1f}s")
+    print(f"Throughput: {runs_per_minute:.2f} runs/min")
+    print(f"Latency p50: {percentile(latencies, 50):.1f}s, p95: {percentile(latencies, 95):.1f}s")
+    cost = sum(record["result"].get("metrics", {}).get("totals", {}).get("cost_usd", 0.0) for record in records if record["status"] == "ok")
+    print(f"Estimated LLM cost: ${cost:.4f}")
+    if cassette is not None:
+        print(f"Cassette ({cassette.mode}): {cassette.stats()}")
+    for record in failures:
+        print(f"Failed row {record['row_id']}: {record['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate gift suggestions for a list of recipients.")
+    parser.add_argument("input", help="CSV or JSONL file with twitter_handle, additional_text and price_ceiling")
+    parser.add_argument("output", help="JSONL file that finished results are appended to")
+    parser.add_argument("--workers", type=int, default=4, help="Number of workflows to run at the same time")
+    parser.add_argument("--verbose", action="store_true", help="Print every workflow log message")
+    parser.add_argument("--record", metavar="CASSETTE", help="Record every LLM, tweet search and Apify response to this file")
+    parser.add_argument("--replay", metavar="CASSETTE", help="Serve LLM, tweet search and Apify responses from this recorded file")
+    parser.add_argument("--replay-latency", choices=["original", "zero"], default="original", help="Wait as long as the recorded calls took, or not at all")
+    parser.add_argument("--no-cache", action="store_true", help="Run without the LLM and product caches")
+    args = parser.parse_args()
+
+    if args.record and args.replay:
+        parser.error("--record and --replay cannot be used together")
+    cassette = None
+    if args.record:
+        cassette = Cassette(args.record, mode="record")
+    elif args.replay:
+        cassette = Cassette(args.replay, mode="replay", latency=args.replay_latency)
+
+    recipients = load_recipients(args.input)
+    finished = load_finished_row_ids(args.output)
+    pending = [recipient for recipient in recipients if recipient["row_id"] not in finished]
+    print(f"{len(pending)} of {len(recipients)} recipients to run")
+
+    start = time.perf_counter()
+    try:
+        records = asyncio.run(run_batch(pending, args.output, args.workers, args.verbose, cassette, not args.no_cache))
+    finally:
+        if cassette is not None:
+            cassette.save()
+    print_summary(records, time.perf_counter() - start, len(recipients) - len(pending), cassette)
+
+    if any(record["status"] != "ok" for record in records):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
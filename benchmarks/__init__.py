@@ -0,0 +1,9 @@
+"""Offline benchmarks for GiftSuggestionWorkflow.
+
+Runs the real workflow steps against deterministic stand-ins for OpenAI, the function-calling
+agents, Toolhouse and Apify, and reports per-step and end-to-end latency percentiles,
+throughput and peak memory:
+
+    python -m benchmarks --runs 20 --concurrency 4 --preset concurrent --output bench.json
+    python -m benchmarks --runs 20 --concurrency 4 --preset concurrent --compare bench.json
+"""
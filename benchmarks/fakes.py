@@ -0,0 +1,492 @@
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import contextvars
+from typing import Any, Dict, List, Optional, Sequence
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+    MessageRole,
+)
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.chat_engine.types import AgentChatResponse
+from llama_index.core.memory import ChatMemoryBuffer
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+
+# Index of the benchmark run the current task belongs to. Latencies and failures are drawn from
+# a generator seeded with it and the request content, so they do not depend on scheduling order.
+current_run_index = contextvars.ContextVar("current_run_index", default=0)
+
+
+class FakeServiceError(Exception):
+    pass
+
+
+class LatencyProfile:
+    """Lognormal latency around median seconds, plus the probability that a call fails."""
+
+    def __init__(self, median: float, spread: float = 0.3, error_rate: float = 0.0):
+        self.median = median
+        self.spread = spread
+        self.error_rate = error_rate
+
+    def sample(self, rng: random.Random) -> float:
+        return self.median * math.exp(self.spread * rng.gauss(0.0, 1.0))
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"median": self.median, "spread": self.spread, "error_rate": self.error_rate}
+
+
+class FakeConfig:
+    """Latencies, error rates and response shapes shared by every stand-in of a benchmark."""
+
+    def __init__(
+        self,
+        seed: int = 0,
+        time_scale: float = 1.0,
+        llm: Optional[LatencyProfile] = None,
+        agent: Optional[LatencyProfile] = None,
+        apify: Optional[LatencyProfile] = None,
+        toolhouse: Optional[LatencyProfile] = None,
+        embedding: Optional[LatencyProfile] = None,
+        categories: int = 5,
+        ideas_per_category: int = 2,
+        items_per_keyword: int = 1,
+        malformed_rate: float = 0.0,
+        missing_field_rate: float = 0.0,
+        source_url_rate: float = 1.0,
+    ):
+        self.seed = seed
+        # Every sampled latency is multiplied by time_scale, so a suite can run faster than real time
+        self.time_scale = time_scale
+        self.llm = llm or LatencyProfile(1.5, 0.4)
+        # One agent chat is a tool-choosing LLM call, the tool's own LLM call and a final answer
+        self.agent = agent or LatencyProfile(4.5, 0.4)
+        self.apify = apify or LatencyProfile(25.0, 0.3)
+        self.toolhouse = toolhouse or LatencyProfile(3.0, 0.3)
+        self.embedding = embedding or LatencyProfile(0.3, 0.3)
+        self.categories = categories
+        self.ideas_per_category = ideas_per_category
+        self.items_per_keyword = items_per_keyword
+        # Share of LLM and agent responses that come back unparseable, to exercise the fallbacks
+        self.malformed_rate = malformed_rate
+        # Share of product items without a price, rating or image
+        self.missing_field_rate = missing_field_rate
+        # Share of product items that report the start URL they were scraped from
+        self.source_url_rate = source_url_rate
+
+    def rng(self, *parts: Any) -> random.Random:
+        key = json.dumps([self.seed, current_run_index.get(), *[str(part) for part in parts]])
+        return random.Random(hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def delay(self, profile: LatencyProfile, *parts: Any) -> float:
+        rng = self.rng(*parts)
+        seconds = profile.sample(rng) * self.time_scale
+        if rng.random() < profile.error_rate:
+            raise FakeServiceError(f"Injected failure for {parts[0] if parts else 'call'}")
+        return seconds
+
+    async def await_latency(self, profile: LatencyProfile, *parts: Any):
+        await asyncio.sleep(self.delay(profile, *parts))
+
+    def wait_latency(self, profile: LatencyProfile, *parts: Any):
+        time.sleep(self.delay(profile, *parts))
+
+    def is_malformed(self, *parts: Any) -> bool:
+        return self.rng("malformed", *parts).random() < self.malformed_rate
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "seed": self.seed,
+            "time_scale": self.time_scale,
+            "llm": self.llm.to_dict(),
+            "agent": self.agent.to_dict(),
+            "apify": self.apify.to_dict(),
+            "toolhouse": self.toolhouse.to_dict(),
+            "embedding": self.embedding.to_dict(),
+            "categories": self.categories,
+            "ideas_per_category": self.ideas_per_category,
+            "items_per_keyword": self.items_per_keyword,
+            "malformed_rate": self.malformed_rate,
+            "missing_field_rate": self.missing_field_rate,
+            "source_url_rate": self.source_url_rate,
+        }
+
+
+INTERESTS = ["Technology", "Fitness", "Travel", "Food", "Photography", "Music", "Gaming", "Gardening"]
+GIFT_CATEGORIES = [
+    "Smart gadgets", "Workout gear", "Travel accessories", "Gourmet snacks", "Camera accessories",
+    "Vinyl records", "Board games", "Indoor plants", "Specialty coffee", "Cookbooks",
+]
+
+
+class FakeResponses:
+    """Builds responses in the shapes the workflow's prompts and parsers expect."""
+
+    def __init__(self, config: FakeConfig):
+        self.config = config
+
+    def interests(self) -> List[str]:
+        return INTERESTS[:5]
+
+    def categories(self) -> List[str]:
+        return (GIFT_CATEGORIES * 2)[:max(self.config.categories, 10)]
+
+    def gift_ideas(self) -> Dict[str, List[str]]:
+        categories = self.categories()[:self.config.categories]
+        return {
+            category: [f"{category} gift idea {index + 1}" for index in range(self.config.ideas_per_category)]
+            for category in categories
+        }
+
+    @staticmethod
+    def con(gift: str) -> str:
+        return f"{gift} may not match the recipient's taste and could end up unused."
+
+    @staticmethod
+    def pro(gift: str) -> str:
+        return f"{gift} fits the recipient's interests and stays within budget."
+
+    def selection(self, gifts: List[str]) -> List[Dict[str, str]]:
+        gifts = gifts or [idea for ideas in self.gift_ideas().values() for idea in ideas]
+        return [{"gift": gift, "reasoning": f"{gift} is practical and personal."} for gift in gifts[:5]]
+
+    def keywords(self, gifts: List[str]) -> List[str]:
+        gifts = gifts or ["gift"]
+        return [self.keyword(gift) for gift in gifts[:3]]
+
+    @staticmethod
+    def keyword(gift: str) -> str:
+        gift = gift.split(":", 1)[-1].strip() if ": " in gift else gift
+        return f"{gift.lower()} under $30"
+
+    @staticmethod
+    def gifts_in(text: str) -> List[str]:
+        """Finds the gift ideas in a repr of the debates dict."""
+        gifts = re.findall(r"'([^']+)': (?:\{'pro'|\{'con'|\[)", text)
+        return list(dict.fromkeys(gifts))
+
+    def for_prompt(self, prompt: str) -> str:
+        """Text answer to one of the workflow's prompts, or JSON when the prompt asks for a schema."""
+        structured = "Here's a JSON schema to follow" in prompt
+        if "categorize them into interest areas" in prompt:
+            interests = self.interests()
+            return json.dumps({"interests": interests}) if structured else ", ".join(interests)
+        if "suggest potential gift categories" in prompt:
+            categories = self.categories()
+            return json.dumps({"categories": categories}) if structured else ", ".join(categories)
+        if "Generate unique and specific gift ideas" in prompt:
+            gift_ideas = self.gift_ideas()
+            return json.dumps({"gift_ideas": gift_ideas}) if structured else repr(gift_ideas)
+        if "You are debating several gift ideas" in prompt:
+            payload = json.loads(prompt.split("Gift ideas:\n", 1)[1].split("\n\nRespond only", 1)[0])
+            gifts = [item["gift"] if isinstance(item, dict) else item for item in payload]
+            return json.dumps({gift: {"con": self.con(gift), "pro": self.pro(gift)} for gift in gifts})
+        if "Debate the following gift idea" in prompt:
+            gift = prompt.split("Gift idea: ", 1)[1].split("\n", 1)[0].strip()
+            return json.dumps({"con": self.con(gift), "pro": self.pro(gift)})
+        if "Argue against the following gift idea" in prompt:
+            return self.con(prompt.split("Gift idea: ", 1)[1].split("\n", 1)[0].strip())
+        if "Argue in favor of the following gift idea" in prompt:
+            return self.pro(prompt.split("Gift idea: ", 1)[1].split("\n", 1)[0].strip())
+        if "final reasoned selection of the top 5" in prompt:
+            selection = self.selection(self.gifts_in(prompt))
+            if structured:
+                return json.dumps({"selections": selection})
+            return repr([f"{item['gift']}: {item['reasoning']}" for item in selection])
+        if "Provide a Python list of 3 search keywords" in prompt:
+            gifts = [gift.split(":", 1)[0] for gift in prompt.split("Gift ideas:\n", 1)[1].split(", ")]
+            keywords = self.keywords(gifts)
+            return json.dumps({"keywords": keywords}) if structured else repr(keywords)
+        if "generate one Amazon search keyword" in prompt:
+            return self.keyword(prompt.split("Gift idea:\n", 1)[1].split("\n", 1)[0].split(": ", 1)[0])
+        return "OK"
+
+    def for_agent(self, system_prompt: str, message: str) -> str:
+        """Final answer of an agent, in the shape the step that owns the agent parses."""
+        if "analyzes tweets" in system_prompt:
+            return ", ".join(self.interests())
+        if "mapping interest categories" in system_prompt:
+            return ", ".join(self.categories())
+        if "generating unique and thoughtful gift ideas" in system_prompt:
+            return repr(self.gift_ideas())
+        if "argues against gift ideas" in system_prompt:
+            return self.con(message.split(": ", 1)[-1][:80])
+        if "argues in favor of gift ideas" in system_prompt:
+            return self.pro(message.split(": ", 1)[-1][:80])
+        if "analyzing debates" in system_prompt:
+            selection = self.selection(self.gifts_in(message))
+            return repr([f"{item['gift']}: {item['reasoning']}" for item in selection])
+        if "generates Amazon search keywords" in system_prompt:
+            gifts = re.findall(r"'([^':]+):", message)
+            return "\n".join(f"- {keyword}" for keyword in self.keywords(gifts))
+        return "OK"
+
+
+class FakeOpenAI(CustomLLM):
+    """Stand-in for llama_index's OpenAI LLM that answers the workflow's prompts offline."""
+
+    model: str = "fake-gpt-4"
+    temperature: float = 0.0
+    _config: FakeConfig = PrivateAttr()
+    _responses: FakeResponses = PrivateAttr()
+
+    def __init__(self, config: FakeConfig, **kwargs: Any):
+        for name in ("api_key", "http_client", "async_http_client", "reuse_client"):
+            kwargs.pop(name, None)
+        super().__init__(**kwargs)
+        self._config = config
+        self._responses = FakeResponses(config)
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name=self.model, is_chat_model=False, is_function_calling_model=False)
+
+    def _text(self, prompt: str) -> str:
+        if self._config.is_malformed("llm", prompt):
+            return "I'm not sure how to answer that."
+        return self._responses.for_prompt(prompt)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        self._config.wait_latency(self._config.llm, "llm", prompt)
+        return CompletionResponse(text=self._text(prompt))
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        await self._config.await_latency(self._config.llm, "llm", prompt)
+        return CompletionResponse(text=self._text(prompt))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        self._config.wait_latency(self._config.llm, "llm", prompt)
+        text = self._text(prompt)
+
+        def gen() -> CompletionResponseGen:
+            for end in range(0, len(text), 20):
+                yield CompletionResponse(text=text[:end + 20], delta=text[end:end + 20])
+
+        return gen()
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        await self._config.await_latency(self._config.llm, "llm", prompt)
+        text = self._text(prompt)
+
+        async def gen() -> CompletionResponseAsyncGen:
+            for end in range(0, len(text), 20):
+                yield CompletionResponse(text=text[:end + 20], delta=text[end:end + 20])
+
+        return gen()
+
+
+class FakeAgent:
+    """Stand-in for the agent built from FunctionCallingAgentWorker; achat returns the agent's final answer."""
+
+    def __init__(self, config: FakeConfig, system_prompt: str):
+        self.config = config
+        self.system_prompt = system_prompt
+        self.responses = FakeResponses(config)
+        # Kept like the real agent's memory, so debate prompt sizes can be compared across debate_memory modes
+        self.memory = ChatMemoryBuffer.from_defaults(token_limit=10**6)
+
+    def _remember(self, message: str, response: str) -> AgentChatResponse:
+        self.memory.put(ChatMessage(role=MessageRole.USER, content=message))
+        self.memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=response))
+        return AgentChatResponse(response=response)
+
+    async def achat(self, message: str) -> AgentChatResponse:
+        await self.config.await_latency(self.config.agent, "agent", self.system_prompt, message)
+        if self.config.is_malformed("agent", self.system_prompt, message):
+            return self._remember(message, "I could not complete that request.")
+        return self._remember(message, self.responses.for_agent(self.system_prompt, message))
+
+    def chat(self, message: str) -> AgentChatResponse:
+        self.config.wait_latency(self.config.agent, "agent", self.system_prompt, message)
+        return self._remember(message, self.responses.for_agent(self.system_prompt, message))
+
+    def reset(self):
+        self.memory.reset()
+
+
+def fake_product_item(config: FakeConfig, keyword: str, index: int, search_url: str) -> Dict[str, Any]:
+    rng = config.rng("product", keyword, index)
+    item = {
+        "title": f"{keyword.title()} #{index + 1}",
+        "url": f"https://www.amazon.com/dp/FAKE{rng.randrange(10**8):08d}",
+        "price": {"value": round(rng.uniform(5, 30), 2), "currency": "$"},
+        "stars": round(rng.uniform(3.5, 5.0), 1),
+        "thumbnailImage": "https://m.media-amazon.com/images/I/fake.jpg",
+    }
+    if rng.random() < config.source_url_rate:
+        item["input"] = search_url
+    if rng.random() < config.missing_field_rate:
+        for field in ("price", "stars", "thumbnailImage"):
+            item.pop(field)
+    return item
+
+
+class _FakeListPage:
+    def __init__(self, items: List[dict]):
+        self.items = items
+        self.count = len(items)
+        self.total = len(items)
+
+
+class FakeEmbedding:
+    """Stand-in for OpenAIEmbedding: hashed bag-of-words vectors, so texts sharing words are similar."""
+
+    def __init__(self, config: FakeConfig, dimensions: int = 256):
+        self.config = config
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r"[a-z0-9]+", text.lower()):
+            vector[int(hashlib.sha256(word.encode("utf-8")).hexdigest(), 16) % self.dimensions] += 1.0
+        return vector
+
+    async def aget_text_embedding_batch(self, texts: List[str], **kwargs: Any) -> List[List[float]]:
+        await self.config.await_latency(self.config.embedding, "embedding", *texts)
+        return [self._embed(text) for text in texts]
+
+    def get_text_embedding_batch(self, texts: List[str], **kwargs: Any) -> List[List[float]]:
+        self.config.wait_latency(self.config.embedding, "embedding", *texts)
+        return [self._embed(text) for text in texts]
+
+
+class FakeApifyStore:
+    """Datasets produced by fake actor runs, shared by the sync and async clients."""
+
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.datasets: Dict[str, List[dict]] = {}
+        self.runs = 0
+
+    def run_actor(self, run_input: dict) -> Dict[str, str]:
+        from gift_suggestion_workflow import GiftSuggestionWorkflow
+
+        self.runs += 1
+        dataset_id = f"fake-dataset-{self.runs}"
+        items = []
+        for start_url in run_input.get("categoryOrProductUrls", []):
+            keyword = GiftSuggestionWorkflow.keyword_from_source_url(start_url["url"]) or "gift"
+            per_url = min(self.config.items_per_keyword, run_input.get("maxItemsPerStartUrl") or self.config.items_per_keyword)
+            items.extend(fake_product_item(self.config, keyword, index, start_url["url"]) for index in range(per_url))
+        self.datasets[dataset_id] = items
+        return {"id": f"fake-run-{self.runs}", "status": "SUCCEEDED", "defaultDatasetId": dataset_id}
+
+    @staticmethod
+    def run_key(run_input: dict) -> str:
+        return json.dumps(sorted(url["url"] for url in run_input.get("categoryOrProductUrls", [])))
+
+
+class FakeApifyClientAsync:
+    """Stand-in for apify_client.ApifyClientAsync covering actor().call() and the dataset reads the workflow uses."""
+
+    def __init__(self, store: FakeApifyStore, token: Optional[str] = None):
+        self.store = store
+
+    def actor(self, actor_id: str):
+        store = self.store
+
+        class Actor:
+            async def call(self, run_input: dict, **kwargs: Any) -> Dict[str, str]:
+                await store.config.await_latency(store.config.apify, "apify", store.run_key(run_input))
+                return store.run_actor(run_input)
+
+        return Actor()
+
+    def dataset(self, dataset_id: str):
+        items = self.store.datasets.get(dataset_id, [])
+
+        class Dataset:
+            async def list_items(self, **kwargs: Any) -> _FakeListPage:
+                return _FakeListPage(list(items))
+
+            async def iterate_items(self, **kwargs: Any):
+                for item in items:
+                    yield item
+
+        return Dataset()
+
+
+class FakeApifyClient:
+    """Synchronous counterpart of FakeApifyClientAsync, used by the background cache refresh."""
+
+    def __init__(self, store: FakeApifyStore, token: Optional[str] = None):
+        self.store = store
+
+    def actor(self, actor_id: str):
+        store = self.store
+
+        class Actor:
+            def call(self, run_input: dict, **kwargs: Any) -> Dict[str, str]:
+                store.config.wait_latency(store.config.apify, "apify", store.run_key(run_input))
+                return store.run_actor(run_input)
+
+        return Actor()
+
+    def dataset(self, dataset_id: str):
+        items = self.store.datasets.get(dataset_id, [])
+
+        class Dataset:
+            def list_items(self, **kwargs: Any) -> _FakeListPage:
+                return _FakeListPage(list(items))
+
+            def iterate_items(self, **kwargs: Any):
+                yield from items
+
+        return Dataset()
+
+
+class FakeToolhouse:
+    """Stand-in for the Toolhouse client searchx uses to search X."""
+
+    def __init__(self, config: FakeConfig, api_key: Optional[str] = None, provider: str = "openai"):
+        self.config = config
+
+    def get_tools(self) -> List[dict]:
+        return [{"type": "function", "function": {"name": "search_x", "parameters": {"type": "object", "properties": {}}}}]
+
+    def run_tools(self, response: Any) -> List[dict]:
+        self.config.wait_latency(self.config.toolhouse, "toolhouse", response.query)
+        return [{"role": "tool", "tool_call_id": "fake-tool-call", "content": "[]"}]
+
+
+class FakeOpenAIClient:
+    """Stand-in for the openai.OpenAI client searchx calls; returns a JSON array of tweets."""
+
+    def __init__(self, config: FakeConfig, api_key: Optional[str] = None):
+        self.config = config
+        self.chat = self
+        self.completions = self
+
+    def create(self, model: str, messages: Sequence[dict], **kwargs: Any):
+        query = messages[0]["content"]
+        self.config.wait_latency(self.config.llm, "openai", query, len(messages))
+        handle = re.search(r"from:(\w+)", query)
+        tweets = [
+            {"id": str(1800000000000000000 + index), "text": f"{interest} is what I do on weekends", "date": "2024-11-01"}
+            for index, interest in enumerate(INTERESTS)
+        ]
+
+        class Message:
+            content = json.dumps(tweets)
+
+        class Choice:
+            message = Message()
+
+        class Response:
+            choices = [Choice()]
+
+        Response.query = handle.group(1) if handle else query
+        return Response()
@@ -0,0 +1,274 @@
+import io
+import os
+import ast
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import functools
+import tracemalloc
+import contextlib
+import subprocess
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+from unittest import mock
+
+import apify_client
+import resource_pool
+from gift_suggestion_workflow import GiftSuggestionWorkflow, Context
+from batch_runner import percentile
+from benchmarks.fakes import (
+    FakeAgent,
+    FakeApifyClient,
+    FakeApifyClientAsync,
+    FakeApifyStore,
+    FakeConfig,
+    FakeEmbedding,
+    FakeOpenAI,
+    FakeOpenAIClient,
+    FakeToolhouse,
+    LatencyProfile,
+    current_run_index,
+)
+
+# Workflow options for the configurations worth comparing
+PRESETS = {
+    "baseline": {},
+    "concurrent": {"concurrent_debates": True, "batch_product_lookups": True},
+    "pipelined": {"concurrent_debates": True, "pipeline_products": True, "speculative_prefetch": True},
+    "batched": {"batch_debates": True, "concurrent_debates": True, "batch_product_lookups": True},
+    "pruned": {"concurrent_debates": True, "pipeline_products": True, "speculative_prefetch": True, "debate_top_k": 5},
+    "adaptive": {"concurrent_debates": True, "pipeline_products": True, "speculative_prefetch": True, "debate_top_k": 5, "adaptive_debates": True},
+    "local_selector": {"concurrent_debates": True, "pipeline_products": True, "speculative_prefetch": True, "debate_top_k": 8, "gift_selector": "local"},
+}
+
+
+@contextlib.contextmanager
+def install_fakes(config: FakeConfig, store: FakeApifyStore):
+    """Swaps OpenAI, the embedding model, the agents, Apify and the clients searchx uses for their offline stand-ins."""
+    with contextlib.ExitStack() as stack:
+        # A fresh pool, so no client created before the patches leaks into the benchmark
+        stack.enter_context(mock.patch.object(resource_pool, "_pool", None))
+        stack.enter_context(mock.patch.object(resource_pool, "OpenAI", functools.partial(FakeOpenAI, config)))
+        stack.enter_context(mock.patch.object(resource_pool.ResourcePool, "embed_model", lambda self, model=None: FakeEmbedding(config)))
+        stack.enter_context(mock.patch.object(
+            GiftSuggestionWorkflow,
+            "create_agent",
+            lambda self, ctx, tools, system_prompt: FakeAgent(config, system_prompt)
+        ))
+        stack.enter_context(mock.patch.object(apify_client, "ApifyClientAsync", functools.partial(FakeApifyClientAsync, store)))
+        stack.enter_context(mock.patch.object(apify_client, "ApifyClient", functools.partial(FakeApifyClient, store)))
+
+        searchx = import_searchx()
+        if searchx is not None:
+            stack.enter_context(mock.patch.object(searchx, "get_client", lambda: FakeOpenAIClient(config)))
+            stack.enter_context(mock.patch.object(searchx, "get_toolhouse", lambda: FakeToolhouse(config)))
+        yield searchx
+
+
+def import_searchx():
+    # Without searchx's dependencies the tweet fetch is not benchmarked
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    try:
+        import searchx
+    except Exception as e:
+        print(f"Skipping the tweet fetch: {str(e)}", file=sys.stderr)
+        return None
+    return searchx
+
+
+async def run_once(index: int, options: Dict[str, Any], searchx) -> Dict[str, Any]:
+    current_run_index.set(index)
+    workflow = GiftSuggestionWorkflow(
+        price_ceiling=30,
+        log_print_func=lambda *args, **kwargs: None,
+        collect_metrics=True,
+        **options
+    )
+    ctx = Context(workflow)
+    start = time.perf_counter()
+    record = {"index": index, "status": "ok"}
+    try:
+        if searchx is not None:
+            fetch_start = time.perf_counter()
+            tweets = await asyncio.to_thread(searchx.search_tweets, f"benchmark_user_{index}", use_cache=False)
+            record["search_tweets_seconds"] = time.perf_counter() - fetch_start
+            ctx.data["tweets"] = [tweet["text"] for tweet in tweets]
+        else:
+            ctx.data["tweets"] = []
+        ctx.data["additional_text"] = "Loves hiking and specialty coffee"
+        result = await workflow.run_pipeline(ctx)
+        record["products"] = sum(1 for product in result["products"] if product["product_links"])
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {str(e)}"
+    record["seconds"] = time.perf_counter() - start
+
+    metrics = ctx.data.get("metrics")
+    if metrics is not None:
+        record["spans"] = {f"{group['kind']}:{group['name']}": group["wall_seconds"] for group in metrics.summary()}
+        record["llm_calls"] = metrics.totals()["llm_calls"]
+    if "search_tweets_seconds" in record:
+        record.setdefault("spans", {})["step:search_tweets"] = record["search_tweets_seconds"]
+    return record
+
+
+async def run_suite(runs: int, concurrency: int, options: Dict[str, Any], searchx) -> List[Dict[str, Any]]:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def bounded(index: int):
+        async with semaphore:
+            return await run_once(index, options, searchx)
+
+    return list(await asyncio.gather(*(bounded(index) for index in range(runs))))
+
+
+def distribution(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "mean": round(sum(values) / len(values), 4) if values else 0.0,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def summarize(records: List[Dict[str, Any]], elapsed: float, args, options: Dict[str, Any], config: FakeConfig, store: FakeApifyStore, traced_peak: Optional[int]) -> Dict[str, Any]:
+    ok = [record for record in records if record["status"] == "ok"]
+    spans = defaultdict(list)
+    for record in ok:
+        for name, seconds in record.get("spans", {}).items():
+            spans[name].append(seconds)
+
+    return {
+        "commit": git_commit(),
+        "preset": args.preset,
+        "options": options,
+        "runs": len(records),
+        "concurrency": args.concurrency,
+        "fakes": config.to_dict(),
+        "errors": len(records) - len(ok),
+        "error_messages": sorted({record["error"] for record in records if record["status"] != "ok"}),
+        "wall_seconds": round(elapsed, 3),
+        "throughput_runs_per_minute": round(len(ok) / elapsed * 60, 3) if elapsed > 0 else 0.0,
+        "end_to_end": distribution([record["seconds"] for record in ok]),
+        "spans": {name: distribution(values) for name, values in sorted(spans.items())},
+        "llm_calls_per_run": distribution([record.get("llm_calls", 0) for record in ok]),
+        "apify_runs": store.runs,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_traced_mb": round(traced_peak / 1024 / 1024, 2) if traced_peak is not None else None,
+    }
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    def delta(value: float, previous: Optional[float]) -> str:
+        if previous in (None, 0):
+            return ""
+        return f" ({(value - previous) / previous * 100:+.1f}%)"
+
+    def previous(path: List[str]) -> Optional[float]:
+        node = baseline
+        for key in path:
+            if not isinstance(node, dict) or key not in node:
+                return None
+            node = node[key]
+        return node
+
+    print(f"\n--- Benchmark ({report['preset']}, commit {report['commit']}) ---")
+    if baseline is not None:
+        print(f"Compared with commit {baseline.get('commit')} ({baseline.get('preset')})")
+    print(f"Runs: {report['runs']} at concurrency {report['concurrency']}, {report['errors']} failed")
+    print(f"Throughput: {report['throughput_runs_per_minute']:.2f} runs/min{delta(report['throughput_runs_per_minute'], previous(['throughput_runs_per_minute']))}")
+    print(f"Peak RSS: {report['peak_rss_mb']} MB" + (f", peak traced: {report['peak_traced_mb']} MB" if report["peak_traced_mb"] is not None else ""))
+
+    rows = [("end_to_end", report["end_to_end"], ["end_to_end"])]
+    rows += [(name, stats, ["spans", name]) for name, stats in report["spans"].items()]
+    width = max(len(name) for name, _, _ in rows)
+    print(f"{'':{width}}  {'p50':>18}  {'p95':>18}  {'p99':>18}")
+    for name, stats, path in rows:
+        cells = [f"{stats[pct]:.3f}s{delta(stats[pct], previous(path + [pct]))}" for pct in ("p50", "p95", "p99")]
+        print(f"{name:{width}}  " + "  ".join(f"{cell:>18}" for cell in cells))
+    for message in report["error_messages"]:
+        print(f"Error: {message}")
+
+
+def parse_options(values: List[str]) -> Dict[str, Any]:
+    options = {}
+    for value in values:
+        key, _, raw = value.partition("=")
+        try:
+            options[key] = ast.literal_eval(raw)
+        except (ValueError, SyntaxError):
+            options[key] = raw
+    return options
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GiftSuggestionWorkflow offline against deterministic fakes.")
+    parser.add_argument("--runs", type=int, default=20, help="Number of workflow runs")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of runs in flight at the same time")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="baseline", help="Workflow options to benchmark")
+    parser.add_argument("--execution-mode", choices=["agent", "direct"], default="agent")
+    parser.add_argument("--option", action="append", default=[], metavar="NAME=VALUE", help="Extra GiftSuggestionWorkflow option, e.g. debate_concurrency=8")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--time-scale", type=float, default=0.02, help="Multiplier applied to every simulated latency")
+    parser.add_argument("--llm-latency", type=float, default=1.5, help="Median seconds per LLM call")
+    parser.add_argument("--agent-latency", type=float, default=4.5, help="Median seconds per agent chat")
+    parser.add_argument("--apify-latency", type=float, default=25.0, help="Median seconds per Apify actor run")
+    parser.add_argument("--toolhouse-latency", type=float, default=3.0, help="Median seconds per Toolhouse tool run")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability that any fake call raises")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Probability that an LLM or agent answer is unparseable")
+    parser.add_argument("--source-url-rate", type=float, default=1.0, help="Probability that a product item names the search URL it came from")
+    parser.add_argument("--trace-memory", action="store_true", help="Also report the tracemalloc peak (slows the runs down)")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Show the workflow's console output")
+    args = parser.parse_args()
+
+    config = FakeConfig(
+        seed=args.seed,
+        time_scale=args.time_scale,
+        llm=LatencyProfile(args.llm_latency, 0.4, args.error_rate),
+        agent=LatencyProfile(args.agent_latency, 0.4, args.error_rate),
+        apify=LatencyProfile(args.apify_latency, 0.3, args.error_rate),
+        toolhouse=LatencyProfile(args.toolhouse_latency, 0.3, args.error_rate),
+        malformed_rate=args.malformed_rate,
+        source_url_rate=args.source_url_rate,
+    )
+    store = FakeApifyStore(config)
+    options = {**PRESETS[args.preset], "execution_mode": args.execution_mode, **parse_options(args.option)}
+
+    if args.trace_memory:
+        tracemalloc.start()
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with install_fakes(config, store) as searchx, output:
+        start = time.perf_counter()
+        records = asyncio.run(run_suite(args.runs, args.concurrency, options, searchx))
+        elapsed = time.perf_counter() - start
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+
+    report = summarize(records, elapsed, args, options, config, store, traced_peak)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f"Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+)
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.llms.openai import OpenAI
+from llm_cache import CachedOpenAI, message_to_dict
+
+CASSETTE_VERSION = 1
+
+
+class CassetteMiss(KeyError):
+    pass
+
+
+class Cassette:
+    """Records LLM, tweet search and Apify responses to a gzipped JSON lines file and replays them.
+
+    Requests are matched on a hash of their content. Identical requests are replayed in the order
+    they were recorded, and the last recording keeps being served once they run out. In replay
+    mode latency="original" waits as long as the recorded call took and "zero" answers at once;
+    a request that was never recorded raises CassetteMiss, or goes to the real service with
+    on_miss="live".
+    """
+
+    def __init__(self, path: str, mode: str = "replay", latency: str = "original", on_miss: str = "error"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if latency not in ("original", "zero"):
+            raise ValueError(f"Unknown cassette latency: {latency}")
+        if on_miss not in ("error", "live"):
+            raise ValueError(f"Unknown cassette on_miss: {on_miss}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.on_miss = on_miss
+        self.counts = defaultdict(int)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._recorded = []
+        self._file_started = False
+        self._entries = defaultdict(deque)
+        if mode == "replay":
+            self.load()
+
+    @staticmethod
+    def make_key(kind: str, request: Any) -> str:
+        return hashlib.sha256(json.dumps([kind, request], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as cassette_file:
+            header = json.loads(cassette_file.readline())
+            if header.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"Unsupported cassette version: {header.get('version')}")
+            for line in cassette_file:
+                entry = json.loads(line)
+                self._entries[entry["key"]].append(entry)
+
+    def save(self):
+        """Writes the entries recorded since the last save and drops them from memory.
+
+        The first save starts a new file; later ones append a gzip member, which gzip readers
+        read as part of the same stream.
+        """
+        if self.mode != "record":
+            return
+        with self._save_lock:
+            with self._lock:
+                entries, self._recorded = self._recorded, []
+            if self._file_started and not entries:
+                return
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            try:
+                with gzip.open(self.path, "at" if self._file_started else "wt", encoding="utf-8") as cassette_file:
+                    if not self._file_started:
+                        cassette_file.write(json.dumps({"version": CASSETTE_VERSION, "created_at": time.time()}) + "\n")
+                    for entry in entries:
+                        cassette_file.write(json.dumps(entry, separators=(",", ":"), default=str) + "\n")
+            except Exception:
+                # Keep the entries for the next save
+                with self._lock:
+                    self._recorded = entries + self._recorded
+                raise
+            self._file_started = True
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+    def _take(self, kind: str, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.counts[f"{kind}_missed"] += 1
+                return None
+            self.counts[f"{kind}_replayed"] += 1
+            return entries.popleft() if len(entries) > 1 else entries[0]
+
+    def _add(self, kind: str, key: str, request: Any, response: Any, latency: float):
+        preview = json.dumps(request, default=str)[:200]
+        with self._lock:
+            self.counts[f"{kind}_recorded"] += 1
+            self._recorded.append({"kind": kind, "key": key, "request": preview, "latency": round(latency, 3), "response": response})
+
+    def _replay_delay(self, entry: Dict[str, Any]) -> float:
+        return entry["latency"] if self.latency == "original" else 0.0
+
+    def _miss(self, kind: str, request: Any):
+        if self.on_miss == "error":
+            raise CassetteMiss(f"No recorded {kind} response for {json.dumps(request, default=str)[:200]}")
+        with self._lock:
+            self.counts[f"{kind}_live"] += 1
+
+    def call(self, kind: str, request: Any, fn: Callable[[], Any]) -> Any:
+        """Returns fn()'s JSON-serializable result, recording or replaying it."""
+        key = self.make_key(kind, request)
+        if self.mode == "replay":
+            entry = self._take(kind, key)
+            if entry is not None:
+                time.sleep(self._replay_delay(entry))
+                return entry["response"]
+            self._miss(kind, request)
+            return fn()
+
+        start = time.perf_counter()
+        response = fn()
+        self._add(kind, key, request, response, time.perf_counter() - start)
+        return response
+
+    async def acall(self, kind: str, request: Any, fn: Callable[[], Awaitable[Any]]) -> Any:
+        key = self.make_key(kind, request)
+        if self.mode == "replay":
+            entry = self._take(kind, key)
+            if entry is not None:
+                await asyncio.sleep(self._replay_delay(entry))
+                return entry["response"]
+            self._miss(kind, request)
+            return await fn()
+
+        start = time.perf_counter()
+        response = await fn()
+        self._add(kind, key, request, response, time.perf_counter() - start)
+        return response
+
+
+class CassetteOpenAI(OpenAI):
+    """OpenAI LLM whose chat and completion calls go through a Cassette.
+
+    Streaming calls are recorded as their final response, so while recording their chunks are
+    only passed on once the response is complete, and are replayed as a single chunk.
+    """
+
+    _cassette: Cassette = PrivateAttr()
+
+    def __init__(self, cassette: Cassette, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._cassette = cassette
+
+    def _chat_request(self, messages: Sequence[ChatMessage], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "temperature": self.temperature,
+            "messages": [message_to_dict(message) for message in messages],
+            "kwargs": json.loads(json.dumps(kwargs, sort_keys=True, default=str)),
+        }
+
+    def _complete_request(self, prompt: str, formatted: bool, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "temperature": self.temperature,
+            "system_prompt": self.system_prompt,
+            "prompt": prompt,
+            "formatted": formatted,
+            "kwargs": json.loads(json.dumps(kwargs, sort_keys=True, default=str)),
+        }
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        parent_chat = super().chat
+        data = self._cassette.call(
+            "llm",
+            self._chat_request(messages, kwargs),
+            lambda: CachedOpenAI._chat_response_to_dict(parent_chat(messages, **kwargs))
+        )
+        return CachedOpenAI._chat_response_from_dict(data)
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        parent_achat = super().achat
+
+        async def fetch():
+            return CachedOpenAI._chat_response_to_dict(await parent_achat(messages, **kwargs))
+
+        return CachedOpenAI._chat_response_from_dict(await self._cassette.acall("llm", self._chat_request(messages, kwargs), fetch))
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        parent_complete = super().complete
+        data = self._cassette.call(
+            "llm",
+            self._complete_request(prompt, formatted, kwargs),
+            lambda: CachedOpenAI._completion_response_to_dict(parent_complete(prompt, formatted=formatted, **kwargs))
+        )
+        return CachedOpenAI._completion_response_from_dict(data)
+
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        parent_acomplete = super().acomplete
+
+        async def fetch():
+            return CachedOpenAI._completion_response_to_dict(await parent_acomplete(prompt, formatted=formatted, **kwargs))
+
+        return CachedOpenAI._completion_response_from_dict(
+            await self._cassette.acall("llm", self._complete_request(prompt, formatted, kwargs), fetch)
+        )
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        chunks = []
+        parent_astream_chat = super().astream_chat
+
+        async def fetch():
+            response = None
+            async for response in await parent_astream_chat(messages, **kwargs):
+                chunks.append(response)
+            return CachedOpenAI._chat_response_to_dict(response) if response is not None else None
+
+        data = await self._cassette.acall("llm", self._chat_request(messages, kwargs), fetch)
+
+        async def gen() -> ChatResponseAsyncGen:
+            if chunks:
+                for chunk in chunks:
+                    yield chunk
+            elif data is not None:
+                response = CachedOpenAI._chat_response_from_dict(data)
+                response.delta = response.message.content
+                yield response
+
+        return gen()
+
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        chunks = []
+        parent_astream_complete = super().astream_complete
+
+        async def fetch():
+            response = None
+            async for response in await parent_astream_complete(prompt, formatted=formatted, **kwargs):
+                chunks.append(response)
+            return CachedOpenAI._completion_response_to_dict(response) if response is not None else None
+
+        data = await self._cassette.acall("llm", self._complete_request(prompt, formatted, kwargs), fetch)
+
+        async def gen() -> CompletionResponseAsyncGen:
+            if chunks:
+                for chunk in chunks:
+                    yield chunk
+            elif data is not None:
+                response = CachedOpenAI._completion_response_from_dict(data)
+                response.delta = response.text
+                yield response
+
+        return gen()
@@ -0,0 +1,99 @@
+import re
+import traceback
+from typing import List, Optional, Sequence
+import numpy as np
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+async def aembed_texts(embed_model, texts: Sequence[str]) -> np.ndarray:
+    """Embeds texts in one batched request; rows are unit length so dot products are cosine similarities."""
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    vectors = await embed_model.aget_text_embedding_batch(list(texts))
+    return normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+
+def tokens(text: str) -> set:
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def lexical_similarity(a: str, b: str) -> float:
+    """Jaccard overlap of the word sets, the stand-in for cosine similarity when embeddings fail."""
+    a_tokens, b_tokens = tokens(a), tokens(b)
+    if not a_tokens or not b_tokens:
+        return 0.0
+    return len(a_tokens & b_tokens) / len(a_tokens | b_tokens)
+
+
+def split_interests(interests: str) -> List[str]:
+    """The interests of tweet_analyzer's comma or line separated answer."""
+    parts = [part.strip(" -*.\t") for part in re.split(r"[,\n]", interests or "")]
+    return [part for part in parts if part]
+
+
+async def relevance_scores(embed_model, queries: Sequence[str], texts: Sequence[str]) -> np.ndarray:
+    """Each text's highest cosine similarity to any of the queries.
+
+    Queries and texts are embedded in one batched request and scored with a single matrix
+    product. If embed_model is None or the request fails, word overlap is used instead.
+    """
+    if not texts:
+        return np.zeros(0, dtype=np.float32)
+    if not queries:
+        return np.zeros(len(texts), dtype=np.float32)
+    if embed_model is not None:
+        try:
+            vectors = await aembed_texts(embed_model, list(queries) + list(texts))
+            return (vectors[len(queries):] @ vectors[:len(queries)].T).max(axis=1)
+        except Exception as e:
+            print(f"Error embedding for relevance, falling back to word overlap: {str(e)}")
+            traceback.print_exc()
+    return np.array([max(lexical_similarity(text, query) for query in queries) for text in texts], dtype=np.float32)
+
+
+class NoveltyTracker:
+    """Scores how much each new batch of texts adds to the texts seen before it.
+
+    A text's novelty is 1 minus its highest similarity to any earlier text, and add() returns the
+    mean over the batch. Similarity is the cosine of the texts' embeddings; if embed_model is None
+    or a request fails, word overlap is used from then on.
+    """
+
+    def __init__(self, embed_model=None):
+        self.embed_model = embed_model
+        self.texts: List[str] = []
+        self.vectors: Optional[np.ndarray] = None
+
+    async def _embed(self, texts: List[str]) -> Optional[np.ndarray]:
+        if self.embed_model is None:
+            return None
+        try:
+            return await aembed_texts(self.embed_model, texts)
+        except Exception as e:
+            print(f"Error embedding arguments, falling back to word overlap: {str(e)}")
+            traceback.print_exc()
+            self.embed_model = None
+            self.vectors = None
+            return None
+
+    async def add(self, texts: List[str]) -> float:
+        texts = [text for text in texts if text and text.strip()]
+        if not texts:
+            return 0.0
+        vectors = await self._embed(texts)
+
+        if not self.texts:
+            novelty = 1.0
+        elif vectors is not None and self.vectors is not None:
+            novelty = float(np.mean(1.0 - (vectors @ self.vectors.T).max(axis=1)))
+        else:
+            novelty = float(np.mean([1.0 - max(lexical_similarity(text, earlier) for earlier in self.texts) for text in texts]))
+
+        self.texts.extend(texts)
+        if vectors is not None:
+            self.vectors = vectors if self.vectors is None else np.vstack([self.vectors, vectors])
+        return novelty
@@ -0,0 +1,103 @@
+import re
+import traceback
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from embeddings import aembed_texts, lexical_similarity
+
+POSITIVE_WORDS = {
+    "perfect", "great", "ideal", "useful", "practical", "thoughtful", "unique", "personal", "love", "loves",
+    "enjoy", "enjoys", "appreciate", "fun", "versatile", "quality", "durable", "memorable", "delight",
+    "delightful", "beautiful", "special", "excellent", "affordable", "valuable", "meaningful", "aligns",
+    "matches", "passion", "favorite", "convenient", "popular", "creative", "relaxing",
+}
+NEGATIVE_WORDS = {
+    "expensive", "impractical", "generic", "boring", "unnecessary", "useless", "cheap", "fragile", "bulky",
+    "already", "duplicate", "misaligned", "inappropriate", "unlikely", "risk", "risky", "waste", "clutter",
+    "niche", "hard", "difficult", "complicated", "impersonal", "unwanted", "error", "lacks", "lack",
+    "overpriced", "outdated", "limited",
+}
+
+
+def argument_sentiment(text: str) -> float:
+    """Share of positive minus share of negative lexicon words, from -1 to 1."""
+    words = re.findall(r"[a-z']+", (text or "").lower())
+    positive = sum(word in POSITIVE_WORDS for word in words)
+    negative = sum(word in NEGATIVE_WORDS for word in words)
+    if positive + negative == 0:
+        return 0.0
+    return (positive - negative) / (positive + negative)
+
+
+class LocalGiftSelector:
+    """Picks the final gifts from the debates without an LLM call.
+
+    Each gift's quality is its relevance to the interests (highest cosine similarity of the gift
+    and its pro argument to any interest) blended with the sentiment of its whole debate. Gifts
+    are then taken by maximal marginal relevance, so a gift too similar to one already picked
+    loses diversity_weight times that similarity. Embeddings are requested in one batch; without
+    embed_model, or if the request fails, word overlap stands in for cosine similarity.
+    """
+
+    def __init__(self, embed_model=None, relevance_weight: float = 0.7, diversity_weight: float = 0.3):
+        self.embed_model = embed_model
+        self.relevance_weight = relevance_weight
+        self.diversity_weight = diversity_weight
+
+    async def _similarities(self, interests: Sequence[str], texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(text x interest, text x text) similarity matrices."""
+        if self.embed_model is not None:
+            try:
+                vectors = await aembed_texts(self.embed_model, list(interests) + list(texts))
+                interest_vectors, text_vectors = vectors[:len(interests)], vectors[len(interests):]
+                return text_vectors @ interest_vectors.T, text_vectors @ text_vectors.T
+            except Exception as e:
+                print(f"Error embedding gifts for selection, falling back to word overlap: {str(e)}")
+                traceback.print_exc()
+        relevance = np.array([[lexical_similarity(text, interest) for interest in interests] for text in texts], dtype=np.float32)
+        similarity = np.array([[lexical_similarity(a, b) for b in texts] for a in texts], dtype=np.float32)
+        return relevance.reshape(len(texts), len(interests)), similarity
+
+    async def _score(self, debates: Dict[str, Dict[str, str]], interests: List[str]) -> Tuple[List[Dict], np.ndarray]:
+        """Per gift, in debate order, its relevance, best matching interest, sentiment and quality; and the gift similarities."""
+        gifts = list(debates)
+        if not gifts:
+            return [], np.zeros((0, 0), dtype=np.float32)
+        texts = [f"{gift}. {debates[gift].get('pro', '')}" for gift in gifts]
+        relevance, similarity = await self._similarities(interests or [""], texts)
+        scores = []
+        for i, gift in enumerate(gifts):
+            debate = debates[gift]
+            sentiment = argument_sentiment(f"{debate.get('pro', '')} {debate.get('con', '')}")
+            gift_relevance = float(relevance[i].max()) if interests else 0.0
+            scores.append({
+                "gift": gift,
+                "relevance": round(gift_relevance, 4),
+                "interest": interests[int(np.argmax(relevance[i]))] if gift_relevance > 0 else None,
+                "sentiment": round(sentiment, 4),
+                "quality": round(self.relevance_weight * gift_relevance + (1 - self.relevance_weight) * (sentiment + 1) / 2, 4),
+            })
+        return scores, similarity
+
+    async def select(self, debates: Dict[str, Dict[str, str]], interests: List[str], k: int = 5) -> List[Dict]:
+        """The k gifts picked by maximal marginal relevance, best first."""
+        scores, similarity = await self._score(debates, interests)
+        if not scores:
+            return []
+        quality = np.array([score["quality"] for score in scores], dtype=np.float32)
+        selected: List[int] = []
+        remaining = list(range(len(scores)))
+        while remaining and len(selected) < k:
+            if selected:
+                redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining), dtype=np.float32)
+            mmr = quality[remaining] - self.diversity_weight * redundancy
+            best = remaining[int(np.argmax(mmr))]
+            selected.append(best)
+            remaining.remove(best)
+        return [scores[i] for i in selected]
+
+    @staticmethod
+    def reasoning(score: Dict, debate: Dict[str, str]) -> str:
+        match = f"Matches the interest in {score['interest']}" if score["interest"] else "Well supported in its debate"
+        return f"{match} (relevance {score['relevance']:.2f}, debate sentiment {score['sentiment']:+.2f}). {debate.get('pro', '')[:200]}"
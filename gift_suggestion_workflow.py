@@ -15,16 +15,136 @@ from llama_index.core.workflow import (
 )
 from llama_index.core.agent import FunctionCallingAgentWorker
 from llama_index.core.tools import FunctionTool
+from llama_index.core.bridge.pydantic import BaseModel
+from llama_index.core.prompts import PromptTemplate
+from llama_index.core.base.llms.types import MessageRole
+from llm_cache import LLMResponseCache
+from product_cache import ProductSearchCache
+from log_sink import LogSink, set_run_id, current_run_id
+from instrumentation import RunMetrics, install_llm_instrumentation, count_tokens
+from cassette import Cassette
+from resource_pool import get_resource_pool
+from embeddings import NoveltyTracker, relevance_scores, split_interests
+from gift_selector import LocalGiftSelector
 import sys
 import ast
 import traceback
-from typing import List, Dict, Optional
+from typing import Any, AsyncIterator, Callable, List, Dict, Optional, Tuple
 from llama_index.core.workflow import Event
 import sys
 import json
+import time
 import random
+import functools
+import contextlib
+import numpy as np
 
 
+TWEET_CATEGORIES_PROMPT = """Analyze the following tweets and categorize them into interest areas or activities. 
+If you can't determine specific interests, use these default categories: Technology,  Self-Care, Travel, Food, Fitness.
+Provide a comma-separated list of at least 5 categories:
+
+Tweets:
+{tweets}
+
+Categories:"""
+
+GIFT_CATEGORIES_PROMPT = """For each of the following interest categories, suggest potential gift categories.
+If the interests are unclear, use these default gift categories: 
+'specialty dark chocolate','premium coffee','charcuterie board items','perishable boutique pantry items'.
+Provide a comma-separated list of at least 10 gift categories:
+
+Interest categories:
+{interests}
+
+Gift categories:"""
+
+GIFT_IDEAS_PROMPT = """Based on the following user-specific information:
+
+Interests: {interests}
+Tweets: {tweets}
+Gift Categories: {gift_categories}
+
+Generate unique and specific gift ideas under ${price_ceiling}. 
+Focus on items that are:
+1. Directly related to the user's interests and gift categories
+2. Unique and not commonly found in regular stores
+3. Specific to the person's interests, avoiding generic items
+4. Preferably from local artisans, small businesses, or specialty shops
+5. Include a mix of physical items and experiences
+6. Aim for a total of 10 gift ideas across all categories
+
+Present your suggestions as a Python dictionary where keys are categories and values are lists of gift ideas.
+Each gift idea should be a string in the format "Category: Gift Idea".
+Ensure that each gift idea is tailored to the user's specific interests and not generic.
+Do not use any default suggestions.
+
+Gift Ideas:"""
+
+CON_ARGUMENT_PROMPT = """Argue against the following gift idea as a Christmas gift under ${price_ceiling} in 300 characters or less. 
+Consider factors like potential misalignment with recipient's interests, lack of practicality, inappropriateness, or reasons the recipient might not appreciate the gift.
+
+Gift idea: {gift_idea}
+
+Provide a concise argument against this gift:"""
+
+PRO_ARGUMENT_PROMPT = """Argue in favor of the following gift idea as a Christmas gift under ${price_ceiling} in 300 characters or less. 
+Consider factors like alignment with recipient's interests, practicality, appropriateness, and reasons the recipient might appreciate the gift.
+Address the previous argument against the gift.
+
+Gift idea: {gift_idea}
+Previous argument against: {previous_argument}
+
+Provide a concise argument in favor of this gift:"""
+
+FINAL_SELECTION_PROMPT = """Given the following debates about gift ideas, provide a final reasoned selection of the top 5 gift ideas. 
+Consider factors such as uniqueness, practicality, and how well they match the recipient's interests. 
+Present your selection as a Python list of strings, where each string is in the format "Gift Idea: Reasoning".
+
+Debates:
+{debates}
+
+Final Selection:"""
+
+AMAZON_KEYWORDS_PROMPT = """Based on the following gift ideas, generate Amazon search keywords. 
+Each keyword should be a short phrase suitable for searching on Amazon, 
+and should include "under ${price_ceiling}" or a similar price qualifier.
+
+Gift ideas:
+{gift_ideas}
+
+Provide a Python list of 3 search keywords:"""
+
+GIFT_KEYWORD_PROMPT = """Based on the following gift idea, generate one Amazon search keyword.
+The keyword should be a short phrase suitable for searching on Amazon,
+and should include "under ${price_ceiling}" or a similar price qualifier.
+
+Gift idea:
+{gift_idea}
+
+Respond with only the search keyword:"""
+
+DEBATE_PROMPT = """Debate the following gift idea as a Christmas gift under ${price_ceiling}.
+First argue against it in 300 characters or less, considering potential misalignment with recipient's interests, lack of practicality, inappropriateness, or reasons the recipient might not appreciate the gift.
+Then argue in favor of it in 300 characters or less, addressing the argument against and considering alignment with recipient's interests, practicality and appropriateness.
+
+Gift idea: {gift_idea}"""
+
+BATCH_DEBATE_PROMPT = """You are debating several gift ideas for a Christmas gift under ${price_ceiling}.
+{instructions}
+Keep every argument concise and persuasive, within 300 characters.
+
+Gift ideas:
+{gift_ideas}
+
+Respond only with a JSON object whose keys are the gift ideas exactly as given above and whose values are objects with a "con" and a "pro" string, for example:
+{{"<gift idea>": {{"con": "<argument against>", "pro": "<argument for>"}}}}"""
+
+
+# gift_debater's rounds as (one_sentence, include_con): 3 back-and-forth rounds (no con in the
+# last one), then 3 rounds of one-sentence arguments
+DEBATE_ROUNDS = [(False, True), (False, True), (False, False), (True, True), (True, True), (True, True)]
+
 class InitializeEvent(Event):
     pass
 
@@ -64,26 +184,220 @@ class ProductLinkEvent(Event):
     product_image: str
     product_links: str
 
+# Structured outputs used by the "direct" execution mode, where each step is a single LLM call
+class TweetInterests(BaseModel):
+    """Interest areas or activities identified from a user's tweets."""
+    interests: List[str]
+
+class GiftCategories(BaseModel):
+    """Gift categories that match a user's interests."""
+    categories: List[str]
+
+class GiftIdeas(BaseModel):
+    """Specific gift ideas grouped by gift category."""
+    gift_ideas: Dict[str, List[str]]
+
+class GiftDebate(BaseModel):
+    """A short argument against a gift idea followed by an argument in favor of it."""
+    con: str
+    pro: str
+
+class GiftSelection(BaseModel):
+    """A selected gift idea and the reasoning behind it."""
+    gift: str
+    reasoning: str
+
+class FinalGiftSelection(BaseModel):
+    """The final reasoned selection of the top gift ideas."""
+    selections: List[GiftSelection]
+
+class AmazonKeywords(BaseModel):
+    """Amazon search keywords, each including a price qualifier."""
+    keywords: List[str]
+
+def timed_step(fn):
+    """Records the step as a span on the run's metrics when the workflow collects them."""
+    @functools.wraps(fn)
+    async def wrapper(self, ctx: Context, ev):
+        metrics = self.run_metrics(ctx)
+        if metrics is None:
+            return await fn(self, ctx, ev)
+        with metrics.span("step", fn.__name__):
+            return await fn(self, ctx, ev)
+    return wrapper
+
 class GiftSuggestionWorkflow(Workflow):
-    def __init__(self, price_ceiling: float, log_print_func, *args, **kwargs):
+    def __init__(
+        self,
+        price_ceiling: float,
+        log_print_func,
+        *args,
+        concurrent_debates: bool = False,
+        debate_concurrency: int = 5,
+        batch_debates: bool = False,
+        debate_batch_size: int = 5,
+        debate_memory: str = "shared",
+        debate_memory_window: int = 8,
+        adaptive_debates: bool = False,
+        debate_min_novelty: float = 0.1,
+        debate_call_budget: Optional[int] = 6,
+        embed_model=None,
+        debate_top_k: Optional[int] = None,
+        score_gift_ideas: bool = False,
+        gift_selector: str = "llm",
+        gift_selector_shortlist: int = 8,
+        gift_selector_model: str = "gpt-4o-mini",
+        execution_mode: str = "agent",
+        llm_cache: Optional[LLMResponseCache] = None,
+        product_lookup_concurrency: int = 3,
+        product_lookup_timeout: Optional[float] = 180,
+        product_cache: Optional[ProductSearchCache] = None,
+        batch_product_lookups: bool = False,
+        batch_lookup_timeout: Optional[float] = 300,
+        amazon_marketplace: str = "www.amazon.com",
+        stream_callback: Optional[Callable[[str, str, str], None]] = None,
+        pipeline_products: bool = False,
+        speculative_prefetch: bool = False,
+        prefetch_concurrency: int = 2,
+        prefetch_max_lookups: int = 10,
+        collect_metrics: bool = False,
+        cassette: Optional[Cassette] = None,
+        **kwargs
+    ):
         super().__init__(*args, **kwargs)
+        if execution_mode not in ("agent", "direct"):
+            raise ValueError(f"Unknown execution_mode: {execution_mode}")
+        if debate_memory not in ("shared", "per_gift", "window"):
+            raise ValueError(f"Unknown debate_memory: {debate_memory}")
+        if gift_selector not in ("llm", "local", "fallback", "prefilter"):
+            raise ValueError(f"Unknown gift_selector: {gift_selector}")
         self.price_ceiling = price_ceiling
         self.log_print = log_print_func
+        # "agent" routes each step through a FunctionCallingAgentWorker whose tool calls the LLM again,
+        # "direct" makes one structured LLM call per step
+        self.execution_mode = execution_mode
+        self.llm_cache = llm_cache
+        # Amazon lookups for all keywords run at once, at most product_lookup_concurrency actor runs at a time
+        self.product_lookup_concurrency = max(1, product_lookup_concurrency)
+        self.product_lookup_timeout = product_lookup_timeout
+        self.product_cache = product_cache
+        # Look up all keywords in a single Apify actor run instead of one run per keyword
+        self.batch_product_lookups = batch_product_lookups
+        self.batch_lookup_timeout = batch_lookup_timeout
+        self.amazon_marketplace = amazon_marketplace
+        # Called as stream_callback(step_name, stream_id, text_so_far) while an LLM call is generating
+        self.stream_callback = stream_callback
+        # Take each selected gift through keyword generation and product lookup on its own
+        # instead of waiting for every gift at each stage
+        self.pipeline_products = pipeline_products
+        # Start keyword and product lookups for every gift idea while the debates run.
+        # Only the per-gift pipeline can pick up the prefetched results.
+        if speculative_prefetch and not pipeline_products:
+            raise ValueError("speculative_prefetch requires pipeline_products")
+        # The per-gift pipeline looks each product up as its gift comes in, so there is no batch to make
+        if batch_product_lookups and pipeline_products:
+            raise ValueError("batch_product_lookups cannot be combined with pipeline_products")
+        self.speculative_prefetch = speculative_prefetch
+        self.prefetch_concurrency = max(1, prefetch_concurrency)
+        self.prefetch_max_lookups = prefetch_max_lookups
+        # Debate every gift idea at once (bounded by debate_concurrency) instead of one after another
+        self.concurrent_debates = concurrent_debates
+        self.debate_concurrency = max(1, debate_concurrency)
+        # Debate debate_batch_size gift ideas per LLM request, falling back to single-gift debates for bad items
+        self.batch_debates = batch_debates
+        self.debate_batch_size = max(1, debate_batch_size)
+        # What the shared con/pro debate agents remember between messages: "shared" keeps every earlier
+        # gift's arguments, "per_gift" clears their memory before each gift and "window" keeps only the
+        # last debate_memory_window messages, so a debate call's input no longer grows with the gift count
+        self.debate_memory = debate_memory
+        self.debate_memory_window = max(1, debate_memory_window)
+        # Stop a gift's gift_debater rounds once a round's arguments are less than debate_min_novelty away
+        # (1 - cosine similarity) from the gift's earlier arguments, or when the next round would take the
+        # gift past debate_call_budget agent calls. The rounds each gift used are kept in ctx.data["debate_rounds"].
+        # Gifts are debated with their own agents, like concurrent_debates, at most debate_concurrency at a time.
+        # run_pipeline runs these rounds between mediation_agent and gift_reasoner.
+        if adaptive_debates and batch_debates:
+            raise ValueError("adaptive_debates stops each gift's rounds on its own and cannot be combined with batch_debates")
+        self.adaptive_debates = adaptive_debates
+        self.debate_min_novelty = debate_min_novelty
+        self.debate_call_budget = debate_call_budget
+        # Embeds debate arguments and gift ideas; defaults to the resource pool's OpenAI embedding model
+        self.embed_model = embed_model
+        # Only debate the debate_top_k gift ideas closest to the identified interests; None debates them all
+        self.debate_top_k = debate_top_k
+        # Score every gift idea's relevance to the interests even when debate_top_k keeps them all, for display
+        self.score_gift_ideas = score_gift_ideas
+        # How gift_reasoner picks the final gifts: "llm" asks the LLM (retrying, then picking at random),
+        # "local" scores the debates with LocalGiftSelector instead, "fallback" asks the LLM once and uses
+        # the local selector if its answer is unusable, and "prefilter" has the local selector shortlist
+        # gift_selector_shortlist gifts for a single structured call to gift_selector_model
+        self.gift_selector = gift_selector
+        self.gift_selector_shortlist = max(1, gift_selector_shortlist)
+        self.gift_selector_model = gift_selector_model
+        # Record wall time, queue wait, tokens and cost of every step, LLM call and Apify call in ctx.data["metrics"]
+        self.collect_metrics = collect_metrics
+        # Record or replay every LLM and Apify call; takes the place of llm_cache for the LLM
+        self.cassette = cassette
+        if collect_metrics:
+            install_llm_instrumentation()
+
+    def run_metrics(self, ctx: Context) -> Optional[RunMetrics]:
+        if not self.collect_metrics:
+            return None
+        if "metrics" not in ctx.data:
+            ctx.data["metrics"] = RunMetrics(run_id=current_run_id.get())
+        return ctx.data["metrics"]
+
+    def span(self, ctx: Context, kind: str, name: str, queued_at: Optional[float] = None, parent: Optional[str] = None, **attributes):
+        metrics = self.run_metrics(ctx)
+        if metrics is None:
+            return contextlib.nullcontext({})
+        return metrics.span(kind, name, queued_at=queued_at, parent=parent, **attributes)
 
     def create_agent(self, ctx: Context, tools: List[callable], system_prompt: str):
-        function_tools = [FunctionTool.from_defaults(fn=tool) for tool in tools]
-        agent_worker = FunctionCallingAgentWorker.from_tools(
-            tools=function_tools,
-            llm=ctx.data["llm"],
-            allow_parallel_tool_calls=False,
-            system_prompt=system_prompt
-        )
-        return agent_worker.as_agent()
+        # Checked out of the process-wide pool; release_agents hands it back once the run is done
+        agent = get_resource_pool().agent(ctx.data["llm"], tools, system_prompt)
+        ctx.data.setdefault("pooled_agents", []).append(agent)
+        return agent
+
+    def release_agents(self, ctx: Context):
+        get_resource_pool().release(ctx.data.pop("pooled_agents", []))
+
+    @staticmethod
+    def create_function_tool(tool: callable) -> FunctionTool:
+        # Coroutine tools are registered as the async implementation so agent.achat never blocks the event loop
+        if asyncio.iscoroutinefunction(tool):
+            return FunctionTool.from_defaults(async_fn=tool)
+        return FunctionTool.from_defaults(fn=tool)
+
+    async def complete_prompt(self, ctx: Context, prompt: str, step_name: Optional[str], stream_id: str = ""):
+        if self.stream_callback is None or step_name is None:
+            return await ctx.data["llm"].acomplete(prompt)
+
+        response = None
+        async for response in await ctx.data["llm"].astream_complete(prompt):
+            self.stream_callback(step_name, stream_id, response.text)
+        return response
+
+    async def direct_predict(self, ctx: Context, output_cls, prompt: str, step_name: Optional[str] = None, stream_id: str = "", llm=None, **prompt_args):
+        llm = llm or ctx.data["llm"]
+        if self.stream_callback is None or step_name is None:
+            return await llm.astructured_predict(output_cls, PromptTemplate(prompt), **prompt_args)
+
+        partial = None
+        async for partial in await llm.astream_structured_predict(output_cls, PromptTemplate(prompt), **prompt_args):
+            self.stream_callback(step_name, stream_id, partial.model_dump_json(indent=2))
+        if partial is None:
+            self.log_print(f"Nothing was streamed for {step_name}. Retrying without streaming.")
+            return await llm.astructured_predict(output_cls, PromptTemplate(prompt), **prompt_args)
+        # The streamed objects are partial copies, so validate the last one against the real output class
+        return output_cls.model_validate(partial.model_dump())
 
     @step(pass_context=True)
+    @timed_step
     async def initialize(self, ctx: Context, ev: StartEvent) -> TweetAnalyzerEvent:
         self.log_print("Step: Initialize and Get Tweets")
-        ctx.data["llm"] = OpenAI(model="gpt-4", temperature=0.4)
+        ctx.data["llm"] = get_resource_pool().llm(llm_cache=self.llm_cache, cassette=self.cassette, model="gpt-4", temperature=0.4)
         
         raw_tweets = ctx.data.get("tweets", [])
         processed_tweets = []
@@ -113,19 +427,20 @@ class GiftSuggestionWorkflow(Workflow):
         return TweetAnalyzerEvent(tweets=processed_tweets)
 
     @step(pass_context=True)
+    @timed_step
     async def tweet_analyzer(self, ctx: Context, ev: TweetAnalyzerEvent) -> InterestMapperEvent:
         self.log_print("Step: Tweet Analyzer")
-        if "tweet_analyzer_agent" not in ctx.data:
-            def categorize_tweets(tweets: List[str]) -> str:
-                prompt = f"""Analyze the following tweets and categorize them into interest areas or activities. 
-                If you can't determine specific interests, use these default categories: Technology,  Self-Care, Travel, Food, Fitness.
-                Provide a comma-separated list of at least 5 categories:
-
-                Tweets:
-                {tweets}
+        if self.execution_mode == "direct":
+            result = await self.direct_predict(ctx, TweetInterests, TWEET_CATEGORIES_PROMPT, "tweet_analyzer", "Interests", tweets=ev.tweets)
+            interests = ", ".join(result.interests)
+            self.log_print(f"Interests identified: {interests}")
+            ctx.data["identified_interests"] = interests
+            return InterestMapperEvent(interests=interests)
 
-                Categories:"""
-                response = ctx.data["llm"].complete(prompt)
+        if "tweet_analyzer_agent" not in ctx.data:
+            async def categorize_tweets(tweets: List[str]) -> str:
+                prompt = TWEET_CATEGORIES_PROMPT.format(tweets=tweets)
+                response = await self.complete_prompt(ctx, prompt, "tweet_analyzer", "Interests")
                 return str(response).strip()
 
             system_prompt = """
@@ -137,25 +452,25 @@ class GiftSuggestionWorkflow(Workflow):
 
             ctx.data["tweet_analyzer_agent"] = self.create_agent(ctx, [categorize_tweets], system_prompt)
 
-        interests = ctx.data["tweet_analyzer_agent"].chat(f"Analyze these tweets: {ev.tweets}")
+        interests = await ctx.data["tweet_analyzer_agent"].achat(f"Analyze these tweets: {ev.tweets}")
         self.log_print(f"Interests identified: {str(interests)}")
+        ctx.data["identified_interests"] = str(interests)
         return InterestMapperEvent(interests=str(interests))
 
     @step(pass_context=True)
+    @timed_step
     async def interest_mapper(self, ctx: Context, ev: InterestMapperEvent) -> GiftIdeaGeneratorEvent:
         self.log_print("Step: Interest Mapper")
-        if "interest_mapper_agent" not in ctx.data:
-            def map_interests_to_gift_categories(interests: str) -> str:
-                prompt = f"""For each of the following interest categories, suggest potential gift categories.
-                If the interests are unclear, use these default gift categories: 
-                'specialty dark chocolate','premium coffee','charcuterie board items','perishable boutique pantry items'.
-                Provide a comma-separated list of at least 10 gift categories:
-
-                Interest categories:
-                {interests}
+        if self.execution_mode == "direct":
+            result = await self.direct_predict(ctx, GiftCategories, GIFT_CATEGORIES_PROMPT, "interest_mapper", "Gift categories", interests=ev.interests)
+            gift_categories = ", ".join(result.categories)
+            self.log_print(f"Gift Categories: {gift_categories}")
+            return GiftIdeaGeneratorEvent(gift_categories=gift_categories)
 
-                Gift categories:"""
-                response = ctx.data["llm"].complete(prompt)
+        if "interest_mapper_agent" not in ctx.data:
+            async def map_interests_to_gift_categories(interests: str) -> str:
+                prompt = GIFT_CATEGORIES_PROMPT.format(interests=interests)
+                response = await self.complete_prompt(ctx, prompt, "interest_mapper", "Gift categories")
                 return str(response).strip()
 
             system_prompt = """
@@ -168,38 +483,42 @@ class GiftSuggestionWorkflow(Workflow):
 
             ctx.data["interest_mapper_agent"] = self.create_agent(ctx, [map_interests_to_gift_categories], system_prompt)
 
-        gift_categories = ctx.data["interest_mapper_agent"].chat(f"Map these interests to gift categories: {ev.interests}")
+        gift_categories = await ctx.data["interest_mapper_agent"].achat(f"Map these interests to gift categories: {ev.interests}")
         self.log_print(f"Gift Categories: {str(gift_categories)}")
         return GiftIdeaGeneratorEvent(gift_categories=str(gift_categories))
 
     @step(pass_context=True)
+    @timed_step
     async def gift_idea_generator(self, ctx: Context, ev: GiftIdeaGeneratorEvent) -> MediationEvent:
         self.log_print("Step: Gift Idea Generator")
         try:
+            if self.execution_mode == "direct":
+                result = await self.direct_predict(
+                    ctx,
+                    GiftIdeas,
+                    GIFT_IDEAS_PROMPT,
+                    "gift_idea_generator",
+                    "Gift ideas",
+                    interests=ctx.data.get("interests", ""),
+                    tweets=ctx.data.get("tweets", []),
+                    gift_categories=ev.gift_categories,
+                    price_ceiling=self.price_ceiling
+                )
+                self.log_print(f"Raw Gift Ideas Output: {result.gift_ideas}")
+                gift_ideas_list = [
+                    item if item.startswith(f"{category}: ") else f"{category}: {item}"
+                    for category, items in result.gift_ideas.items()
+                    for item in items
+                ]
+                if not gift_ideas_list:
+                    raise ValueError("No gift ideas returned")
+                self.log_print(f"Processed Gift Ideas: {str(gift_ideas_list)}")
+                return MediationEvent(gift_ideas=gift_ideas_list)
+
             if "gift_idea_generator_agent" not in ctx.data:
-                def generate_specific_gift_ideas(gift_categories: str, interests: str, tweets: List[str]) -> str:
-                    prompt = f"""Based on the following user-specific information:
-
-                    Interests: {interests}
-                    Tweets: {tweets}
-                    Gift Categories: {gift_categories}
-
-                    Generate unique and specific gift ideas under ${self.price_ceiling}. 
-                    Focus on items that are:
-                    1. Directly related to the user's interests and gift categories
-                    2. Unique and not commonly found in regular stores
-                    3. Specific to the person's interests, avoiding generic items
-                    4. Preferably from local artisans, small businesses, or specialty shops
-                    5. Include a mix of physical items and experiences
-                    6. Aim for a total of 10 gift ideas across all categories
-
-                    Present your suggestions as a Python dictionary where keys are categories and values are lists of gift ideas.
-                    Each gift idea should be a string in the format "Category: Gift Idea".
-                    Ensure that each gift idea is tailored to the user's specific interests and not generic.
-                    Do not use any default suggestions.
-
-                    Gift Ideas:"""
-                    response = ctx.data["llm"].complete(prompt)
+                async def generate_specific_gift_ideas(gift_categories: str, interests: str, tweets: List[str]) -> str:
+                    prompt = GIFT_IDEAS_PROMPT.format(interests=interests, tweets=tweets, gift_categories=gift_categories, price_ceiling=self.price_ceiling)
+                    response = await self.complete_prompt(ctx, prompt, "gift_idea_generator", "Gift ideas")
                     return str(response).strip()
 
                 system_prompt = """
@@ -216,7 +535,7 @@ class GiftSuggestionWorkflow(Workflow):
             interests = ctx.data.get("interests", "")
             tweets = ctx.data.get("tweets", [])
 
-            gift_ideas_str = ctx.data["gift_idea_generator_agent"].chat(
+            gift_ideas_str = await ctx.data["gift_idea_generator_agent"].achat(
                 f"Generate gift ideas for these categories: {ev.gift_categories}, "
                 f"with these interests: {interests}, and these tweets: {tweets}"
             )
@@ -268,53 +587,190 @@ class GiftSuggestionWorkflow(Workflow):
             ]
             return MediationEvent(gift_ideas=fallback_ideas)
 
+    def create_debate_agents(self, ctx: Context):
+        async def argue_against_gift(gift_idea: str) -> str:
+            prompt = CON_ARGUMENT_PROMPT.format(gift_idea=gift_idea, price_ceiling=self.price_ceiling)
+            return await self.complete_prompt(ctx, prompt, "mediation_agent", f"{gift_idea} (con)")
+
+        con_system_prompt = """
+            You are an AI assistant that argues against gift ideas. Your role is to:
+            1. Present strong arguments opposing the given gift idea.
+            2. Focus on potential drawbacks or limitations of the gift.
+            3. Provide specific reasons why the recipient might not appreciate the gift.
+            4. Keep your argument concise and persuasive, within 300 characters.
+        """
+
+        async def argue_for_gift(gift_idea: str, previous_argument: str) -> str:
+            prompt = PRO_ARGUMENT_PROMPT.format(gift_idea=gift_idea, previous_argument=previous_argument, price_ceiling=self.price_ceiling)
+            return await self.complete_prompt(ctx, prompt, "mediation_agent", f"{gift_idea} (pro)")
+
+        pro_system_prompt = """
+            You are an AI assistant that argues in favor of gift ideas. Your role is to:
+            1. Present strong arguments supporting the given gift idea based on the user's interests.
+            2. Address and counter the previous argument against the gift.
+            3. Focus on the positive aspects and potential benefits of the gift.
+            4. Keep your argument concise and persuasive, within 300 characters.
+        """
+
+        con_agent = self.create_agent(ctx, [argue_against_gift], con_system_prompt)
+        pro_agent = self.create_agent(ctx, [argue_for_gift], pro_system_prompt)
+        return con_agent, pro_agent
+
     def initialize_debate_agents(self, ctx: Context):
-        if "gift_con_agent" not in ctx.data:
-            def argue_against_gift(gift_idea: str) -> str:
-                prompt = f"""Argue against the following gift idea as a Christmas gift under ${self.price_ceiling} in 300 characters or less. 
-                Consider factors like potential misalignment with recipient's interests, lack of practicality, inappropriateness, or reasons the recipient might not appreciate the gift.
-
-                Gift idea: {gift_idea}
-
-                Provide a concise argument against this gift:"""
-                return ctx.data["llm"].complete(prompt)
-
-            con_system_prompt = """
-                You are an AI assistant that argues against gift ideas. Your role is to:
-                1. Present strong arguments opposing the given gift idea.
-                2. Focus on potential drawbacks or limitations of the gift.
-                3. Provide specific reasons why the recipient might not appreciate the gift.
-                4. Keep your argument concise and persuasive, within 300 characters.
-            """
+        if "gift_con_agent" not in ctx.data or "gift_pro_agent" not in ctx.data:
+            ctx.data["gift_con_agent"], ctx.data["gift_pro_agent"] = self.create_debate_agents(ctx)
 
-            ctx.data["gift_con_agent"] = self.create_agent(ctx, [argue_against_gift], con_system_prompt)
+    def start_gift_debate(self, ctx: Context):
+        if self.debate_memory == "per_gift":
+            ctx.data["gift_con_agent"].memory.reset()
+            ctx.data["gift_pro_agent"].memory.reset()
 
-        if "gift_pro_agent" not in ctx.data:
-            def argue_for_gift(gift_idea: str, previous_argument: str) -> str:
-                prompt = f"""Argue in favor of the following gift idea as a Christmas gift under ${self.price_ceiling} in 300 characters or less. 
-                Consider factors like alignment with recipient's interests, practicality, appropriateness, and reasons the recipient might appreciate the gift.
-                Address the previous argument against the gift.
+    @staticmethod
+    def trim_memory(memory, max_messages: int):
+        messages = memory.get_all()
+        if len(messages) <= max_messages:
+            return
+        # Start the window at a user message so no tool result is kept without the call that asked for it
+        start = next(
+            (i for i in range(len(messages) - max_messages, len(messages)) if messages[i].role == MessageRole.USER),
+            len(messages)
+        )
+        memory.set(messages[start:])
+
+    async def debate_chat(self, ctx: Context, agent, message: str) -> str:
+        """Sends one message to a debate agent and records the size of the context it gets."""
+        if self.debate_memory == "window":
+            self.trim_memory(agent.memory, self.debate_memory_window)
+        history = "\n".join(chat_message.content or "" for chat_message in agent.memory.get_all())
+        ctx.data.setdefault("debate_context_tokens", []).append(count_tokens(history) + count_tokens(message))
+        response = await agent.achat(message)
+        return response.response if hasattr(response, 'response') else str(response)
+
+    def debate_prompt_stats(self, ctx: Context) -> Optional[Dict[str, Any]]:
+        """Token counts of what the debate agents were sent: their memory plus the new message."""
+        sizes = ctx.data.get("debate_context_tokens")
+        if not sizes:
+            return None
+        return {
+            "debate_memory": self.debate_memory,
+            "calls": len(sizes),
+            "mean_tokens": round(sum(sizes) / len(sizes), 1),
+            "max_tokens": max(sizes),
+            "first_tokens": sizes[0],
+            "last_tokens": sizes[-1],
+            "total_tokens": sum(sizes),
+        }
 
-                Gift idea: {gift_idea}
-                Previous argument against: {previous_argument}
+    async def debate_gift(self, ctx: Context, con_agent, pro_agent, gift: str) -> Dict[str, str]:
+        # The pro side always answers the con argument, so the two calls for one gift stay sequential
+        con_argument = await self.debate_chat(ctx, con_agent, f"Argue against this gift idea: {gift}")
+        pro_argument = await self.debate_chat(ctx, pro_agent, f"Argue for this gift idea: {gift}, considering: {con_argument[:300]}")
+        return {"pro": pro_argument, "con": con_argument}
+
+    async def agent_debate_gift(self, ctx: Context, gift: str) -> Dict[str, str]:
+        # Each gift gets its own agents so concurrent debates don't share chat memory
+        con_agent, pro_agent = self.create_debate_agents(ctx)
+        return await self.debate_gift(ctx, con_agent, pro_agent, gift)
+
+    async def direct_debate_gift(self, ctx: Context, gift: str) -> Dict[str, str]:
+        result = await self.direct_predict(ctx, GiftDebate, DEBATE_PROMPT, "mediation_agent", gift, gift_idea=gift, price_ceiling=self.price_ceiling)
+        return {"pro": result.pro, "con": result.con}
+
+    async def debate_gifts_concurrently(self, ctx: Context, gift_ideas: List[str], debate_fn=None, concurrency: Optional[int] = None) -> Dict[str, Dict[str, str]]:
+        debate_fn = debate_fn or self.agent_debate_gift
+        semaphore = asyncio.Semaphore(concurrency or self.debate_concurrency)
+
+        async def run_debate(i: int, gift: str):
+            queued_at = time.perf_counter()
+            async with semaphore:
+                self.log_print(f"Processing gift {i+1}/{len(gift_ideas)}: {gift}")
+                try:
+                    with self.span(ctx, "debate", "debate_gift", queued_at=queued_at, gift=gift):
+                        return gift, await debate_fn(ctx, gift)
+                except Exception as e:
+                    self.log_print(f"Error processing gift '{gift}': {str(e)}")
+                    return gift, {"pro": "Error generating argument", "con": "Error generating argument"}
 
-                Provide a concise argument in favor of this gift:"""
-                return ctx.data["llm"].complete(prompt)
+        results = await asyncio.gather(*(run_debate(i, gift) for i, gift in enumerate(gift_ideas)))
+        return {gift: debate for gift, debate in results}
 
-            pro_system_prompt = """
-                You are an AI assistant that argues in favor of gift ideas. Your role is to:
-                1. Present strong arguments supporting the given gift idea based on the user's interests.
-                2. Address and counter the previous argument against the gift.
-                3. Focus on the positive aspects and potential benefits of the gift.
-                4. Keep your argument concise and persuasive, within 300 characters.
-            """
+    @staticmethod
+    def parse_batch_debate(response_text: str, gift_ideas: List[str]) -> Dict[str, Dict[str, str]]:
+        json_match = re.search(r'\{[\s\S]*\}', response_text)
+        if not json_match:
+            return {}
+        try:
+            data = json.loads(json_match.group())
+        except json.JSONDecodeError:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+
+        # Models sometimes change the case or spacing of the keys, so match on a normalized form as well
+        normalized = {str(key).strip().lower(): value for key, value in data.items()}
+        debates = {}
+        for gift in gift_ideas:
+            item = data.get(gift, normalized.get(gift.strip().lower()))
+            if not isinstance(item, dict):
+                continue
+            pro, con = item.get("pro"), item.get("con")
+            if isinstance(pro, str) and isinstance(con, str) and pro.strip() and con.strip():
+                debates[gift] = {"pro": pro.strip(), "con": con.strip()}
+        return debates
+
+    async def batch_debate_round(self, ctx: Context, gift_ideas: List[str], instructions: str, previous_arguments: Optional[Dict[str, List[str]]] = None, step_name: str = "mediation_agent") -> Dict[str, Dict[str, str]]:
+        """Debates gift_ideas in batches of debate_batch_size; gifts missing from the result need the single-gift path."""
+        batches = [gift_ideas[i:i + self.debate_batch_size] for i in range(0, len(gift_ideas), self.debate_batch_size)]
+        semaphore = asyncio.Semaphore(self.debate_concurrency if self.concurrent_debates else 1)
+
+        async def run_batch(index: int, batch: List[str]) -> Dict[str, Dict[str, str]]:
+            if previous_arguments:
+                payload = [{"gift": gift, "previous_arguments": previous_arguments.get(gift, [])} for gift in batch]
+            else:
+                payload = batch
+            prompt = BATCH_DEBATE_PROMPT.format(
+                price_ceiling=self.price_ceiling,
+                instructions=instructions,
+                gift_ideas=json.dumps(payload, indent=2)
+            )
+            async with semaphore:
+                try:
+                    response = await self.complete_prompt(ctx, prompt, step_name, f"Batch {index + 1}")
+                except Exception as e:
+                    self.log_print(f"Error debating batch {batch}: {str(e)}")
+                    return {}
+            return self.parse_batch_debate(str(response), batch)
+
+        debates = {}
+        for batch_debates in await asyncio.gather(*(run_batch(index, batch) for index, batch in enumerate(batches))):
+            debates.update(batch_debates)
+        return debates
 
-            ctx.data["gift_pro_agent"] = self.create_agent(ctx, [argue_for_gift], pro_system_prompt)
+    @staticmethod
+    def interest_list(ctx: Context) -> List[str]:
+        return split_interests(ctx.data.get("identified_interests", "")) or split_interests(ctx.data.get("additional_text", ""))
+
+    async def rank_gift_ideas(self, ctx: Context, gift_ideas: List[str]) -> List[str]:
+        """Sorts gift_ideas by relevance to the identified interests and keeps the scores in ctx.data["gift_idea_scores"]."""
+        with self.span(ctx, "rank", "rank_gift_ideas", ideas=len(gift_ideas)):
+            scores = await relevance_scores(self.resolve_embed_model("gift idea ranking"), self.interest_list(ctx), gift_ideas)
+        ctx.data["gift_idea_scores"] = {idea: round(float(score), 4) for idea, score in zip(gift_ideas, scores)}
+        return [gift_ideas[i] for i in np.argsort(-scores, kind="stable")]
 
     @step(pass_context=True)
+    @timed_step
     async def mediation_agent(self, ctx: Context, ev: MediationEvent) -> GiftDebaterEvent:
         self.log_print("Step: Mediation Agent")
-        if not ev.gift_ideas:
+        gift_ideas = ev.gift_ideas
+        if (self.debate_top_k is not None or self.score_gift_ideas) and gift_ideas:
+            ranked_ideas = await self.rank_gift_ideas(ctx, gift_ideas)
+            if self.debate_top_k is not None:
+                gift_ideas = ranked_ideas[:self.debate_top_k]
+                self.log_print(f"Debating the top {len(gift_ideas)} of {len(ev.gift_ideas)} gift ideas: {gift_ideas}")
+        # Only the per-gift pipeline picks up prefetched products
+        if self.speculative_prefetch and self.pipeline_products and gift_ideas:
+            self.start_prefetch(ctx, gift_ideas)
+        if not gift_ideas:
             self.log_print("No gift ideas to debate. Providing fallback ideas.")
             fallback_ideas = ["high-quality charger cable", "perishable boutique pantry items", "Gourmet Chocolate", "Portable Charger", "Cozy Socks"]
             debates = {gift: {"pro": "Versatile gift", "con": "May not match specific interests"} for gift in fallback_ideas}
@@ -322,22 +778,49 @@ class GiftSuggestionWorkflow(Workflow):
         
         
         try:
+            if self.batch_debates:
+                debates = await self.batch_debate_round(
+                    ctx,
+                    gift_ideas,
+                    "For each gift idea, first argue against it, then argue in favor of it while addressing the argument against."
+                )
+                missing = [gift for gift in gift_ideas if gift not in debates]
+                if missing:
+                    self.log_print(f"Batch debate missing or malformed for {missing}. Debating them one at a time.")
+                    debate_fn = self.direct_debate_gift if self.execution_mode == "direct" else self.agent_debate_gift
+                    concurrency = self.debate_concurrency if self.concurrent_debates else 1
+                    debates.update(await self.debate_gifts_concurrently(ctx, missing, debate_fn, concurrency))
+                debates = {gift: debates[gift] for gift in gift_ideas}
+                self.log_print(f"Gift Debates: {str(debates)}")
+                return GiftDebaterEvent(gift_ideas=gift_ideas, debates=debates)
+
+            if self.execution_mode == "direct":
+                concurrency = self.debate_concurrency if self.concurrent_debates else 1
+                debates = await self.debate_gifts_concurrently(ctx, gift_ideas, self.direct_debate_gift, concurrency)
+                self.log_print(f"Gift Debates: {str(debates)}")
+                return GiftDebaterEvent(gift_ideas=gift_ideas, debates=debates)
+
+            if self.concurrent_debates:
+                debates = await self.debate_gifts_concurrently(ctx, gift_ideas)
+                self.log_print(f"Gift Debates: {str(debates)}")
+                return GiftDebaterEvent(gift_ideas=gift_ideas, debates=debates)
+
             self.initialize_debate_agents(ctx)
 
-            debates = {gift: {"pro": "", "con": ""} for gift in ev.gift_ideas}
+            debates = {gift: {"pro": "", "con": ""} for gift in gift_ideas}
 
-            for i, gift in enumerate(ev.gift_ideas):
-                self.log_print(f"Processing gift {i+1}/{len(ev.gift_ideas)}: {gift}")
+            for i, gift in enumerate(gift_ideas):
+                self.log_print(f"Processing gift {i+1}/{len(gift_ideas)}: {gift}")
                 
                 try:
+                    self.start_gift_debate(ctx)
+
                     # Argue against
-                    con_response = ctx.data["gift_con_agent"].chat(f"Argue against this gift idea: {gift}")
-                    con_argument = con_response.response if hasattr(con_response, 'response') else str(con_response)
+                    con_argument = await self.debate_chat(ctx, ctx.data["gift_con_agent"], f"Argue against this gift idea: {gift}")
                     debates[gift]["con"] = con_argument
 
                     # Argue for
-                    pro_response = ctx.data["gift_pro_agent"].chat(f"Argue for this gift idea, considering: {con_argument[:300]}")
-                    pro_argument = pro_response.response if hasattr(pro_response, 'response') else str(pro_response)
+                    pro_argument = await self.debate_chat(ctx, ctx.data["gift_pro_agent"], f"Argue for this gift idea, considering: {con_argument[:300]}")
                     debates[gift]["pro"] = pro_argument
                 
                 except Exception as e:
@@ -346,7 +829,7 @@ class GiftSuggestionWorkflow(Workflow):
                     debates[gift]["pro"] = "Error generating argument"
 
             self.log_print(f"Gift Debates: {str(debates)}")
-            return GiftDebaterEvent(gift_ideas=ev.gift_ideas, debates=debates)
+            return GiftDebaterEvent(gift_ideas=gift_ideas, debates=debates)
         
         except Exception as e:
             self.log_print(f"Error in mediation_agent: {str(e)}")
@@ -354,56 +837,187 @@ class GiftSuggestionWorkflow(Workflow):
             raise
 
     @step(pass_context=True)
+    @timed_step
     async def gift_debater(self, ctx: Context, ev: GiftDebaterEvent) -> GiftReasonerEvent:
         self.log_print("Step: Gift Debater")
-        
+
+        if self.adaptive_debates:
+            extended_debates = await self.adaptive_gift_debates(ctx, ev)
+            self.log_print(f"Extended Gift Debates: {str(extended_debates)}")
+            self.log_print(f"Debate prompt sizes: {self.debate_prompt_stats(ctx)}")
+            self.log_print(f"Debate rounds used: {ctx.data.get('debate_rounds', {})}")
+            return GiftReasonerEvent(gift_ideas=extended_debates)
+
         self.initialize_debate_agents(ctx)
 
+        if self.batch_debates:
+            extended_debates = await self.batch_gift_debater(ctx, ev)
+            self.log_print(f"Extended Gift Debates: {str(extended_debates)}")
+            return GiftReasonerEvent(gift_ideas=extended_debates)
+
         extended_debates = {}
         for gift_idea in ev.gift_ideas:
             extended_debates[gift_idea] = []
             # Initial arguments from mediation_agent
             extended_debates[gift_idea].append(f"Con: {ev.debates[gift_idea]['con']}")
             extended_debates[gift_idea].append(f"Pro: {ev.debates[gift_idea]['pro']}")
+            self.start_gift_debate(ctx)
+
+            # 3 rounds of back-and-forth arguments, then 3 rounds of one-sentence arguments
+            for one_sentence, include_con in DEBATE_ROUNDS:
+                extended_debates[gift_idea] += await self.debate_round(
+                    ctx, ctx.data["gift_con_agent"], ctx.data["gift_pro_agent"], gift_idea, ev.debates[gift_idea]['con'], one_sentence, include_con
+                )
+
+        self.log_print(f"Extended Gift Debates: {str(extended_debates)}")
+        self.log_print(f"Debate prompt sizes: {self.debate_prompt_stats(ctx)}")
+        return GiftReasonerEvent(gift_ideas=extended_debates)
+
+    async def debate_round(self, ctx: Context, con_agent, pro_agent, gift_idea: str, first_con_argument: str, one_sentence: bool, include_con: bool) -> List[str]:
+        """One gift_debater round for one gift: a pro argument and, with include_con, the con side's answer."""
+        if one_sentence:
+            pro_argument = await self.debate_chat(ctx, pro_agent, f"Give a one-sentence argument for {gift_idea}")
+        else:
+            pro_argument = await self.debate_chat(ctx, pro_agent, f"Argue for this gift idea: {gift_idea}, considering: {first_con_argument}")
+        entries = [f"Pro: {pro_argument[:300]}"]
+
+        if include_con:
+            if one_sentence:
+                con_argument = await self.debate_chat(ctx, con_agent, f"Give a one-sentence argument against {gift_idea}")
+            else:
+                con_argument = await self.debate_chat(ctx, con_agent, f"Counter this argument: {pro_argument[:300]}")
+            entries.append(f"Con: {con_argument[:300]}")
+        return entries
+
+    def resolve_embed_model(self, purpose: str):
+        if self.embed_model is not None:
+            return self.embed_model
+        try:
+            return get_resource_pool().embed_model()
+        except Exception as e:
+            self.log_print(f"No embedding model for {purpose}, using word overlap: {str(e)}")
+            return None
+
+    async def adaptive_gift_debates(self, ctx: Context, ev: GiftDebaterEvent) -> Dict[str, List[str]]:
+        semaphore = asyncio.Semaphore(self.debate_concurrency if self.concurrent_debates else 1)
+
+        async def run_debate(gift_idea: str) -> List[str]:
+            queued_at = time.perf_counter()
+            entries = [f"Con: {ev.debates[gift_idea]['con']}", f"Pro: {ev.debates[gift_idea]['pro']}"]
+            async with semaphore:
+                try:
+                    return entries + await self.adaptive_debate(ctx, gift_idea, ev.debates[gift_idea], queued_at)
+                except Exception as e:
+                    self.log_print(f"Error extending the debate for '{gift_idea}': {str(e)}")
+                    return entries
+
+        results = await asyncio.gather(*(run_debate(gift_idea) for gift_idea in ev.gift_ideas))
+        return dict(zip(ev.gift_ideas, results))
+
+    async def adaptive_debate(self, ctx: Context, gift_idea: str, debate: Dict[str, str], queued_at: Optional[float] = None) -> List[str]:
+        """Runs DEBATE_ROUNDS for one gift until its arguments converge or its call budget is spent."""
+        # Each gift gets its own agents so concurrent debates don't share chat memory
+        con_agent, pro_agent = self.create_debate_agents(ctx)
+        tracker = NoveltyTracker(self.resolve_embed_model("debate novelty"))
+        await tracker.add([debate["con"], debate["pro"]])
+        entries, novelties, calls, stop_reason = [], [], 0, "completed"
+
+        with self.span(ctx, "debate", "adaptive_debate", queued_at=queued_at, gift=gift_idea) as record:
+            for one_sentence, include_con in DEBATE_ROUNDS:
+                round_calls = 2 if include_con else 1
+                if self.debate_call_budget is not None and calls + round_calls > self.debate_call_budget:
+                    stop_reason = "budget"
+                    break
+
+                round_entries = await self.debate_round(ctx, con_agent, pro_agent, gift_idea, debate["con"], one_sentence, include_con)
+                calls += round_calls
+                entries += round_entries
+                novelty = await tracker.add([entry.split(": ", 1)[1] for entry in round_entries])
+                novelties.append(round(novelty, 3))
+                if novelty < self.debate_min_novelty:
+                    stop_reason = "converged"
+                    break
+
+            rounds = {"rounds": len(novelties), "calls": calls, "stop_reason": stop_reason, "novelty": novelties}
+            record.update(rounds)
+        ctx.data.setdefault("debate_rounds", {})[gift_idea] = rounds
+        return entries
+
+    @staticmethod
+    def merge_extended_debates(extended_debates: Dict[str, List[str]]) -> Dict[str, Dict[str, str]]:
+        """Folds each gift's gift_debater arguments into one pro and one con argument, the debates gift_reasoner reads."""
+        debates = {}
+        for gift_idea, arguments in extended_debates.items():
+            sides = {"pro": [], "con": []}
+            for argument in arguments:
+                side, _, text = argument.partition(": ")
+                if side.lower() in sides and text.strip():
+                    sides[side.lower()].append(text.strip())
+            debates[gift_idea] = {side: " ".join(texts) for side, texts in sides.items()}
+        return debates
+
+    async def batch_gift_debater(self, ctx: Context, ev: GiftDebaterEvent) -> Dict[str, List[str]]:
+        extended_debates = {
+            gift_idea: [f"Con: {ev.debates[gift_idea]['con']}", f"Pro: {ev.debates[gift_idea]['pro']}"]
+            for gift_idea in ev.gift_ideas
+        }
+
+        for one_sentence, include_con in DEBATE_ROUNDS:
+            if one_sentence:
+                instructions = "For each gift idea, give a one-sentence argument against it and a one-sentence argument for it."
+            else:
+                instructions = "For each gift idea, give a new argument for it that counters its previous arguments against, and a new argument against it that counters your argument for."
+            previous_arguments = {gift_idea: arguments[-4:] for gift_idea, arguments in extended_debates.items()}
+            debates = await self.batch_debate_round(ctx, ev.gift_ideas, instructions, previous_arguments, "gift_debater")
+
+            for gift_idea in ev.gift_ideas:
+                if gift_idea in debates:
+                    pro_argument, con_argument = debates[gift_idea]["pro"], debates[gift_idea]["con"]
+                else:
+                    self.log_print(f"Batch debate missing or malformed for '{gift_idea}'. Debating it on its own.")
+                    self.start_gift_debate(ctx)
+                    if one_sentence:
+                        pro_argument = await self.debate_chat(ctx, ctx.data["gift_pro_agent"], f"Give a one-sentence argument for {gift_idea}")
+                    else:
+                        pro_argument = await self.debate_chat(ctx, ctx.data["gift_pro_agent"], f"Argue for this gift idea: {gift_idea}, considering: {ev.debates[gift_idea]['con']}")
+                    con_argument = ""
+                    if include_con:
+                        if one_sentence:
+                            con_argument = await self.debate_chat(ctx, ctx.data["gift_con_agent"], f"Give a one-sentence argument against {gift_idea}")
+                        else:
+                            con_argument = await self.debate_chat(ctx, ctx.data["gift_con_agent"], f"Counter this argument: {pro_argument[:300]}")
 
-            # 3 rounds of back-and-forth arguments
-            for i in range(3):
-                pro_response = ctx.data["gift_pro_agent"].chat(f"Argue for this gift idea: {gift_idea}, considering: {ev.debates[gift_idea]['con']}")
-                pro_argument = pro_response.response if hasattr(pro_response, 'response') else str(pro_response)
                 extended_debates[gift_idea].append(f"Pro: {pro_argument[:300]}")
-                
-                if i < 2:  # Only do con argument for the first two rounds
-                    con_response = ctx.data["gift_con_agent"].chat(f"Counter this argument: {pro_argument[:300]}")
-                    con_argument = con_response.response if hasattr(con_response, 'response') else str(con_response)
+                if include_con:
                     extended_debates[gift_idea].append(f"Con: {con_argument[:300]}")
 
-            # 3 rounds of one-sentence arguments
-            for _ in range(3):
-                pro_response = ctx.data["gift_pro_agent"].chat(f"Give a one-sentence argument for {gift_idea}")
-                pro_argument = pro_response.response if hasattr(pro_response, 'response') else str(pro_response)
-                extended_debates[gift_idea].append(f"Pro: {pro_argument[:300]}")
-                
-                con_response = ctx.data["gift_con_agent"].chat(f"Give a one-sentence argument against {gift_idea}")
-                con_argument = con_response.response if hasattr(con_response, 'response') else str(con_response)
-                extended_debates[gift_idea].append(f"Con: {con_argument[:300]}")
-
-        self.log_print(f"Extended Gift Debates: {str(extended_debates)}")
-        return GiftReasonerEvent(debates=extended_debates)
+        return extended_debates
 
     @step(pass_context=True)
+    @timed_step
     async def gift_reasoner(self, ctx: Context, ev: GiftDebaterEvent) -> GiftReasonerEvent:
         self.log_print("Step: Gift Reasoner")
-        if "gift_reasoner_agent" not in ctx.data:
-            def reason_over_debates(debates: str) -> str:
-                prompt = f"""Given the following debates about gift ideas, provide a final reasoned selection of the top 5 gift ideas. 
-                Consider factors such as uniqueness, practicality, and how well they match the recipient's interests. 
-                Present your selection as a Python list of strings, where each string is in the format "Gift Idea: Reasoning".
+        if self.gift_selector == "local":
+            return GiftReasonerEvent(gift_ideas=await self.local_gift_selection(ctx, ev.debates))
+        if self.gift_selector == "prefilter":
+            return GiftReasonerEvent(gift_ideas=await self.prefiltered_gift_selection(ctx, ev.debates))
 
-                Debates:
-                {debates}
+        if self.execution_mode == "direct":
+            try:
+                result = await self.direct_predict(ctx, FinalGiftSelection, FINAL_SELECTION_PROMPT, "gift_reasoner", "Final selection", debates=ev.debates)
+                self.log_print(f"Final Gift Selection: {result.selections}")
+                reasoned_gifts = {selection.gift.strip(): [selection.reasoning.strip()] for selection in result.selections}
+                if not reasoned_gifts:
+                    raise ValueError("No gifts selected")
+                return GiftReasonerEvent(gift_ideas=reasoned_gifts)
+            except Exception as e:
+                self.log_print(f"Error in gift_reasoner: {str(e)}. Using fallback method.")
+                return GiftReasonerEvent(gift_ideas=await self.reasoner_fallback(ctx, ev.debates))
 
-                Final Selection:"""
-                return ctx.data["llm"].complete(prompt)
+        if "gift_reasoner_agent" not in ctx.data:
+            async def reason_over_debates(debates: str) -> str:
+                prompt = FINAL_SELECTION_PROMPT.format(debates=debates)
+                return await self.complete_prompt(ctx, prompt, "gift_reasoner", "Final selection")
 
             system_prompt = """
                 You are an AI assistant specialized in analyzing debates about gift ideas and making final selections.
@@ -413,12 +1027,13 @@ class GiftSuggestionWorkflow(Workflow):
 
             ctx.data["gift_reasoner_agent"] = self.create_agent(ctx, [reason_over_debates], system_prompt)
 
-        max_retries = 3
+        # The local selector is a better answer than a retry 5 seconds later
+        max_retries = 1 if self.gift_selector == "fallback" else 3
         retry_delay = 5  # seconds
 
         for attempt in range(max_retries):
             try:
-                final_gifts = ctx.data["gift_reasoner_agent"].chat(f"Reason over these debates: {ev.debates}")
+                final_gifts = await ctx.data["gift_reasoner_agent"].achat(f"Reason over these debates: {ev.debates}")
                 self.log_print(f"Final Gift Selection: {final_gifts}")
                 
                 # Extract the response from AgentChatResponse
@@ -435,9 +1050,51 @@ class GiftSuggestionWorkflow(Workflow):
                     await asyncio.sleep(retry_delay)
                 else:
                     self.log_print("Max retries reached. Using fallback method.")
-                    fallback_gifts = self.fallback_gift_selection(ev.debates)
+                    fallback_gifts = await self.reasoner_fallback(ctx, ev.debates)
                     return GiftReasonerEvent(gift_ideas=fallback_gifts)
 
+    async def reasoner_fallback(self, ctx: Context, debates: Dict[str, Dict[str, str]]) -> Dict[str, List[str]]:
+        # Marks the run's selection as a stand-in, so its result is not saved as a good answer
+        ctx.data["gift_selection_fallback"] = True
+        if self.gift_selector == "fallback":
+            return await self.local_gift_selection(ctx, debates)
+        return self.fallback_gift_selection(debates)
+
+    async def local_gift_selection(self, ctx: Context, debates: Dict[str, Dict[str, str]], k: int = 5) -> Dict[str, List[str]]:
+        """The k gifts LocalGiftSelector picks from the debates, each with its scores as the reasoning."""
+        selector = LocalGiftSelector(self.resolve_embed_model("gift selection"))
+        with self.span(ctx, "select", "local_gift_selection", gifts=len(debates)):
+            selected = await selector.select(debates, self.interest_list(ctx), k)
+        ctx.data["gift_selection_scores"] = {score["gift"]: score for score in selected}
+        self.log_print(f"Local Gift Selection: {selected}")
+        return {score["gift"]: [selector.reasoning(score, debates[score["gift"]])] for score in selected}
+
+    async def prefiltered_gift_selection(self, ctx: Context, debates: Dict[str, Dict[str, str]]) -> Dict[str, List[str]]:
+        """The local selector's shortlist, reasoned over in one structured call to the smaller gift_selector_model."""
+        shortlist = await self.local_gift_selection(ctx, debates, self.gift_selector_shortlist)
+        if len(shortlist) <= 5:
+            return shortlist
+        llm = get_resource_pool().llm(llm_cache=self.llm_cache, cassette=self.cassette, model=self.gift_selector_model, temperature=0.4)
+        try:
+            result = await self.direct_predict(
+                ctx,
+                FinalGiftSelection,
+                FINAL_SELECTION_PROMPT,
+                "gift_reasoner",
+                "Final selection",
+                llm=llm,
+                debates={gift: debates[gift] for gift in shortlist}
+            )
+            self.log_print(f"Final Gift Selection: {result.selections}")
+            reasoned_gifts = {selection.gift.strip(): [selection.reasoning.strip()] for selection in result.selections}
+            if not reasoned_gifts:
+                raise ValueError("No gifts selected")
+            return reasoned_gifts
+        except Exception as e:
+            self.log_print(f"Error in gift_reasoner: {str(e)}. Using the local selection.")
+            ctx.data["gift_selection_fallback"] = True
+            return dict(list(shortlist.items())[:5])
+
     def fallback_gift_selection(self, debates: Dict[str, Dict[str, str]]) -> Dict[str, List[str]]:
         # Simple fallback method to extract gift ideas from debates
         fallback_gifts = {}
@@ -453,18 +1110,33 @@ class GiftSuggestionWorkflow(Workflow):
         return fallback_gifts
     
     @step(pass_context=True)
+    @timed_step
     async def amazon_keyword_generator(self, ctx: Context, ev: GiftReasonerEvent) -> AmazonKeywordGeneratorEvent:
-        if "amazon_keyword_generator_agent" not in ctx.data:
-            def generate_keywords(gift_ideas: List[str]) -> List[str]:
-                prompt = f"""Based on the following gift ideas, generate Amazon search keywords. 
-                Each keyword should be a short phrase suitable for searching on Amazon, 
-                and should include "under ${self.price_ceiling}" or a similar price qualifier.
-
-                Gift ideas:
-                {', '.join(gift_ideas)}
+        if self.execution_mode == "direct":
+            gift_ideas_list = [f"{gift}: {reasons[0]}" for gift, reasons in ev.gift_ideas.items()]
+            try:
+                result = await self.direct_predict(
+                    ctx,
+                    AmazonKeywords,
+                    AMAZON_KEYWORDS_PROMPT,
+                    "amazon_keyword_generator",
+                    "Keywords",
+                    gift_ideas=', '.join(gift_ideas_list),
+                    price_ceiling=self.price_ceiling
+                )
+                keywords_list = [keyword.strip() for keyword in result.keywords if keyword.strip()]
+            except Exception as e:
+                self.log_print(f"Error in amazon_keyword_generator: {str(e)}")
+                keywords_list = []
+            if not keywords_list:
+                self.log_print("Failed to generate valid keywords. Using fallback keyword.")
+                keywords_list = [f"Gift under ${self.price_ceiling}"]  # Fallback keyword
+            return AmazonKeywordGeneratorEvent(gift_ideas=gift_ideas_list, amazon_keywords=keywords_list)
 
-                Provide a Python list of 3 search keywords:"""
-                response = ctx.data["llm"].complete(prompt)
+        if "amazon_keyword_generator_agent" not in ctx.data:
+            async def generate_keywords(gift_ideas: List[str]) -> List[str]:
+                prompt = AMAZON_KEYWORDS_PROMPT.format(gift_ideas=', '.join(gift_ideas), price_ceiling=self.price_ceiling)
+                response = await self.complete_prompt(ctx, prompt, "amazon_keyword_generator", "Keywords")
                 return eval(str(response).strip())
 
             system_prompt = """
@@ -477,7 +1149,7 @@ class GiftSuggestionWorkflow(Workflow):
         # Convert the gift_ideas dictionary to a list of strings
         gift_ideas_list = [f"{gift}: {reasons[0]}" for gift, reasons in ev.gift_ideas.items()]
 
-        amazon_keywords = ctx.data["amazon_keyword_generator_agent"].chat(
+        amazon_keywords = await ctx.data["amazon_keyword_generator_agent"].achat(
             f"Generate keywords for these gift ideas: {gift_ideas_list}"
         )
                 
@@ -498,22 +1170,20 @@ class GiftSuggestionWorkflow(Workflow):
         return AmazonKeywordGeneratorEvent(gift_ideas=gift_ideas_list, amazon_keywords=keywords_list)
     
     @staticmethod
-    def extract_amazon_product_links(keyword: str):
-        from apify_client import ApifyClient
-        import os
-        from dotenv import load_dotenv
+    def amazon_search_url(keyword: str, marketplace: str = "www.amazon.com") -> str:
         import urllib.parse
 
-        # Initialize the ApifyClient with your API token
-        load_dotenv()
+        keyword = urllib.parse.quote(keyword, safe="")
+        return f"https://{marketplace}/s?k={keyword}"
 
-        api_token = os.getenv("APIFY_API_TOKEN")
-        client = ApifyClient(api_token)
+    @staticmethod
+    def amazon_run_input(keyword: str, marketplace: str = "www.amazon.com") -> dict:
+        return GiftSuggestionWorkflow.amazon_batch_run_input([keyword], marketplace)
 
-        keyword = urllib.parse.quote(keyword, safe="")
-        # Prepare the Actor input
-        run_input = {
-            "categoryOrProductUrls": [{"url": f"https://www.amazon.com/s?k={keyword}"}],
+    @staticmethod
+    def amazon_batch_run_input(keywords: List[str], marketplace: str = "www.amazon.com") -> dict:
+        return {
+            "categoryOrProductUrls": [{"url": GiftSuggestionWorkflow.amazon_search_url(keyword, marketplace)} for keyword in keywords],
             "maxItemsPerStartUrl": 1,
             "proxyCountry": "AUTO_SELECT_PROXY_COUNTRY",
             "maxOffers": 0,
@@ -522,11 +1192,23 @@ class GiftSuggestionWorkflow(Workflow):
             "scrapeProductVariantPrices": False,
         }
 
+    @staticmethod
+    def actor_call_options(timeout: Optional[float]) -> dict:
+        # Timing out the await alone leaves the actor running (and billing), so Apify aborts the run too
+        return {} if timeout is None else {"timeout_secs": max(1, int(timeout + 0.999))}
+
+    @staticmethod
+    def extract_amazon_product_links(keyword: str, marketplace: str = "www.amazon.com", timeout: Optional[float] = None):
+        client = get_resource_pool().apify_client()
+
+        # Prepare the Actor input
+        run_input = GiftSuggestionWorkflow.amazon_run_input(keyword, marketplace)
+
         print(f"Running Actor with input: {run_input}")
 
         try:
             # Run the Actor and wait for it to finish
-            run = client.actor("BG3WDrGdteHgZgbPK").call(run_input=run_input)
+            run = client.actor("BG3WDrGdteHgZgbPK").call(run_input=run_input, **GiftSuggestionWorkflow.actor_call_options(timeout))
 
             # Fetch Actor results from the run's dataset
             data = client.dataset(run["defaultDatasetId"]).list_items().items
@@ -539,14 +1221,320 @@ class GiftSuggestionWorkflow(Workflow):
             traceback.print_exc()
             return []
 
+    @staticmethod
+    async def aextract_amazon_product_links(keyword: str, marketplace: str = "www.amazon.com", timeout: Optional[float] = None):
+        client = get_resource_pool().apify_async_client()
+
+        run_input = GiftSuggestionWorkflow.amazon_run_input(keyword, marketplace)
+
+        print(f"Running Actor with input: {run_input}")
+
+        try:
+            # Run the Actor without blocking the event loop while it finishes
+            run = await client.actor("BG3WDrGdteHgZgbPK").call(run_input=run_input, **GiftSuggestionWorkflow.actor_call_options(timeout))
+
+            data = (await client.dataset(run["defaultDatasetId"]).list_items()).items
+            for item in data:
+                print(f'Item: {item}')
+
+            return data
+        except Exception as e:
+            print(f"An error occurred: {str(e)}")
+            traceback.print_exc()
+            return []
+
+    # Item fields in which the Amazon actor reports the start URL an item was scraped from
+    SOURCE_URL_FIELDS = ("input", "searchUrl", "sourceUrl", "startUrl", "categoryUrl")
+
+    @staticmethod
+    def keyword_from_source_url(url: str) -> Optional[str]:
+        import urllib.parse
+
+        keyword = urllib.parse.parse_qs(urllib.parse.urlparse(url).query).get("k")
+        return ProductSearchCache.normalize_keyword(keyword[0]) if keyword else None
+
+    @staticmethod
+    async def aextract_amazon_product_links_batch(keywords: List[str], marketplace: str = "www.amazon.com", timeout: Optional[float] = None) -> Dict[str, List[dict]]:
+        """Runs the Amazon actor once for all keywords and splits the items back by their source URL."""
+        client = get_resource_pool().apify_async_client()
+
+        by_normalized = {}
+        for keyword in keywords:
+            by_normalized.setdefault(ProductSearchCache.normalize_keyword(keyword), []).append(keyword)
+        results = {keyword: [] for keyword in keywords}
+
+        run_input = GiftSuggestionWorkflow.amazon_batch_run_input([group[0] for group in by_normalized.values()], marketplace)
+        print(f"Running Actor with input: {run_input}")
+
+        try:
+            run = await client.actor("BG3WDrGdteHgZgbPK").call(run_input=run_input, **GiftSuggestionWorkflow.actor_call_options(timeout))
+
+            async for item in client.dataset(run["defaultDatasetId"]).iterate_items():
+                print(f'Item: {item}')
+                source_keyword = None
+                for field in GiftSuggestionWorkflow.SOURCE_URL_FIELDS:
+                    if isinstance(item.get(field), str):
+                        source_keyword = GiftSuggestionWorkflow.keyword_from_source_url(item[field])
+                        if source_keyword in by_normalized:
+                            break
+                if source_keyword not in by_normalized:
+                    if len(by_normalized) != 1:
+                        print(f"Could not match item to a keyword: {item.get('url')}")
+                        continue
+                    source_keyword = next(iter(by_normalized))
+                for keyword in by_normalized[source_keyword]:
+                    results[keyword].append(item)
+        except Exception as e:
+            print(f"An error occurred: {str(e)}")
+            traceback.print_exc()
+
+        return results
+
+    def cached_amazon_products(self, keyword: str) -> Optional[List[dict]]:
+        if self.product_cache is None:
+            return None
+
+        cached = self.product_cache.get(keyword, self.amazon_marketplace)
+        if cached is not None:
+            items, is_stale = cached
+            if is_stale:
+                # Serve the stale result right away and refresh it for the next request
+                self.log_print(f"Serving stale product results for '{keyword}' and refreshing in the background")
+                self.product_cache.refresh_in_background(keyword, self.amazon_marketplace, lambda: self.fetch_amazon_products(keyword))
+            else:
+                self.log_print(f"Serving cached product results for '{keyword}'")
+            return items
+        return None
+
+    def fetch_amazon_products(self, keyword: str) -> List[dict]:
+        fetch = lambda: self.extract_amazon_product_links(keyword, self.amazon_marketplace, self.product_lookup_timeout)
+        if self.cassette is None:
+            return fetch()
+        request = {"keyword": keyword, "marketplace": self.amazon_marketplace}
+        return self.cassette.call("apify", request, fetch)
+
+    async def afetch_amazon_products(self, keyword: str) -> List[dict]:
+        fetch = lambda: self.aextract_amazon_product_links(keyword, self.amazon_marketplace, self.product_lookup_timeout)
+        if self.cassette is None:
+            return await fetch()
+        request = {"keyword": keyword, "marketplace": self.amazon_marketplace}
+        return await self.cassette.acall("apify", request, fetch)
+
+    async def afetch_amazon_products_batch(self, keywords: List[str]) -> Dict[str, List[dict]]:
+        fetch = lambda: self.aextract_amazon_product_links_batch(keywords, self.amazon_marketplace, self.batch_lookup_timeout)
+        if self.cassette is None:
+            return await fetch()
+        request = {"keywords": keywords, "marketplace": self.amazon_marketplace}
+        return await self.cassette.acall("apify_batch", request, fetch)
+
+    async def search_amazon_products(self, ctx: Context, keyword: str):
+        items = self.cached_amazon_products(keyword)
+        if items is not None:
+            return items
+
+        with self.span(ctx, "apify", "amazon_search", keyword=keyword) as record:
+            items = await self.afetch_amazon_products(keyword)
+            record["items"] = len(items or [])
+        if items and self.product_cache is not None:
+            self.product_cache.set(keyword, self.amazon_marketplace, items)
+        return items
+
+    @staticmethod
+    def no_product_event() -> ProductLinkEvent:
+        return ProductLinkEvent(
+            product_title="No product found",
+            product_price=None,
+            product_rating=None,
+            product_image="",
+            product_links=""
+        )
+
+    @staticmethod
+    def product_link_to_dict(product_link: ProductLinkEvent) -> Dict[str, Any]:
+        return {
+            "product_title": product_link.product_title,
+            "product_price": product_link.product_price,
+            "product_rating": product_link.product_rating,
+            "product_image": product_link.product_image,
+            "product_links": product_link.product_links,
+        }
+
+    async def generate_product_links(self, ctx: Context, keywords: List[str]) -> List[ProductLinkEvent]:
+        """Looks up every keyword concurrently; results come back in keyword order."""
+        with self.span(ctx, "step", "generate_product_links"):
+            if self.batch_product_lookups:
+                return await self.generate_product_links_batch(ctx, keywords)
+
+            semaphore = asyncio.Semaphore(self.product_lookup_concurrency)
+            return list(await asyncio.gather(*(self.lookup_product_link(ctx, keyword, semaphore) for keyword in keywords)))
+
+    async def lookup_product_link(self, ctx: Context, keyword: str, semaphore: asyncio.Semaphore) -> ProductLinkEvent:
+        queued_at = time.perf_counter()
+        async with semaphore:
+            try:
+                with self.span(ctx, "product_lookup", "lookup_product_link", queued_at=queued_at, keyword=keyword):
+                    return await asyncio.wait_for(
+                        self.amazon_product_link_generator(ctx, AmazonProductLinkEvent(keyword=keyword)),
+                        timeout=self.product_lookup_timeout
+                    )
+            except asyncio.TimeoutError:
+                self.log_print(f"Product lookup for keyword '{keyword}' timed out after {self.product_lookup_timeout} seconds")
+                return self.no_product_event()
+
+    async def generate_gift_keyword(self, ctx: Context, gift: str, reasons: List[str], step_name: Optional[str] = "amazon_keyword_generator") -> str:
+        gift_idea = f"{gift}: {reasons[0]}" if reasons else gift
+        prompt = GIFT_KEYWORD_PROMPT.format(gift_idea=gift_idea, price_ceiling=self.price_ceiling)
+        try:
+            response = await self.complete_prompt(ctx, prompt, step_name, gift)
+            for line in str(response).strip().split('\n'):
+                keyword = line.strip().lstrip('-•*').strip().strip('"\'')
+                if keyword:
+                    return keyword
+        except Exception as e:
+            self.log_print(f"Error generating keyword for '{gift}': {str(e)}")
+        return f"{gift} under ${self.price_ceiling}"  # Fallback keyword
+
+    def start_prefetch(self, ctx: Context, gift_ideas: List[str]):
+        """Starts keyword generation and product lookup for the candidate gift ideas in the background.
+
+        At most prefetch_max_lookups ideas are prefetched, prefetch_concurrency at a time, with their
+        own semaphore so the lookups for the final selection never wait behind them.
+        """
+        semaphore = asyncio.Semaphore(self.prefetch_concurrency)
+
+        async def prefetch(gift: str):
+            queued_at = time.perf_counter()
+            async with semaphore:
+                # Started during mediation_agent, but the work is for the product phase
+                with self.span(ctx, "prefetch", "prefetch_gift", queued_at=queued_at, parent="gift_product_pipeline", gift=gift):
+                    keyword = await self.generate_gift_keyword(ctx, gift, [], step_name=None)
+                    product_link = await self.lookup_product_link(ctx, keyword, asyncio.Semaphore(1))
+                    return keyword, product_link
+
+        candidates = list(dict.fromkeys(gift_ideas))[:self.prefetch_max_lookups]
+        if len(candidates) < len(gift_ideas):
+            self.log_print(f"Prefetching products for {len(candidates)} of {len(gift_ideas)} gift ideas")
+        ctx.data["product_prefetch"] = {gift: asyncio.create_task(prefetch(gift)) for gift in candidates}
+
+    async def stop_prefetch(self, ctx: Context):
+        """Cancels the prefetch tasks that are still running and collects the results and errors of all of them."""
+        tasks = list(ctx.data.pop("product_prefetch", {}).values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    def match_prefetched_gift(gift: str, candidates: List[str]) -> Optional[str]:
+        # gift_reasoner may drop the "Category: " prefix or reword the idea slightly
+        def normalize(text: str) -> str:
+            return " ".join(text.lower().replace("*", "").split())
+
+        target = normalize(gift)
+        for candidate in candidates:
+            if target in (normalize(candidate), normalize(candidate.split(": ", 1)[-1])):
+                return candidate
+        for candidate in candidates:
+            item = normalize(candidate.split(": ", 1)[-1])
+            if item and (item in target or target in item):
+                return candidate
+        return None
+
+    async def iter_gift_products(self, ctx: Context, gift_ideas: Dict[str, List[str]]) -> AsyncIterator[Tuple[str, str, ProductLinkEvent]]:
+        """Takes every selected gift through keyword generation and product lookup on its own.
+
+        Yields (gift, keyword, product link) as soon as each gift is done, so the first
+        product is available while the others are still being processed.
+        """
+        semaphore = asyncio.Semaphore(self.product_lookup_concurrency)
+
+        # Left in ctx.data so run_pipeline can cancel and collect every task once the run ends
+        prefetched = ctx.data.get("product_prefetch", {})
+        matches = {gift: self.match_prefetched_gift(gift, list(prefetched)) for gift in gift_ideas}
+        selected = set(matches.values())
+        for candidate, task in prefetched.items():
+            if candidate not in selected:
+                task.cancel()
+        if prefetched:
+            self.log_print(f"Prefetched gifts used: {sorted(candidate for candidate in selected if candidate)}")
+
+        async def process_gift(gift: str, reasons: List[str]):
+            with self.span(ctx, "step", "gift_product_pipeline", gift=gift):
+                return await lookup_gift(gift, reasons)
+
+        async def lookup_gift(gift: str, reasons: List[str]):
+            candidate = matches.get(gift)
+            if candidate is not None:
+                try:
+                    keyword, product_link = await prefetched[candidate]
+                    if product_link.product_links:
+                        return gift, keyword, product_link
+                except Exception as e:
+                    self.log_print(f"Prefetch for '{candidate}' failed: {str(e)}")
+
+            keyword = await self.generate_gift_keyword(ctx, gift, reasons)
+            self.log_print(f"Keyword for '{gift}': {keyword}")
+            product_link = await self.lookup_product_link(ctx, keyword, semaphore)
+            return gift, keyword, product_link
+
+        for next_done in asyncio.as_completed([process_gift(gift, reasons) for gift, reasons in gift_ideas.items()]):
+            yield await next_done
+
+    async def generate_product_links_batch(self, ctx: Context, keywords: List[str]) -> List[ProductLinkEvent]:
+        products = {}
+        missing = []
+        for keyword in keywords:
+            items = self.cached_amazon_products(keyword)
+            if items is not None:
+                products[keyword] = items
+            else:
+                missing.append(keyword)
+
+        if missing:
+            self.log_print(f"Generating product links for keywords in one actor run: {missing}")
+            try:
+                with self.span(ctx, "apify", "amazon_search_batch", keywords=len(missing)):
+                    fetched = await asyncio.wait_for(self.afetch_amazon_products_batch(missing), timeout=self.batch_lookup_timeout)
+            except asyncio.TimeoutError:
+                self.log_print(f"Batched product lookup timed out after {self.batch_lookup_timeout} seconds")
+                fetched = {}
+            else:
+                # Items the actor did not tie to a start URL are dropped, so those keywords get a run of their own
+                unmatched = [keyword for keyword in missing if not fetched.get(keyword)]
+                if unmatched and len(missing) > 1:
+                    self.log_print(f"No batched products for {unmatched}. Looking them up one at a time.")
+                    semaphore = asyncio.Semaphore(self.product_lookup_concurrency)
+                    items = await asyncio.gather(*(self.fetch_unmatched_products(ctx, keyword, semaphore) for keyword in unmatched))
+                    fetched.update(zip(unmatched, items))
+            for keyword in missing:
+                products[keyword] = fetched.get(keyword, [])
+                if products[keyword] and self.product_cache is not None:
+                    self.product_cache.set(keyword, self.amazon_marketplace, products[keyword])
+
+        return [self.product_link_event(products[keyword]) for keyword in keywords]
+
+    async def fetch_unmatched_products(self, ctx: Context, keyword: str, semaphore: asyncio.Semaphore) -> List[dict]:
+        async with semaphore:
+            try:
+                with self.span(ctx, "apify", "amazon_search", keyword=keyword) as record:
+                    items = await asyncio.wait_for(self.afetch_amazon_products(keyword), timeout=self.product_lookup_timeout)
+                    record["items"] = len(items or [])
+                return items or []
+            except asyncio.TimeoutError:
+                self.log_print(f"Product lookup for keyword '{keyword}' timed out after {self.product_lookup_timeout} seconds")
+                return []
+
     @step(pass_context=True)
+    @timed_step
     async def amazon_product_link_generator(self, ctx: Context, ev: AmazonProductLinkEvent) -> ProductLinkEvent:
         self.log_print(f"Generating product link for keyword: {ev.keyword}")
         
         product_link = []
-        link = self.extract_amazon_product_links(ev.keyword)
+        link = await self.search_amazon_products(ctx, ev.keyword)
         product_link.extend(link)
-        
+        return self.product_link_event(product_link)
+
+    def product_link_event(self, product_link: List[dict]) -> ProductLinkEvent:
         self.log_print("\n--- Amazon Product Links ---")
         self.log_print(product_link)
         self.log_print("----------------------------\n")
@@ -591,17 +1579,90 @@ class GiftSuggestionWorkflow(Workflow):
         except Exception as e:
             self.log_print(f"An error occurred while processing product link: {str(e)}")
             traceback.print_exc()
-            return ProductLinkEvent(
-                product_title="No product found",
-                product_price=None,
-                product_rating=None,
-                product_image="",
-                product_links=""
-            )
+            return self.no_product_event()
+
+    async def run_pipeline(self, ctx: Context, progress_callback: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """Runs every step in the same order as the Streamlit app and returns the results as plain data.
+
+        progress_callback(step_name, data) gets each step's results as soon as the step finishes,
+        and with pipeline_products one "gift_product" call per gift as its product comes in.
+        """
+        def report(step_name: str, **data):
+            if progress_callback is not None:
+                progress_callback(step_name, data)
+
+        try:
+            init_event = await self.initialize(ctx, StartEvent())
+            report("initialize", tweets=init_event.tweets)
+            interest_event = await self.tweet_analyzer(ctx, init_event)
+            report("tweet_analyzer", interests=interest_event.interests)
+            gift_categories_event = await self.interest_mapper(ctx, interest_event)
+            report("interest_mapper", gift_categories=gift_categories_event.gift_categories)
+            gift_ideas_event = await self.gift_idea_generator(ctx, gift_categories_event)
+            report("gift_idea_generator", gift_ideas=gift_ideas_event.gift_ideas)
+            gift_debates_event = await self.mediation_agent(ctx, gift_ideas_event)
+            if "gift_idea_scores" in ctx.data:
+                report("mediation_agent", debates=gift_debates_event.debates, gift_idea_scores=ctx.data["gift_idea_scores"])
+            else:
+                report("mediation_agent", debates=gift_debates_event.debates)
+            if self.adaptive_debates:
+                extended_debates_event = await self.gift_debater(ctx, gift_debates_event)
+                gift_debates_event = GiftDebaterEvent(
+                    gift_ideas=gift_debates_event.gift_ideas,
+                    debates=self.merge_extended_debates(extended_debates_event.gift_ideas)
+                )
+                report("gift_debater", debates=gift_debates_event.debates, debate_rounds=ctx.data.get("debate_rounds", {}))
+            debate_prompt_stats = self.debate_prompt_stats(ctx)
+            if debate_prompt_stats is not None:
+                self.log_print(f"Debate prompt sizes: {debate_prompt_stats}")
+            gift_reasoner_event = await self.gift_reasoner(ctx, gift_debates_event)
+            report("gift_reasoner", selected_gifts=gift_reasoner_event.gift_ideas)
+            if self.pipeline_products:
+                gift_products = {}
+                async for gift, keyword, product_link in self.iter_gift_products(ctx, gift_reasoner_event.gift_ideas):
+                    gift_products[gift] = (keyword, product_link)
+                    report("gift_product", gift=gift, keyword=keyword, product=self.product_link_to_dict(product_link))
+                ordered = [gift_products[gift] for gift in gift_reasoner_event.gift_ideas]
+                amazon_keyword_event = AmazonKeywordGeneratorEvent(
+                    gift_ideas=[f"{gift}: {reasons[0]}" for gift, reasons in gift_reasoner_event.gift_ideas.items()],
+                    amazon_keywords=[keyword for keyword, _ in ordered]
+                )
+                product_links = [product_link for _, product_link in ordered]
+            else:
+                amazon_keyword_event = await self.amazon_keyword_generator(ctx, gift_reasoner_event)
+                report("amazon_keyword_generator", amazon_keywords=amazon_keyword_event.amazon_keywords)
+                product_links = await self.generate_product_links(ctx, amazon_keyword_event.amazon_keywords)
+                report("generate_product_links", products=[self.product_link_to_dict(product_link) for product_link in product_links])
+
+            result = {
+                "tweets": init_event.tweets,
+                "interests": interest_event.interests,
+                "gift_categories": gift_categories_event.gift_categories,
+                "gift_ideas": gift_ideas_event.gift_ideas,
+                "debates": gift_debates_event.debates,
+                "selected_gifts": gift_reasoner_event.gift_ideas,
+                "amazon_keywords": amazon_keyword_event.amazon_keywords,
+                "products": [self.product_link_to_dict(product_link) for product_link in product_links],
+            }
+            result["selection_fallback"] = ctx.data.get("gift_selection_fallback", False)
+            if "gift_idea_scores" in ctx.data:
+                result["gift_idea_scores"] = ctx.data["gift_idea_scores"]
+            if "debate_rounds" in ctx.data:
+                result["debate_rounds"] = ctx.data["debate_rounds"]
+            if debate_prompt_stats is not None:
+                result["debate_prompt_stats"] = debate_prompt_stats
+            if "metrics" in ctx.data:
+                result["metrics"] = {"totals": ctx.data["metrics"].totals(), "summary": ctx.data["metrics"].summary()}
+            # Agents of a failed run may still be in use by cancelled tasks, so only a finished run hands them back
+            self.release_agents(ctx)
+            return result
+        finally:
+            # Prefetch tasks outlive mediation_agent, so stop them however the run ends
+            await self.stop_prefetch(ctx)
 
 # Remove the draw_all_possible_flows call from here
 def create_agent(ctx: Context, tools: List[callable], system_prompt: str):
-    function_tools = [FunctionTool.from_defaults(fn=tool) for tool in tools]
+    function_tools = [GiftSuggestionWorkflow.create_function_tool(tool) for tool in tools]
     agent_worker = FunctionCallingAgentWorker.from_tools(
         tools=function_tools,
         llm=ctx.data["llm"],
@@ -613,17 +1674,9 @@ def create_agent(ctx: Context, tools: List[callable], system_prompt: str):
 async def main():
     price_ceiling = 30
 
-    log_dir = "logs"
-    os.makedirs(log_dir, exist_ok=True)
-    log_filename = datetime.now().strftime("%Y-%m-%d-%H-%M") + ".txt"
-    log_path = os.path.join(log_dir, log_filename)
-
-    def log_print(*args, **kwargs):
-        message = " ".join(map(str, args))
-        print(message, flush=True)  # Print to console immediately
-        with open(log_path, "a") as log_file:
-            log_file.write(message + "\n")
-            log_file.flush()  # Ensure it's written to the file immediately
+    log_sink = LogSink()
+    log_print = log_sink.log
+    set_run_id(datetime.now().strftime("%Y-%m-%d-%H-%M-%S"))
 
     sys.excepthook = lambda type, value, tb: log_print("".join(traceback.format_exception(type, value, tb)))
 
@@ -636,7 +1689,8 @@ async def main():
         log_print(f"An error occurred: {str(e)}")
         traceback.print_exc(file=sys.stdout)
     finally:
-        log_print(f"Log saved to: {log_path}")
+        log_print(f"Log saved to: {log_sink.path}")
+        log_sink.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events.llm import (
+    LLMChatEndEvent,
+    LLMChatStartEvent,
+    LLMCompletionEndEvent,
+    LLMCompletionStartEvent,
+)
+from llama_index.core.utils import get_tokenizer
+
+# USD per million (prompt, completion) tokens
+MODEL_PRICES = {
+    "gpt-4": (30.0, 60.0),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-3.5-turbo": (0.5, 1.5),
+}
+
+# The RunMetrics of the run the current task belongs to, and the step it is in
+current_metrics = contextvars.ContextVar("current_metrics", default=None)
+current_parent = contextvars.ContextVar("current_parent", default=None)
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    if not model:
+        return None
+    # Dated model names ("gpt-4o-2024-08-06") are priced like their base model
+    matches = [name for name in MODEL_PRICES if model == name or model.startswith(name + "-")]
+    if not matches:
+        return None
+    prompt_price, completion_price = MODEL_PRICES[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def count_tokens(text: str) -> int:
+    return len(get_tokenizer()(text)) if text else 0
+
+
+class RunMetrics:
+    """Spans recorded during one workflow run.
+
+    Every span has a kind ("step", "llm", "apify", ...), a name, its wall time and, where the
+    work waited on a semaphore first, the queue wait. LLM spans also carry token counts and an
+    estimated cost.
+    """
+
+    def __init__(self, run_id: Optional[str] = None):
+        self.run_id = run_id or time.strftime("%Y-%m-%d-%H-%M-%S")
+        self.started_at = time.time()
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._open_llm_calls = defaultdict(list)
+
+    def add_span(self, record: Dict[str, Any]):
+        with self._lock:
+            self.spans.append(record)
+
+    @contextmanager
+    def span(self, kind: str, name: str, queued_at: Optional[float] = None, parent: Optional[str] = None, **attributes):
+        """parent overrides the enclosing step, for work started in one step on behalf of another."""
+        start = time.perf_counter()
+        record = {
+            "kind": kind,
+            "name": name,
+            "parent": parent if parent is not None else current_parent.get(),
+            "started_at": time.time(),
+            "queue_wait_seconds": round(start - queued_at, 4) if queued_at is not None else 0.0,
+            **attributes,
+        }
+        metrics_token = current_metrics.set(self)
+        if kind == "step":
+            parent_token = current_parent.set(name)
+        else:
+            # LLM and Apify spans inside an explicitly parented span belong to that parent too
+            parent_token = current_parent.set(parent) if parent is not None else None
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            if parent_token is not None:
+                current_parent.reset(parent_token)
+            current_metrics.reset(metrics_token)
+            record["wall_seconds"] = round(time.perf_counter() - start, 4)
+            self.add_span(record)
+
+    def llm_call_started(self, span_id: Optional[str], model: Optional[str]):
+        with self._lock:
+            self._open_llm_calls[span_id].append((model, time.perf_counter(), time.time(), current_parent.get()))
+
+    def llm_call_finished(self, span_id: Optional[str], prompt_text: str, response: Any, response_text: str):
+        with self._lock:
+            started = self._open_llm_calls[span_id]
+            if not started:
+                return
+            model, start, started_at, parent = started.pop(0)
+
+        usage = getattr(response, "additional_kwargs", None) or {}
+        if "prompt_tokens" in usage and "completion_tokens" in usage:
+            prompt_tokens, completion_tokens, estimated = usage["prompt_tokens"], usage["completion_tokens"], False
+        else:
+            # Streamed responses come back without usage
+            prompt_tokens, completion_tokens, estimated = count_tokens(prompt_text), count_tokens(response_text), True
+
+        self.add_span({
+            "kind": "llm",
+            "name": model or "unknown",
+            "parent": parent,
+            "started_at": started_at,
+            "queue_wait_seconds": 0.0,
+            "wall_seconds": round(time.perf_counter() - start, 4),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "tokens_estimated": estimated,
+            "cost_usd": estimate_cost(model, prompt_tokens, completion_tokens),
+        })
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Aggregates the spans per (kind, name); LLM calls are grouped by the step that made them."""
+        groups = {}
+        with self._lock:
+            spans = list(self.spans)
+        for record in spans:
+            name = f"{record['parent'] or '-'} / {record['name']}" if record["kind"] == "llm" else record["name"]
+            group = groups.setdefault((record["kind"], name), {
+                "kind": record["kind"],
+                "name": name,
+                "count": 0,
+                "wall_seconds": 0.0,
+                "max_wall_seconds": 0.0,
+                "queue_wait_seconds": 0.0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "cost_usd": 0.0,
+                "errors": 0,
+            })
+            group["count"] += 1
+            group["wall_seconds"] += record.get("wall_seconds", 0.0)
+            group["max_wall_seconds"] = max(group["max_wall_seconds"], record.get("wall_seconds", 0.0))
+            group["queue_wait_seconds"] += record.get("queue_wait_seconds", 0.0)
+            group["prompt_tokens"] += record.get("prompt_tokens", 0)
+            group["completion_tokens"] += record.get("completion_tokens", 0)
+            group["cost_usd"] += record.get("cost_usd") or 0.0
+            group["errors"] += 1 if "error" in record else 0
+
+        for group in groups.values():
+            for field in ("wall_seconds", "max_wall_seconds", "queue_wait_seconds"):
+                group[field] = round(group[field], 3)
+            group["cost_usd"] = round(group["cost_usd"], 5)
+        return sorted(groups.values(), key=lambda group: (group["kind"] != "step", -group["wall_seconds"]))
+
+    def totals(self) -> Dict[str, Any]:
+        with self._lock:
+            llm_spans = [record for record in self.spans if record["kind"] == "llm"]
+        return {
+            "wall_seconds": round(time.time() - self.started_at, 3),
+            "llm_calls": len(llm_spans),
+            "prompt_tokens": sum(record["prompt_tokens"] for record in llm_spans),
+            "completion_tokens": sum(record["completion_tokens"] for record in llm_spans),
+            "cost_usd": round(sum(record["cost_usd"] or 0.0 for record in llm_spans), 5),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = list(self.spans)
+        return {"run_id": self.run_id, "totals": self.totals(), "summary": self.summary(), "spans": spans}
+
+    def export_json(self, directory: str = "metrics") -> str:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.run_id}.json")
+        with open(path, "w") as metrics_file:
+            json.dump(self.to_dict(), metrics_file, indent=2, default=str)
+        return path
+
+
+@contextmanager
+def span(kind: str, name: str, queued_at: Optional[float] = None, **attributes):
+    """Records a span on the current run's metrics, or does nothing outside an instrumented run."""
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield {}
+        return
+    with metrics.span(kind, name, queued_at=queued_at, **attributes) as record:
+        yield record
+
+
+class LLMCallHandler(BaseEventHandler):
+    """Turns LlamaIndex LLM start/end events into llm spans on the current run's metrics."""
+
+    _metrics_by_span: Dict[Optional[str], RunMetrics] = PrivateAttr(default_factory=dict)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LLMCallHandler"
+
+    def handle(self, event: Any, **kwargs: Any) -> Any:
+        if isinstance(event, (LLMChatStartEvent, LLMCompletionStartEvent)):
+            metrics = current_metrics.get()
+            if metrics is not None:
+                # End events of streamed calls can fire outside the context that started them
+                self._metrics_by_span[event.span_id] = metrics
+                metrics.llm_call_started(event.span_id, event.model_dict.get("model"))
+        elif isinstance(event, LLMChatEndEvent):
+            metrics = self._metrics_by_span.pop(event.span_id, None)
+            if metrics is not None:
+                prompt_text = "\n".join(message.content or "" for message in event.messages)
+                response_text = event.response.message.content or "" if event.response else ""
+                metrics.llm_call_finished(event.span_id, prompt_text, event.response, response_text)
+        elif isinstance(event, LLMCompletionEndEvent):
+            metrics = self._metrics_by_span.pop(event.span_id, None)
+            if metrics is not None:
+                metrics.llm_call_finished(event.span_id, event.prompt, event.response, event.response.text or "")
+
+
+_handler_lock = threading.Lock()
+_handler: Optional[LLMCallHandler] = None
+
+
+def install_llm_instrumentation():
+    global _handler
+    with _handler_lock:
+        if _handler is None:
+            _handler = LLMCallHandler()
+            get_dispatcher().add_event_handler(_handler)
+
+
+class MetricsRegistry:
+    """Process-wide totals of every finished run, served in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self._totals = defaultdict(lambda: defaultdict(float))
+        self._server = None
+
+    def observe(self, metrics: RunMetrics):
+        with self._lock:
+            self.runs += 1
+            for group in metrics.summary():
+                totals = self._totals[(group["kind"], group["name"])]
+                for field in ("count", "wall_seconds", "queue_wait_seconds", "prompt_tokens", "completion_tokens", "cost_usd", "errors"):
+                    totals[field] += group[field]
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    def prometheus_text(self) -> str:
+        metric_fields = [
+            ("giftgenie_span_count_total", "counter", "count", "Spans recorded"),
+            ("giftgenie_span_wall_seconds_total", "counter", "wall_seconds", "Wall time spent in spans"),
+            ("giftgenie_span_queue_wait_seconds_total", "counter", "queue_wait_seconds", "Time spans waited before starting"),
+            ("giftgenie_span_prompt_tokens_total", "counter", "prompt_tokens", "Prompt tokens sent"),
+            ("giftgenie_span_completion_tokens_total", "counter", "completion_tokens", "Completion tokens received"),
+            ("giftgenie_span_cost_usd_total", "counter", "cost_usd", "Estimated LLM cost in USD"),
+            ("giftgenie_span_errors_total", "counter", "errors", "Spans that raised"),
+        ]
+        with self._lock:
+            lines = [
+                "# HELP giftgenie_runs_total Workflow runs finished",
+                "# TYPE giftgenie_runs_total counter",
+                f"giftgenie_runs_total {self.runs}",
+            ]
+            for metric, metric_type, field, help_text in metric_fields:
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} {metric_type}")
+                for (kind, name), totals in sorted(self._totals.items()):
+                    lines.append(f'{metric}{{kind="{self._escape(kind)}",name="{self._escape(name)}"}} {totals[field]:g}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9464, host: str = "0.0.0.0"):
+        """Serves /metrics from a daemon thread."""
+        if self._server is not None:
+            return
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
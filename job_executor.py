@@ -0,0 +1,176 @@
+import time
+import uuid
+import asyncio
+import threading
+import traceback
+import contextvars
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# The Job the current task is running, so log_print and stream callbacks can report to it
+current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class Job:
+    """One submitted workflow run and everything the UI needs to show it.
+
+    state holds the partial results published so far, streams the latest partial LLM output
+    per step and stream id, and events the log lines and status changes, in order.
+    """
+
+    def __init__(self, job_id: str, name: str = ""):
+        self.id = job_id
+        self.name = name
+        self.status = "queued"
+        self.progress = 0
+        self.state: Dict[str, Any] = {}
+        self.streams: Dict[str, Dict[str, str]] = {}
+        self.events: List[Dict[str, Any]] = []
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._future = None
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def emit(self, event_type: str, **data):
+        with self._lock:
+            self.events.append({"ts": time.time(), "type": event_type, **data})
+
+    def log(self, message: str):
+        self.emit("log", message=message)
+
+    def update(self, progress: Optional[float] = None, **state):
+        with self._lock:
+            if progress is not None:
+                self.progress = max(self.progress, int(progress))
+            self.state.update(state)
+
+    def stream(self, step_name: str, stream_id: str, text: str):
+        with self._lock:
+            self.streams.setdefault(step_name, {})[stream_id] = text
+
+    def clear_streams(self, step_name: str, stream_id: Optional[str] = None):
+        """Drops the partial output of a finished step, or of one of its streams, now replaced by results."""
+        with self._lock:
+            if stream_id is None:
+                self.streams.pop(step_name, None)
+            elif step_name in self.streams:
+                self.streams[step_name].pop(stream_id, None)
+
+    def _set_status(self, status: str, **data):
+        with self._lock:
+            self.status = status
+            if status == "running":
+                self.started_at = time.time()
+            elif status in ("done", "failed", "cancelled"):
+                self.finished_at = time.time()
+                self.streams.clear()
+                if status == "done":
+                    self.progress = 100
+            self.events.append({"ts": time.time(), "type": "status", "status": status, **data})
+
+    def snapshot(self, since: int = 0) -> Dict[str, Any]:
+        """A consistent copy for rendering; events start at index since."""
+        with self._lock:
+            return {
+                "id": self.id,
+                "name": self.name,
+                "status": self.status,
+                "progress": self.progress,
+                "state": dict(self.state),
+                "streams": {step_name: dict(streams) for step_name, streams in self.streams.items()},
+                "events": self.events[since:],
+                "event_count": len(self.events),
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobExecutor:
+    """Runs workflow jobs on one background event loop, at most max_running at a time.
+
+    Jobs outlive the Streamlit script run that submitted them, so reruns and reconnects only
+    stop the polling, not the work. Finished jobs are kept for finished_ttl_seconds, and only
+    the newest max_finished of them.
+    """
+
+    def __init__(self, max_running: int = 4, max_finished: int = 256, finished_ttl_seconds: float = 3600):
+        self.max_running = max_running
+        self.max_finished = max_finished
+        self.finished_ttl_seconds = finished_ttl_seconds
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._semaphore = asyncio.Semaphore(max_running)
+        # One long-lived loop, so the resource pool's async clients are shared by every job
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="job-executor", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable[..., Awaitable[Any]], *args, name: str = "", **kwargs) -> Job:
+        """Schedules fn(*args, **kwargs); inside it current_job is the returned Job."""
+        job = Job(uuid.uuid4().hex[:12], name)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        job.emit("status", status="queued")
+        job._future = asyncio.run_coroutine_threadsafe(self._run(job, fn, args, kwargs), self._loop)
+        return job
+
+    async def _run(self, job: Job, fn, args, kwargs):
+        current_job.set(job)
+        try:
+            async with self._semaphore:
+                job._set_status("running")
+                result = await fn(*args, **kwargs)
+            job.result = result
+            job._set_status("done")
+        except asyncio.CancelledError:
+            job._set_status("cancelled")
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {str(e)}"
+            job._set_status("failed", error=job.error)
+            traceback.print_exc()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.done or job._future is None:
+            return False
+        return job._future.cancel()
+
+    def jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def stats(self) -> Dict[str, int]:
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0, "cancelled": 0}
+        for job in self.jobs():
+            counts[job.status] += 1
+        return counts
+
+    def _prune(self):
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.done]
+        expired = {job.id for job in finished if now - job.finished_at > self.finished_ttl_seconds}
+        expired.update(job.id for job in finished[:max(0, len(finished) - self.max_finished)])
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self):
+        for job in self.jobs():
+            if not job.done and job._future is not None:
+                job._future.cancel()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
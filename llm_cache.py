@@ -0,0 +1,289 @@
+import os
+import json
+import atexit
+import asyncio
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional, Sequence
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    MessageRole,
+)
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.llms.openai import OpenAI
+from openai.types.chat import ChatCompletionMessageToolCall
+
+
+class LLMResponseCache:
+    """SQLite-backed cache of LLM responses with a TTL and LRU eviction past max_entries.
+
+    Hits only note their access time in memory; the times are written in one transaction once
+    access_flush_size of them are pending or access_flush_seconds have passed, and before eviction.
+    """
+
+    def __init__(
+        self,
+        path: str = "cache/llm_cache.sqlite",
+        ttl_seconds: Optional[float] = 7 * 24 * 3600,
+        max_entries: int = 5000,
+        access_flush_size: int = 100,
+        access_flush_seconds: float = 30.0,
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.access_flush_size = access_flush_size
+        self.access_flush_seconds = access_flush_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pending_access: Dict[str, float] = {}
+        self._last_access_flush = time.time()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_accessed ON responses (last_accessed)")
+        self._conn.commit()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def make_key(model: str, temperature: float, system_prompt: Optional[str], prompt: str) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        key_data = json.dumps([model, temperature, system_prompt or "", prompt_hash])
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            value, created_at = row
+            if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._pending_access[key] = now
+            if len(self._pending_access) >= self.access_flush_size or now - self._last_access_flush >= self.access_flush_seconds:
+                self._flush_access(now)
+                self._conn.commit()
+            self.hits += 1
+            return json.loads(value)
+
+    def set(self, key: str, value: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, last_accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            self._pending_access.pop(key, None)
+            # Eviction goes by last_accessed, so it must see the pending access times
+            self._flush_access(now)
+            self._evict(now)
+            self._conn.commit()
+
+    def _flush_access(self, now: float):
+        if self._pending_access:
+            self._conn.executemany(
+                "UPDATE responses SET last_accessed = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._pending_access.items()]
+            )
+            self._pending_access.clear()
+        self._last_access_flush = now
+
+    def flush(self):
+        """Writes the pending access times, e.g. before the process exits."""
+        with self._lock:
+            self._flush_access(time.time())
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        # Keep only the max_entries most recently used responses
+        self._conn.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def clear(self):
+        with self._lock:
+            self._pending_access.clear()
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+def _json_default(obj: Any):
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return str(obj)
+
+
+def message_to_dict(message: ChatMessage) -> Dict[str, Any]:
+    additional_kwargs = dict(message.additional_kwargs)
+    if "tool_calls" in additional_kwargs:
+        additional_kwargs["tool_calls"] = [_json_default(tool_call) for tool_call in additional_kwargs["tool_calls"]]
+    return {"role": message.role.value, "content": message.content, "additional_kwargs": additional_kwargs}
+
+
+def message_from_dict(data: Dict[str, Any]) -> ChatMessage:
+    additional_kwargs = dict(data.get("additional_kwargs", {}))
+    if "tool_calls" in additional_kwargs:
+        # OpenAI.get_tool_calls_from_response only accepts the OpenAI tool call objects
+        additional_kwargs["tool_calls"] = [
+            ChatCompletionMessageToolCall.model_validate(tool_call) for tool_call in additional_kwargs["tool_calls"]
+        ]
+    return ChatMessage(role=data["role"], content=data.get("content"), additional_kwargs=additional_kwargs)
+
+
+class CachedOpenAI(OpenAI):
+    """OpenAI LLM that serves chat and completion calls from an LLMResponseCache.
+
+    The agent path goes through chat/achat (tool definitions are part of the key),
+    the tool closures and direct mode through complete/acomplete and achat.
+    Streaming calls replay a cached response as a single chunk. The async calls
+    reach SQLite from a worker thread, so a lookup never holds up the event loop.
+    """
+
+    _cache: LLMResponseCache = PrivateAttr()
+
+    def __init__(self, cache: LLMResponseCache, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._cache = cache
+
+    @property
+    def cache(self) -> LLMResponseCache:
+        return self._cache
+
+    def _chat_key(self, messages: Sequence[ChatMessage], kwargs: Dict[str, Any]) -> str:
+        system_prompt = "\n".join(message.content or "" for message in messages if message.role == MessageRole.SYSTEM)
+        prompt = json.dumps(
+            {
+                "messages": [message_to_dict(message) for message in messages if message.role != MessageRole.SYSTEM],
+                "kwargs": kwargs,
+            },
+            sort_keys=True,
+            default=_json_default
+        )
+        return self._cache.make_key(self.model, self.temperature, system_prompt, prompt)
+
+    def _complete_key(self, prompt: str, formatted: bool, kwargs: Dict[str, Any]) -> str:
+        prompt_data = json.dumps({"prompt": prompt, "formatted": formatted, "kwargs": kwargs}, sort_keys=True, default=_json_default)
+        return self._cache.make_key(self.model, self.temperature, self.system_prompt, prompt_data)
+
+    @staticmethod
+    def _chat_response_to_dict(response: ChatResponse) -> Dict[str, Any]:
+        return {"message": message_to_dict(response.message), "additional_kwargs": response.additional_kwargs}
+
+    @staticmethod
+    def _chat_response_from_dict(data: Dict[str, Any]) -> ChatResponse:
+        return ChatResponse(message=message_from_dict(data["message"]), additional_kwargs=data.get("additional_kwargs", {}))
+
+    @staticmethod
+    def _completion_response_to_dict(response: CompletionResponse) -> Dict[str, Any]:
+        return {"text": response.text, "additional_kwargs": response.additional_kwargs}
+
+    @staticmethod
+    def _completion_response_from_dict(data: Dict[str, Any]) -> CompletionResponse:
+        return CompletionResponse(text=data["text"], additional_kwargs=data.get("additional_kwargs", {}))
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self._chat_key(messages, kwargs)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return self._chat_response_from_dict(cached)
+        response = super().chat(messages, **kwargs)
+        self._cache.set(key, self._chat_response_to_dict(response))
+        return response
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self._chat_key(messages, kwargs)
+        cached = await asyncio.to_thread(self._cache.get, key)
+        if cached is not None:
+            return self._chat_response_from_dict(cached)
+        response = await super().achat(messages, **kwargs)
+        await asyncio.to_thread(self._cache.set, key, self._chat_response_to_dict(response))
+        return response
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        key = self._complete_key(prompt, formatted, kwargs)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return self._completion_response_from_dict(cached)
+        response = super().complete(prompt, formatted=formatted, **kwargs)
+        self._cache.set(key, self._completion_response_to_dict(response))
+        return response
+
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        key = self._complete_key(prompt, formatted, kwargs)
+        cached = await asyncio.to_thread(self._cache.get, key)
+        if cached is not None:
+            return self._completion_response_from_dict(cached)
+        response = await super().acomplete(prompt, formatted=formatted, **kwargs)
+        await asyncio.to_thread(self._cache.set, key, self._completion_response_to_dict(response))
+        return response
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        key = self._chat_key(messages, kwargs)
+        cached = await asyncio.to_thread(self._cache.get, key)
+        stream = None if cached is not None else await super().astream_chat(messages, **kwargs)
+
+        async def gen() -> ChatResponseAsyncGen:
+            if cached is not None:
+                response = self._chat_response_from_dict(cached)
+                response.delta = response.message.content
+                yield response
+                return
+
+            response = None
+            async for response in stream:
+                yield response
+            if response is not None:
+                await asyncio.to_thread(self._cache.set, key, self._chat_response_to_dict(response))
+
+        return gen()
+
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        key = self._complete_key(prompt, formatted, kwargs)
+        cached = await asyncio.to_thread(self._cache.get, key)
+        stream = None if cached is not None else await super().astream_complete(prompt, formatted=formatted, **kwargs)
+
+        async def gen() -> CompletionResponseAsyncGen:
+            if cached is not None:
+                response = self._completion_response_from_dict(cached)
+                response.delta = response.text
+                yield response
+                return
+
+            response = None
+            async for response in stream:
+                yield response
+            if response is not None:
+                await asyncio.to_thread(self._cache.set, key, self._completion_response_to_dict(response))
+
+        return gen()
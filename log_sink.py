@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import reprlib
+import threading
+import contextvars
+from datetime import datetime
+from typing import Optional
+
+# Set per run and per step so every line can be attributed without threading the ids through log_print
+current_run_id = contextvars.ContextVar("current_run_id", default=None)
+current_step = contextvars.ContextVar("current_step", default=None)
+
+_STOP = object()
+
+
+def set_run_id(run_id: Optional[str]):
+    current_run_id.set(run_id)
+
+
+class LogSink:
+    """Writes log lines as JSON from a background thread so logging never blocks a step.
+
+    log() only formats a size-bounded message and puts it on an in-memory queue. The writer
+    thread appends to log_dir/filename and rotates the file once it is larger than max_bytes
+    or older than rotate_seconds, keeping backup_count rotated files.
+    """
+
+    def __init__(
+        self,
+        log_dir: str = "logs",
+        filename: str = "gift-genie.jsonl",
+        max_bytes: int = 10 * 1024 * 1024,
+        rotate_seconds: Optional[float] = 24 * 3600,
+        backup_count: int = 10,
+        max_message_chars: int = 4000,
+        queue_size: int = 10000,
+        echo: bool = True,
+    ):
+        self.log_dir = log_dir
+        self.path = os.path.join(log_dir, filename)
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backup_count = backup_count
+        self.max_message_chars = max_message_chars
+        self.echo = echo
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._opened_at = 0.0
+
+        # Product payloads and debate dicts are summarised instead of formatted in full
+        self._repr = reprlib.Repr()
+        self._repr.maxlevel = 4
+        self._repr.maxdict = 20
+        self._repr.maxlist = 20
+        self._repr.maxstring = 500
+        self._repr.maxother = 500
+
+        os.makedirs(log_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def format_message(self, args) -> str:
+        message = " ".join(arg if isinstance(arg, str) else self._repr.repr(arg) for arg in args)
+        if len(message) > self.max_message_chars:
+            message = message[:self.max_message_chars] + f"... [truncated {len(message) - self.max_message_chars} chars]"
+        return message
+
+    def log(self, *args, **kwargs):
+        message = self.format_message(args)
+        # Only the first argument names the step; the rest are values logged with it
+        if args and isinstance(args[0], str) and args[0].startswith("Step: "):
+            current_step.set(args[0][len("Step: "):].strip())
+
+        record = {
+            "ts": time.time(),
+            "run_id": current_run_id.get(),
+            "step": current_step.get(),
+            "message": message,
+        }
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        return message
+
+    __call__ = log
+
+    def _open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._opened_at = time.time()
+
+    def _should_rotate(self) -> bool:
+        if self._file.tell() >= self.max_bytes:
+            return True
+        return self.rotate_seconds is not None and time.time() - self._opened_at >= self.rotate_seconds
+
+    def _rotate(self):
+        self._file.close()
+        if os.path.getsize(self.path) > 0:
+            base, ext = os.path.splitext(self.path)
+            os.replace(self.path, f"{base}-{datetime.now().strftime('%Y-%m-%d-%H-%M-%S-%f')}{ext}")
+            self._remove_old_backups(base, ext)
+        self._open()
+
+    def _remove_old_backups(self, base: str, ext: str):
+        prefix = os.path.basename(base) + "-"
+        backups = sorted(
+            name for name in os.listdir(self.log_dir) if name.startswith(prefix) and name.endswith(ext)
+        )
+        for name in backups[:max(0, len(backups) - self.backup_count)]:
+            os.remove(os.path.join(self.log_dir, name))
+
+    def _write(self, record: dict):
+        if self._should_rotate():
+            self._rotate()
+        self._file.write(json.dumps(record, default=str) + "\n")
+        if self.echo:
+            print(record["message"], file=sys.stdout, flush=True)
+
+    def _run(self):
+        self._open()
+        while True:
+            record = self._queue.get()
+            if record is _STOP:
+                break
+            try:
+                self._write(record)
+                # Flush once the queue is drained instead of after every line
+                if self._queue.empty():
+                    self._file.flush()
+            except Exception as e:
+                print(f"Error writing log record: {str(e)}", file=sys.stderr)
+        self._file.close()
+
+    def close(self, timeout: float = 5.0):
+        if not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
@@ -3,14 +3,20 @@ import streamlit as st
 from gift_suggestion_workflow import (
     GiftSuggestionWorkflow,
     Context,
-    StartEvent,
-    AmazonKeywordGeneratorEvent,
-    AmazonProductLinkEvent,  # Add this import
+    ProductLinkEvent,
 )
 import traceback
 from searchx import search_tweets
+from llm_cache import LLMResponseCache
+from product_cache import ProductSearchCache
+from result_cache import WorkflowResultCache
+from log_sink import LogSink, set_run_id
+from instrumentation import MetricsRegistry
+from cassette import Cassette
+from resource_pool import get_resource_pool
+from job_executor import JobExecutor, current_job
 import os
-from datetime import datetime
+import time
 import random
 from collections import defaultdict
 import sys
@@ -38,32 +44,157 @@ st.title("🎁 Gift Genie 🎁")
 if 'log_output' not in st.session_state:
     st.session_state.log_output = []
 
+@st.cache_resource
+def get_log_sink():
+    # One writer thread for every session, so concurrent runs append to the same rotated log
+    return LogSink()
+
 def log_print(*args, **kwargs):
-    message = " ".join(map(str, args))
-    print(message, flush=True)  # Print to console immediately
+    message = get_log_sink().log(*args, **kwargs)
     st.session_state.log_output.append(message)
-    
-    # Write to log file
-    log_dir = "logs"
-    os.makedirs(log_dir, exist_ok=True)
-    log_filename = datetime.now().strftime("%Y-%m-%d-%H-%M") + ".txt"
-    log_path = os.path.join(log_dir, log_filename)
-    with open(log_path, "a") as log_file:
-        log_file.write(message + "\n")
-        log_file.flush()  # Ensure it's written to the file immediately
-
-async def run_workflow(price_ceiling, twitter_handle, additional_text, progress_bar):
+
+@st.cache_resource
+def get_llm_cache():
+    # Shared by every session and kept on disk so cached responses survive server restarts
+    return LLMResponseCache()
+
+@st.cache_resource
+def get_product_cache():
+    return ProductSearchCache()
+
+@st.cache_resource
+def get_result_cache():
+    # Finished runs shared by every session, bounded by RESULT_CACHE_MAX_AGE_HOURS and RESULT_CACHE_MAX_MB
+    return WorkflowResultCache(
+        max_age_seconds=float(os.getenv("RESULT_CACHE_MAX_AGE_HOURS", "168")) * 3600,
+        max_bytes=int(float(os.getenv("RESULT_CACHE_MAX_MB", "50")) * 1024 * 1024),
+    )
+
+@st.cache_resource
+def get_cassette():
+    # Set GIFTGENIE_RECORD_CASSETTE to capture the sessions of this server for replay with batch_runner.py
+    path = os.getenv("GIFTGENIE_RECORD_CASSETTE")
+    return Cassette(path, mode="record") if path else None
+
+@st.cache_resource
+def get_job_executor():
+    # Runs outlive the script run that started them; MAX_RUNNING_JOBS caps how many run at once
+    return JobExecutor(max_running=int(os.getenv("MAX_RUNNING_JOBS", "4")))
+
+@st.cache_resource
+def get_metrics_registry():
+    # Totals of every run in this server process, scraped from http://<host>:METRICS_PORT/metrics
+    registry = MetricsRegistry()
+    try:
+        registry.serve(int(os.getenv("METRICS_PORT", "9464")))
+    except OSError as e:
+        print(f"Could not start the metrics endpoint: {str(e)}")
+    return registry
+
+STEP_TITLES = {
+    1: "Step 1: Analyzing Tweets and Text 🧐",
+    2: "Step 2: Mapping Interests to Gift Categories",
+    3: "Step 3: 💡 Generating Gift Ideas",
+    4: "Step 4: 🥊 Debating Gift Ideas 🥊",
+    5: "Step 5: Reasoning Over Gift Debates 🤔",
+    6: "Step 6: Generating Amazon Search Keywords ✍️",
+    7: "Step 7: Generating Amazon Product Links 📀",
+}
+
+# Progress shown once a step has finished
+STEP_PROGRESS = {
+    "initialize": 10,
+    "tweet_analyzer": 20,
+    "interest_mapper": 40,
+    "gift_idea_generator": 60,
+    "mediation_agent": 80,
+    "gift_debater": 85,
+    "gift_reasoner": 90,
+    "amazon_keyword_generator": 95,
+    "generate_product_links": 100,
+}
+
+# The steps whose partial LLM output is shown in each step's expander
+STEP_STREAMS = {
+    1: ("tweet_analyzer",),
+    2: ("interest_mapper",),
+    3: ("gift_idea_generator",),
+    4: ("mediation_agent", "gift_debater"),
+    5: ("gift_reasoner",),
+    6: ("amazon_keyword_generator",),
+}
+
+# Seconds between two looks at a running job, and while an LLM call is streaming
+POLL_SECONDS = 1.0
+STREAM_POLL_SECONDS = 0.25
+
+def report_progress(job, step_name, data):
+    if step_name == "gift_product":
+        # Steps 6 and 7 fill in gift by gift
+        state = job.snapshot()["state"]
+        products = state.get("products", []) + [data["product"]]
+        job.update(
+            90 + 10 * len(products) // max(1, len(state.get("selected_gifts", {}))),
+            amazon_keywords=state.get("amazon_keywords", []) + [data["keyword"]],
+            products=products,
+        )
+        job.clear_streams("amazon_keyword_generator", data["gift"])
+    else:
+        job.update(STEP_PROGRESS.get(step_name), **data)
+        # The partial output of a finished step is replaced by its results
+        job.clear_streams(step_name)
+        if step_name == "gift_debater":
+            # Its agents argue through the mediation_agent debate tools
+            job.clear_streams("mediation_agent")
+
+def workflow_options(cassette):
+    """The app's workflow options that change its answers; they are part of the result cache key."""
+    return {
+        "concurrent_debates": True,
+        "pipeline_products": True,
+        "speculative_prefetch": True,
+        # Only the DEBATE_TOP_K gift ideas most relevant to the interests are debated; 0 debates them all
+        "debate_top_k": int(os.getenv("DEBATE_TOP_K", "8")) or None,
+        # "fallback" picks the final gifts locally when the LLM's selection cannot be parsed, see GiftSuggestionWorkflow
+        "gift_selector": os.getenv("GIFT_SELECTOR", "fallback"),
+        # Extra debate rounds per gift until its arguments stop adding anything new, see GiftSuggestionWorkflow
+        "adaptive_debates": os.getenv("ADAPTIVE_DEBATES", "0") == "1",
+        # Relevance scores for the top 5 list, also when DEBATE_TOP_K=0 debates every idea
+        "score_gift_ideas": True,
+        "cassette_mode": cassette.mode if cassette is not None else None,
+    }
+
+def is_cacheable(result):
+    # Runs that fell back to a stand-in selection or found no products are worth running again
+    if result.get("selection_fallback"):
+        return False
+    return any(product.get("product_links") for product in result.get("products", []))
+
+async def run_workflow(price_ceiling, twitter_handle, additional_text, request, options, resources):
+    """Runs as a background job; everything the UI shows is published on the job."""
+    job = current_job.get()
+    set_run_id(job.id)
+
+    def job_log_print(*args, **kwargs):
+        job.log(resources["log_sink"].log(*args, **kwargs))
+
     workflow = GiftSuggestionWorkflow(
         price_ceiling=price_ceiling,
-        log_print_func=log_print,
+        log_print_func=job_log_print,
         timeout=600,
         verbose=True,
+        llm_cache=resources["llm_cache"],
+        product_cache=resources["product_cache"],
+        stream_callback=job.stream,
+        collect_metrics=True,
+        cassette=resources["cassette"],
+        **{name: value for name, value in options.items() if name != "cassette_mode"},
     )
     ctx = Context(workflow)
 
     if twitter_handle:
         twitter_handle = twitter_handle.lstrip("@")
-        tweet_data = search_tweets(twitter_handle)
+        tweet_data = await asyncio.to_thread(search_tweets, twitter_handle, cassette=resources["cassette"])
         ctx.data["tweets"] = [tweet["text"] for tweet in tweet_data]
     else:
         ctx.data["tweets"] = []
@@ -71,126 +202,229 @@ async def run_workflow(price_ceiling, twitter_handle, additional_text, progress_
     ctx.data["twitter_handle"] = twitter_handle
     ctx.data["additional_text"] = additional_text
 
-    progress_bar.progress(0)
+    result = await workflow.run_pipeline(ctx, progress_callback=lambda step_name, data: report_progress(job, step_name, data))
+
+    job_log_print(f"LLM cache stats: {resources['llm_cache'].stats()}")
+    job_log_print(f"Resource pool stats: {get_resource_pool().stats()}")
+    if resources["cassette"] is not None:
+        # Appends only this job's recordings, off the loop the other jobs run on
+        await asyncio.to_thread(resources["cassette"].save)
+    metrics = ctx.data.get("metrics")
+    if metrics is not None:
+        resources["metrics_registry"].observe(metrics)
+        job_log_print(f"Run metrics saved to: {metrics.export_json()}")
+    if is_cacheable(result):
+        # The metrics belong to this run, not to the answer for the request
+        resources["result_cache"].set(request, {key: value for key, value in result.items() if key != "metrics"})
+    else:
+        job_log_print("Not saving this result: its selection was a fallback or it found no products")
+    return result
+
+def submit_workflow(price_ceiling, twitter_handle, additional_text, request, options):
+    # The cached resources are looked up here, on the script thread, and handed to the job
+    resources = {
+        "log_sink": get_log_sink(),
+        "llm_cache": get_llm_cache(),
+        "product_cache": get_product_cache(),
+        "result_cache": get_result_cache(),
+        "cassette": get_cassette(),
+        "metrics_registry": get_metrics_registry(),
+    }
+    return get_job_executor().submit(
+        run_workflow, price_ceiling, twitter_handle, additional_text, request, options, resources,
+        name=twitter_handle or "gift request",
+    )
+
+def render_tweets(tweets):
+    st.subheader("Tweets Extracted and Additional Information")
+    for tweet in tweets:
+        st.markdown(f"- {tweet}")
+
+def render_interests(interests):
+    st.subheader("Interests Identified")
+    st.write(interests)
+
+def render_gift_categories(gift_categories):
+    st.subheader("Gift Categories")
+    st.text(gift_categories)
+    # categories = gift_categories.split(", ")
+    # for i, category in enumerate(categories, 1):
+    #     st.markdown(f"{i}. {category}")
+
+def render_gift_ideas(gift_ideas, gift_idea_scores=None):
+    st.subheader("Gift Ideas by Category")
+    
+    # Group ideas by category
+    categorized_ideas = defaultdict(list)
+    for idea in gift_ideas:
+        category, item = idea.split(": ", 1)
+        categorized_ideas[category].append(item)
     
-    with st.expander("Step 1: Analyzing Tweets and Text 🧐", expanded=True):
-        init_event = await workflow.initialize(ctx, StartEvent())
-        st.subheader("Tweets Extracted and Additional Information")
-        for tweet in init_event.tweets:
-            st.markdown(f"- {tweet}")
-        interest_event = await workflow.tweet_analyzer(ctx, init_event)
-        st.subheader("Interests Identified")
-        st.write(interest_event.interests)
-    progress_bar.progress(20)
-
-    with st.expander("Step 2: Mapping Interests to Gift Categories", expanded=True):
-        st.subheader("Interest Mapping")
-        gift_categories_event = await workflow.interest_mapper(ctx, interest_event)
-        st.subheader("Gift Categories")
-        st.text(gift_categories_event.gift_categories)
-        # categories = gift_categories_event.gift_categories.split(", ")
-        # for i, category in enumerate(categories, 1):
-        #     st.markdown(f"{i}. {category}")
-    progress_bar.progress(40)
-
-    with st.expander("Step 3: 💡 Generating Gift Ideas", expanded=True):
-        gift_ideas_event = await workflow.gift_idea_generator(ctx, gift_categories_event)
-        st.subheader("Gift Ideas by Category")
-        
-        # Group ideas by category
-        categorized_ideas = defaultdict(list)
-        for idea in gift_ideas_event.gift_ideas:
-            category, item = idea.split(": ", 1)
-            categorized_ideas[category].append(item)
-        
-        # Display ideas by category
-        for category, ideas in categorized_ideas.items():
-            st.write(f"**{category}**")
-            for idea in ideas:
-                st.markdown(f"- {idea}")
-        
-        # Score and select top 5 gift ideas based on relevance to user's interests
-        def score_idea(idea, interests):
-            return sum(interest.lower() in idea.lower() for interest in interests.split(','))
-
-        interests = interest_event.interests
-        scored_ideas = [(idea, score_idea(idea, interests)) for idea in gift_ideas_event.gift_ideas]
-        top_ideas = sorted(scored_ideas, key=lambda x: x[1], reverse=True)[:5]
-        
-        st.subheader("Top 5 Gift Ideas Based on User Interests")
-        for idea, score in top_ideas:
-            st.markdown(f"- {idea} (Relevance Score: {score})")
-
-    progress_bar.progress(60)
-
-    with st.expander("Step 4: 🥊 Debating Gift Ideas 🥊", expanded=True):
-        gift_debates_event = await workflow.mediation_agent(ctx, gift_ideas_event)
-        st.subheader("Gift Debates")
-        for gift, debate in gift_debates_event.debates.items():
-            st.write(f"**{gift}**")
-            col1, col2 = st.columns(2)
-            with col1:
-                st.markdown("🟢 **Pro:**")
-                st.markdown(debate['pro'])
-            with col2:
-                st.markdown("🔴 **Con:**")
-                st.markdown(debate['con'])
-            st.markdown("---")
-    progress_bar.progress(80)
-
-    with st.expander("Step 5: Reasoning Over Gift Debates 🤔", expanded=True):
-        gift_reasoner_event = await workflow.gift_reasoner(ctx, gift_debates_event)
-        st.subheader("Final Gift Selections")
-        for gift, reasons in gift_reasoner_event.gift_ideas.items():
-            st.markdown(f"**{gift}**")
-            for reason in reasons:
-                st.markdown(f"*Rationale:* {reason}")
-            st.markdown("---")
-    progress_bar.progress(90)
-
-    with st.expander("Step 6: Generating Amazon Search Keywords ✍️", expanded=True):
-        amazon_keyword_event = await workflow.amazon_keyword_generator(ctx, gift_reasoner_event)
-        st.subheader("Amazon Search Keywords")
-        for keyword in amazon_keyword_event.amazon_keywords:
-            st.markdown(f"- {keyword}")
-    progress_bar.progress(95)
-
-    with st.expander("Step 7: Generating Amazon Product Links 📀", expanded=True):
-        st.subheader("Amazon Product Links")
-        product_links = []
-        for keyword in amazon_keyword_event.amazon_keywords:
-            print(f"Generating product links for keyword: {keyword}")
-            product_link_event = await workflow.amazon_product_link_generator(
-                ctx, AmazonProductLinkEvent(keyword=keyword)
-            )
-            print(f"Product link event: {product_link_event}")
-            product_links.append(product_link_event)
-
-        print("\n--- Amazon Product Links ---")
-        print(product_links)
-        print("----------------------------\n")
-
-        st.subheader("Amazon Product Links")
-        for product_link in product_links:
-            with st.container():
-                col1, col2 = st.columns([1, 3])
-                with col1:
-                    if product_link.product_image:
-                        st.image(product_link.product_image, width=100)
-                    else:
-                        st.write("No image available")
-                with col2:
-                    st.write(f"**{product_link.product_title[:50]}...**" if product_link.product_title else "Title not available")
-                    price_text = f"${product_link.product_price:.2f}" if product_link.product_price and product_link.product_price != 'N/A' else "Price not available"
-                    rating_stars = '⭐' * int(float(product_link.product_rating)) if product_link.product_rating and product_link.product_rating != 'N/A' else ""
-                    st.write(f"{price_text} | {rating_stars}")
-                    if product_link.product_links:
-                        st.markdown(f"[View]({product_link.product_links})")
-                    else:
-                        st.write("Link not available")
-    progress_bar.progress(100)
-
-    return amazon_keyword_event
+    # Display ideas by category
+    for category, ideas in categorized_ideas.items():
+        st.write(f"**{category}**")
+        for idea in ideas:
+            st.markdown(f"- {idea}")
+    
+    # Relevance to the user's interests as scored by the workflow before the debates
+    st.subheader("Top 5 Gift Ideas Based on User Interests")
+    if not gift_idea_scores:
+        st.caption("No relevance scores yet: the gift ideas are scored against the interests when the debates start.")
+        return
+    top_ideas = sorted(gift_idea_scores.items(), key=lambda x: x[1], reverse=True)[:5]
+
+    for idea, score in top_ideas:
+        st.markdown(f"- {idea} (Relevance Score: {score:.2f})")
+
+def render_debates(debates):
+    st.subheader("Gift Debates")
+    for gift, debate in debates.items():
+        st.write(f"**{gift}**")
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("🟢 **Pro:**")
+            st.markdown(debate['pro'])
+        with col2:
+            st.markdown("🔴 **Con:**")
+            st.markdown(debate['con'])
+        st.markdown("---")
+
+def render_selected_gifts(gift_ideas):
+    st.subheader("Final Gift Selections")
+    for gift, reasons in gift_ideas.items():
+        st.markdown(f"**{gift}**")
+        for reason in reasons:
+            st.markdown(f"*Rationale:* {reason}")
+        st.markdown("---")
+
+def render_keywords(amazon_keywords):
+    st.subheader("Amazon Search Keywords")
+    for keyword in amazon_keywords:
+        st.markdown(f"- {keyword}")
+
+def render_streams(streams):
+    # A placeholder under the step's results, holding the partial output of its running LLM calls
+    with st.empty().container():
+        for stream_id, text in streams.items():
+            st.markdown(f"**{stream_id}**\n\n{text}" if stream_id else text)
+
+def render_result(result, streams=None):
+    """Renders the steps present in result, which comes from a running job, a finished one or the result cache.
+
+    streams is the partial LLM output per step name, shown inside the expander of the step still running.
+    """
+    step_streams = {
+        number: {stream_id: text for step_name in step_names for stream_id, text in (streams or {}).get(step_name, {}).items()}
+        for number, step_names in STEP_STREAMS.items()
+    }
+    if "tweets" in result or step_streams[1]:
+        with st.expander(STEP_TITLES[1], expanded=True):
+            if "tweets" in result:
+                render_tweets(result["tweets"])
+            if "interests" in result:
+                render_interests(result["interests"])
+            render_streams(step_streams[1])
+    if "gift_categories" in result or step_streams[2]:
+        with st.expander(STEP_TITLES[2], expanded=True):
+            if "gift_categories" in result:
+                render_gift_categories(result["gift_categories"])
+            render_streams(step_streams[2])
+    if "gift_ideas" in result or step_streams[3]:
+        with st.expander(STEP_TITLES[3], expanded=True):
+            if "gift_ideas" in result:
+                render_gift_ideas(result["gift_ideas"], result.get("gift_idea_scores"))
+            render_streams(step_streams[3])
+    if "debates" in result or step_streams[4]:
+        with st.expander(STEP_TITLES[4], expanded=True):
+            if "debates" in result:
+                render_debates(result["debates"])
+            render_streams(step_streams[4])
+    if "selected_gifts" in result or step_streams[5]:
+        with st.expander(STEP_TITLES[5], expanded=True):
+            if "selected_gifts" in result:
+                render_selected_gifts(result["selected_gifts"])
+            render_streams(step_streams[5])
+    if "amazon_keywords" in result or step_streams[6]:
+        with st.expander(STEP_TITLES[6], expanded=True):
+            if "amazon_keywords" in result:
+                render_keywords(result["amazon_keywords"])
+            render_streams(step_streams[6])
+    if "products" in result:
+        with st.expander(STEP_TITLES[7], expanded=True):
+            render_products(result["products"])
+
+def render_products(products):
+    st.subheader("Amazon Product Links")
+    for product in products:
+        render_product_link(ProductLinkEvent(**product))
+
+def render_metrics(metrics):
+    totals = metrics["totals"]
+    with st.expander("⏱️ Run Metrics", expanded=False):
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Wall time", f"{totals['wall_seconds']:.1f}s")
+        col2.metric("LLM calls", totals["llm_calls"])
+        col3.metric("Tokens", totals["prompt_tokens"] + totals["completion_tokens"])
+        col4.metric("Estimated cost", f"${totals['cost_usd']:.4f}")
+        st.dataframe(metrics["summary"], use_container_width=True)
+
+def render_product_link(product_link):
+    with st.container():
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            if product_link.product_image:
+                st.image(product_link.product_image, width=100)
+            else:
+                st.write("No image available")
+        with col2:
+            st.write(f"**{product_link.product_title[:50]}...**" if product_link.product_title else "Title not available")
+            price_text = f"${product_link.product_price:.2f}" if product_link.product_price and product_link.product_price != 'N/A' else "Price not available"
+            rating_stars = '⭐' * int(float(product_link.product_rating)) if product_link.product_rating and product_link.product_rating != 'N/A' else ""
+            st.write(f"{price_text} | {rating_stars}")
+            if product_link.product_links:
+                st.markdown(f"[View]({product_link.product_links})")
+            else:
+                st.write("Link not available")
+
+def forget_job():
+    st.session_state.pop("job_id", None)
+    if "job" in st.query_params:
+        del st.query_params["job"]
+
+def render_job(job_id):
+    """Shows a job's progress and results; returns its notes and the seconds until the next look, None once it is done."""
+    job = get_job_executor().get(job_id)
+    if job is None:
+        st.warning("That run is no longer available. Please start a new one.")
+        forget_job()
+        return [], None
+
+    if not job.done and st.button("✋ Cancel"):
+        get_job_executor().cancel(job_id)
+
+    snapshot = job.snapshot()
+    notes = [event["message"] for event in snapshot["events"] if event["type"] == "log"]
+    if snapshot["status"] == "queued":
+        st.info("Waiting for a free worker, your run starts as soon as one is available...")
+    elif snapshot["status"] == "running":
+        st.progress(snapshot["progress"])
+
+    render_result(snapshot["result"] or snapshot["state"], snapshot["streams"])
+
+    if snapshot["status"] == "done":
+        if "metrics" in snapshot["result"]:
+            render_metrics(snapshot["result"]["metrics"])
+        if st.session_state.get("celebrated_job") != job_id:
+            st.session_state.celebrated_job = job_id
+            st.success("Gift suggestions generated successfully!")
+            st.balloons()
+    elif snapshot["status"] == "failed":
+        st.error(f"An error occurred: {snapshot['error']}")
+    elif snapshot["status"] == "cancelled":
+        st.warning("This run was cancelled.")
+    if job.done:
+        return notes, None
+    return notes, STREAM_POLL_SECONDS if snapshot["streams"] else POLL_SECONDS
 
 def main():
     price_ceiling = st.sidebar.number_input(
@@ -204,31 +438,50 @@ def main():
         help="Enter any additional text to analyze",
     )
 
-    if st.button("✨ Let the GiftGenie Grant Your Wish ✨"):
-        progress_bar = st.progress(0)
-        progress_text = st.empty()
+    generate = st.button("✨ Let the GiftGenie Grant Your Wish ✨")
+    regenerate = st.button("🔄 Regenerate", help="Run every step again instead of showing saved suggestions for the same request")
+    notes = list(st.session_state.log_output)
+    if generate or regenerate:
+        options = workflow_options(get_cassette())
+        request = WorkflowResultCache.normalize_request(twitter_handle, additional_text, price_ceiling, options)
         try:
-            progress_text.text("Starting the gift suggestion process...")
-            asyncio.run(
-                run_workflow(price_ceiling, twitter_handle, additional_text, progress_bar)
-            )
-            progress_text.text("Gift suggestions generated successfully!")
-            st.balloons()
+            saved_result = None if regenerate else get_result_cache().get(request)
+            if saved_result is not None:
+                forget_job()
+                log_print("Showing saved suggestions for this request")
+                st.info("These suggestions were saved from an earlier run with the same details. Press Regenerate for new ones.")
+                render_result(saved_result)
+            else:
+                job = submit_workflow(price_ceiling, twitter_handle, additional_text, request, options)
+                log_print(f"Started run {job.id}")
+                # Kept in the URL as well, so a reconnect or page reload finds the run again
+                st.session_state.job_id = job.id
+                st.query_params["job"] = job.id
         except Exception as e:
             st.error(f"An error occurred: {str(e)}")
             traceback.print_exc(file=sys.stdout)
             log_print(f"Error: {str(e)}")  # Log the error
-        finally:
-            progress_bar.empty()
-            progress_text.empty()
+        notes = list(st.session_state.log_output)
+
+    poll_seconds = None
+    job_id = st.session_state.get("job_id") or st.query_params.get("job")
+    if job_id:
+        st.session_state.job_id = job_id
+        job_notes, poll_seconds = render_job(job_id)
+        notes += job_notes
 
     st.sidebar.info("Note: This process may take a few minutes to complete.")
 
     # Display logs
-    if st.session_state.log_output:
+    if notes:
         with st.expander("✨ 📝 Our Notes 📝  ✨", expanded=False):
-            for log in st.session_state.log_output:
+            for log in notes:
                 st.text(log)
 
+    if poll_seconds is not None:
+        # Poll: this script run ends and the next one shows the job's latest state
+        time.sleep(poll_seconds)
+        st.rerun()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
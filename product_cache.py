@@ -0,0 +1,88 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+
+class ProductSearchCache:
+    """SQLite-backed cache of Apify product search results, keyed by normalized keyword and marketplace.
+
+    Entries younger than ttl_seconds are fresh. Older entries are still served for up to
+    max_stale_seconds while refresh_in_background fetches a new result.
+    """
+
+    def __init__(self, path: str = "cache/product_cache.sqlite", ttl_seconds: float = 24 * 3600, max_stale_seconds: float = 7 * 24 * 3600, refresh_workers: int = 2):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        # Refreshes run on threads so they outlive the event loop of the run that triggered them
+        self._executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="product-cache-refresh")
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS products (
+                keyword TEXT NOT NULL,
+                marketplace TEXT NOT NULL,
+                items TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (keyword, marketplace)
+            )"""
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def normalize_keyword(keyword: str) -> str:
+        return " ".join(keyword.strip().strip("\"'").lower().split())
+
+    def get(self, keyword: str, marketplace: str) -> Optional[Tuple[List[dict], bool]]:
+        """Returns (items, is_stale), or None if there is no usable entry."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT items, fetched_at FROM products WHERE keyword = ? AND marketplace = ?",
+                (self.normalize_keyword(keyword), marketplace)
+            ).fetchone()
+        if row is None:
+            return None
+
+        items, fetched_at = row
+        age = time.time() - fetched_at
+        if age > self.ttl_seconds + self.max_stale_seconds:
+            return None
+        return json.loads(items), age > self.ttl_seconds
+
+    def set(self, keyword: str, marketplace: str, items: List[dict]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO products (keyword, marketplace, items, fetched_at) VALUES (?, ?, ?, ?)",
+                (self.normalize_keyword(keyword), marketplace, json.dumps(items, default=str), time.time())
+            )
+            self._conn.commit()
+
+    def refresh_in_background(self, keyword: str, marketplace: str, fetch: Callable[[], List[dict]]):
+        key = (self.normalize_keyword(keyword), marketplace)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                items = fetch()
+                if items:
+                    self.set(keyword, marketplace, items)
+            except Exception as e:
+                print(f"Error refreshing product cache for '{keyword}': {str(e)}")
+                traceback.print_exc()
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(refresh)
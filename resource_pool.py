@@ -0,0 +1,245 @@
+import os
+import asyncio
+import inspect
+import weakref
+import threading
+import contextvars
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, List, Optional
+import httpx
+from llama_index.core.agent import FunctionCallingAgentWorker
+from llama_index.core.tools import FunctionTool
+from llama_index.llms.openai import OpenAI
+from llm_cache import CachedOpenAI
+from cassette import CassetteOpenAI
+
+# Tool implementations of the run that is currently chatting with a pooled agent, by tool name
+current_tools = contextvars.ContextVar("current_tools", default=None)
+
+
+class PooledAgent:
+    """An agent checked out of the ResourcePool for one run.
+
+    The pooled agent's tools only forward to the implementations in current_tools, so the
+    run's own tool closures are installed around every chat.
+    """
+
+    def __init__(self, key, agent, tools: Dict[str, Callable]):
+        self.key = key
+        self.agent = agent
+        self.tools = tools
+
+    async def achat(self, message: str, **kwargs):
+        token = current_tools.set(self.tools)
+        try:
+            return await self.agent.achat(message, **kwargs)
+        finally:
+            current_tools.reset(token)
+
+    def reset(self):
+        self.agent.reset()
+
+    def __getattr__(self, name):
+        return getattr(self.agent, name)
+
+
+class ResourcePool:
+    """Clients and agents shared by every run in the process.
+
+    Sync clients are created once and keep their HTTP connections alive between runs. Async
+    clients hold connections bound to the event loop that opened them, so they are created once
+    per event loop and shared by every step, debate and product lookup of the runs on that loop.
+    Agents are checked out per run and handed back with their chat memory reset, so later runs
+    reuse the agent worker, tool schemas and LLM instead of building them again.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 60.0,
+        max_idle_agents: int = 64,
+    ):
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(600.0, connect=10.0)
+        self.max_idle_agents = max_idle_agents
+        self.counts = defaultdict(int)
+        self._lock = threading.RLock()
+        self._http_client = None
+        self._openai_client = None
+        self._toolhouse = None
+        self._apify_client = None
+        self._loop_resources = weakref.WeakKeyDictionary()
+        self._sync_resources = {}
+        self._tool_metadata = {}
+        self._idle_agents = OrderedDict()
+        self._idle_count = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counts, "idle_agents": self._idle_count}
+
+    def http_client(self) -> httpx.Client:
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(limits=self.limits, timeout=self.timeout)
+            return self._http_client
+
+    def _resources(self) -> dict:
+        """The async clients of the running event loop, or the sync ones outside a loop."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self._sync_resources
+        with self._lock:
+            if loop not in self._loop_resources:
+                self._loop_resources[loop] = {}
+            return self._loop_resources[loop]
+
+    def async_http_client(self) -> Optional[httpx.AsyncClient]:
+        resources = self._resources()
+        if resources is self._sync_resources:
+            return None
+        with self._lock:
+            if "http_client" not in resources:
+                resources["http_client"] = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            return resources["http_client"]
+
+    def llm(self, llm_cache=None, cassette=None, model: str = "gpt-4", temperature: float = 0.4):
+        """One LLM per (cache, cassette, model) and event loop; a cassette takes precedence over the cache."""
+        resources = self._resources()
+        key = ("llm", model, temperature, id(cassette) if cassette is not None else None, id(llm_cache) if cassette is None and llm_cache is not None else None)
+        with self._lock:
+            if key in resources:
+                self.counts["llm_reused"] += 1
+                return resources[key]
+
+            kwargs = {
+                "model": model,
+                "temperature": temperature,
+                "http_client": self.http_client(),
+                "async_http_client": self.async_http_client(),
+                "reuse_client": True,
+            }
+            if cassette is not None:
+                llm = CassetteOpenAI(cassette=cassette, **kwargs)
+            elif llm_cache is not None:
+                llm = CachedOpenAI(cache=llm_cache, **kwargs)
+            else:
+                llm = OpenAI(**kwargs)
+            self.counts["llm_created"] += 1
+            resources[key] = llm
+            return llm
+
+    def embed_model(self, model: str = "text-embedding-3-small"):
+        """One OpenAI embedding model per model name and event loop."""
+        resources = self._resources()
+        key = ("embed_model", model)
+        with self._lock:
+            if key not in resources:
+                from llama_index.embeddings.openai import OpenAIEmbedding
+
+                resources[key] = OpenAIEmbedding(model=model, http_client=self.http_client())
+            return resources[key]
+
+    def openai_client(self):
+        with self._lock:
+            if self._openai_client is None:
+                from openai import OpenAI as OpenAIClient
+
+                self._openai_client = OpenAIClient(api_key=os.getenv("OPENAI_API_KEY"), http_client=self.http_client())
+            return self._openai_client
+
+    def toolhouse(self):
+        with self._lock:
+            if self._toolhouse is None:
+                from toolhouse import Toolhouse
+
+                self._toolhouse = Toolhouse(api_key=os.getenv("TOOLHOUSE_API_KEY"), provider="openai")
+            return self._toolhouse
+
+    def apify_client(self):
+        with self._lock:
+            if self._apify_client is None:
+                from apify_client import ApifyClient
+
+                self._apify_client = ApifyClient(os.getenv("APIFY_API_TOKEN"))
+            return self._apify_client
+
+    def apify_async_client(self):
+        resources = self._resources()
+        with self._lock:
+            if "apify" not in resources:
+                from apify_client import ApifyClientAsync
+
+                resources["apify"] = ApifyClientAsync(os.getenv("APIFY_API_TOKEN"))
+            return resources["apify"]
+
+    def _forwarding_tool(self, tool: Callable) -> FunctionTool:
+        name = tool.__name__
+        metadata_key = (tool.__module__, tool.__qualname__)
+        if metadata_key not in self._tool_metadata:
+            # Built from the real tool so the schema and description the LLM sees are unchanged
+            fn_key = "async_fn" if asyncio.iscoroutinefunction(tool) else "fn"
+            self._tool_metadata[metadata_key] = FunctionTool.from_defaults(**{fn_key: tool}).metadata
+
+        async def forward(*args, **kwargs):
+            result = current_tools.get()[name](*args, **kwargs)
+            return await result if inspect.isawaitable(result) else result
+
+        return FunctionTool.from_defaults(async_fn=forward, tool_metadata=self._tool_metadata[metadata_key])
+
+    def agent(self, llm, tools: List[Callable], system_prompt: str) -> PooledAgent:
+        key = (id(llm), tuple((tool.__module__, tool.__qualname__) for tool in tools), system_prompt)
+        with self._lock:
+            idle = self._idle_agents.get(key)
+            if idle:
+                agent = idle.pop()
+                self._idle_count -= 1
+                if not idle:
+                    del self._idle_agents[key]
+                self.counts["agents_reused"] += 1
+                return PooledAgent(key, agent, {tool.__name__: tool for tool in tools})
+
+            agent = FunctionCallingAgentWorker.from_tools(
+                tools=[self._forwarding_tool(tool) for tool in tools],
+                llm=llm,
+                allow_parallel_tool_calls=False,
+                system_prompt=system_prompt
+            ).as_agent()
+            self.counts["agents_created"] += 1
+        return PooledAgent(key, agent, {tool.__name__: tool for tool in tools})
+
+    def release(self, agents: List[PooledAgent]):
+        """Resets the agents' chat memory and keeps them for the next run."""
+        for pooled in agents:
+            pooled.reset()
+            with self._lock:
+                self._idle_agents.setdefault(pooled.key, []).append(pooled.agent)
+                self._idle_agents.move_to_end(pooled.key)
+                self._idle_count += 1
+                while self._idle_count > self.max_idle_agents:
+                    oldest_key, oldest = next(iter(self._idle_agents.items()))
+                    oldest.pop(0)
+                    self._idle_count -= 1
+                    if not oldest:
+                        del self._idle_agents[oldest_key]
+
+
+_pool_lock = threading.Lock()
+_pool: Optional[ResourcePool] = None
+
+
+def get_resource_pool() -> ResourcePool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ResourcePool()
+        return _pool
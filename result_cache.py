@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+# Bump when a change to the workflow makes earlier results wrong to show again
+RESULT_CACHE_VERSION = 1
+
+
+class WorkflowResultCache:
+    """SQLite-backed cache of finished workflow runs, keyed by the normalized request.
+
+    Results older than max_age_seconds are dropped, and once the stored results add up to
+    more than max_bytes the least recently used ones are evicted.
+    """
+
+    def __init__(self, path: str = "cache/result_cache.sqlite", max_age_seconds: Optional[float] = 7 * 24 * 3600, max_bytes: Optional[int] = 50 * 1024 * 1024):
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Several server processes can share the file, so wait for their writes instead of failing
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                request TEXT NOT NULL,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_last_accessed ON results (last_accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def normalize_request(twitter_handle: str, additional_text: str, price_ceiling: float, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Requests that differ only in case, whitespace or a leading "@" map to the same entry."""
+        return {
+            "version": RESULT_CACHE_VERSION,
+            "twitter_handle": (twitter_handle or "").strip().lstrip("@").lower(),
+            "additional_text": " ".join((additional_text or "").lower().split()),
+            "price_ceiling": round(float(price_ceiling), 2),
+            "options": options or {},
+        }
+
+    @staticmethod
+    def make_key(request: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        key = self.make_key(request)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT result, created_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.max_age_seconds is not None and now - row[1] > self.max_age_seconds):
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE results SET last_accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, request: Dict[str, Any], result: Dict[str, Any]):
+        value = json.dumps(result, default=str)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, request, result, size, created_at, last_accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.make_key(request), json.dumps(request, sort_keys=True), value, len(value.encode("utf-8")), now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        if self.max_age_seconds is not None:
+            self._conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.max_age_seconds,))
+        if self.max_bytes is not None:
+            # Keep the most recently used results that fit in max_bytes together
+            self._conn.execute(
+                """DELETE FROM results WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY last_accessed DESC, key) AS total FROM results
+                    ) WHERE total > ?
+                )""",
+                (self.max_bytes,)
+            )
+
+    def delete(self, request: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute("DELETE FROM results WHERE key = ?", (self.make_key(request),))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
@@ -1,27 +1,62 @@
-import os
-from typing import List, Dict
-from dotenv import load_dotenv
-from openai import OpenAI
-from toolhouse import Toolhouse
+from typing import List, Dict, Optional
 import json
 import re
+import threading
+from tweet_store import TweetStore
+from resource_pool import get_resource_pool
 
-# Load environment variables
-load_dotenv()
+# The OpenAI and Toolhouse clients are created on first use and shared through the process-wide pool
+def get_client():
+    return get_resource_pool().openai_client()
 
-# Set API Keys
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-th = Toolhouse(api_key=os.getenv('TOOLHOUSE_API_KEY'), provider="openai")
+def get_toolhouse():
+    return get_resource_pool().toolhouse()
 
 # Define the OpenAI model
 MODEL = 'gpt-4'
 
-def search_tweets(username: str, max_results: int = 10) -> List[Dict[str, str]]:
+# Tweets already fetched per handle, so repeat lookups skip the Toolhouse round trips.
+# Opened on first use, so importing this module does not create the SQLite file.
+_tweet_store: Optional[TweetStore] = None
+_tweet_store_lock = threading.Lock()
+
+def get_tweet_store() -> TweetStore:
+    global _tweet_store
+    with _tweet_store_lock:
+        if _tweet_store is None:
+            _tweet_store = TweetStore()
+        return _tweet_store
+
+def search_tweets(username: str, max_results: int = 10, use_cache: bool = True, cassette=None) -> List[Dict[str, str]]:
+    if cassette is not None:
+        # Record or replay the tweets the Toolhouse search returned for this handle
+        request = {"username": username, "max_results": max_results}
+        return cassette.call("tweets", request, lambda: search_tweets(username, max_results, use_cache))
+
+    if not use_cache:
+        return fetch_tweets(username, max_results)
+
+    tweet_store = get_tweet_store()
+    if tweet_store.is_fresh(username):
+        print(f"Using cached tweets for {username}")
+        return tweet_store.get_tweets(username, max_results)
+
+    # Only ask for tweets newer than the ones we already have
+    since_id = tweet_store.newest_id(username)
+    tweets = fetch_tweets(username, max_results, since_id)
+    tweet_store.add_tweets(username, tweets)
+    return tweet_store.get_tweets(username, max_results)
+
+def fetch_tweets(username: str, max_results: int = 10, since_id: Optional[str] = None) -> List[Dict[str, str]]:
     search_query = f"from:{username}"
+    if since_id:
+        search_query += f" since_id:{since_id}"
     messages = [{
         "role": "user",
         "content": f"Search X for the most recent {max_results} tweets {search_query}. Return the results as a JSON array of objects, each with 'id', 'text', and 'date' fields."
     }]
+    client = get_client()
+    th = get_toolhouse()
 
     response = client.chat.completions.create(
         model=MODEL,
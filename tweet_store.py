@@ -0,0 +1,91 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+
+class TweetStore:
+    """SQLite store of fetched tweets per Twitter handle.
+
+    A handle fetched less than freshness_seconds ago is served from the store,
+    and newest_id lets a later fetch ask only for tweets posted since then.
+    """
+
+    def __init__(self, path: str = "cache/tweets.sqlite", freshness_seconds: float = 15 * 60):
+        self.path = path
+        self.freshness_seconds = freshness_seconds
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS tweets (
+                handle TEXT NOT NULL,
+                id TEXT NOT NULL,
+                text TEXT NOT NULL,
+                date TEXT,
+                PRIMARY KEY (handle, id)
+            )"""
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS handles (handle TEXT PRIMARY KEY, fetched_at REAL NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def normalize_handle(handle: str) -> str:
+        return handle.strip().lstrip("@").lower()
+
+    @staticmethod
+    def _sort_key(tweet: Dict[str, str]):
+        # Tweet ids are snowflakes, so numeric order is posting order
+        tweet_id = tweet.get("id", "")
+        return (1, int(tweet_id)) if tweet_id.isdigit() else (0, 0)
+
+    def is_fresh(self, handle: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fetched_at FROM handles WHERE handle = ?", (self.normalize_handle(handle),)
+            ).fetchone()
+        return row is not None and time.time() - row[0] < self.freshness_seconds
+
+    def newest_id(self, handle: str) -> Optional[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM tweets WHERE handle = ?", (self.normalize_handle(handle),)
+            ).fetchall()
+        numeric_ids = [int(row[0]) for row in rows if row[0].isdigit()]
+        return str(max(numeric_ids)) if numeric_ids else None
+
+    def get_tweets(self, handle: str, limit: int = 10) -> List[Dict[str, str]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, text, date FROM tweets WHERE handle = ?", (self.normalize_handle(handle),)
+            ).fetchall()
+        tweets = [{"id": tweet_id, "text": text, "date": date or ""} for tweet_id, text, date in rows]
+        return sorted(tweets, key=self._sort_key, reverse=True)[:limit]
+
+    @staticmethod
+    def tweet_id(tweet: Dict[str, str]) -> str:
+        # Tweets parsed from the model's text answer have no id; a content hash is never numeric,
+        # so newest_id leaves them out
+        if tweet.get("id"):
+            return str(tweet["id"])
+        return "sha256:" + hashlib.sha256(str(tweet["text"]).encode("utf-8")).hexdigest()[:16]
+
+    def add_tweets(self, handle: str, tweets: List[Dict[str, str]]):
+        handle = self.normalize_handle(handle)
+        with self._lock:
+            for tweet in tweets:
+                # The model's answer is parsed loosely, so skip anything that is not a tweet with text
+                if not isinstance(tweet, dict) or not tweet.get("text"):
+                    continue
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO tweets (handle, id, text, date) VALUES (?, ?, ?, ?)",
+                    (handle, self.tweet_id(tweet), str(tweet["text"]), str(tweet.get("date") or ""))
+                )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO handles (handle, fetched_at) VALUES (?, ?)", (handle, time.time())
+            )
+            self._conn.commit()
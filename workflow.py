@@ -1,7 +1,8 @@
 import os
+import hashlib
 from typing import List, Dict
 from dotenv import load_dotenv
-from llama_index.core import VectorStoreIndex, Document, Settings
+from llama_index.core import VectorStoreIndex, Document, Settings, load_index_from_storage
 from llama_index.llms.openai import OpenAI
 from llama_index.core.storage import StorageContext
 
@@ -34,15 +35,55 @@ def get_openai_key():
         raise ValueError("OPENAI_API_KEY not found in environment variables")
     os.environ["OPENAI_API_KEY"] = openai_api_key
 
-def create_index(data: List[str], index_name: str) -> VectorStoreIndex:
-    documents = [Document(text=item) for item in data]
-    Settings.llm = OpenAI()
-    index = VectorStoreIndex.from_documents(documents)
-    index.storage_context.persist(persist_dir=f'./{index_name}')
-    return index
+class PersistentIndex:
+    """A VectorStoreIndex kept in ./<index_name> and updated in place.
+
+    Documents are keyed by a hash of their text, so sync() only embeds items that are new or
+    changed and deletes the ones no longer in the data, instead of re-embedding everything.
+    """
+
+    def __init__(self, index_name: str):
+        self.persist_dir = f'./{index_name}'
+        self.index = self.load()
+
+    def load(self) -> VectorStoreIndex:
+        if os.path.exists(os.path.join(self.persist_dir, "docstore.json")):
+            try:
+                storage_context = StorageContext.from_defaults(persist_dir=self.persist_dir)
+                return load_index_from_storage(storage_context)
+            except Exception as e:
+                print(f"Could not load index from {self.persist_dir}, rebuilding it: {str(e)}")
+        return VectorStoreIndex([])
+
+    @staticmethod
+    def doc_id(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def sync(self, data: List[str]) -> VectorStoreIndex:
+        wanted = {self.doc_id(item): item for item in data}
+        existing = set(self.index.ref_doc_info)
+
+        for doc_id in existing - set(wanted):
+            self.index.delete_ref_doc(doc_id, delete_from_docstore=True)
+        new_documents = [Document(text=text, id_=doc_id) for doc_id, text in wanted.items() if doc_id not in existing]
+        if new_documents:
+            # One batched embedding request for all new items
+            self.index.insert_nodes(Settings.node_parser.get_nodes_from_documents(new_documents))
+
+        if existing != set(wanted) or not os.path.exists(self.persist_dir):
+            self.index.storage_context.persist(persist_dir=self.persist_dir)
+        return self.index
+
+_indexes: Dict[str, PersistentIndex] = {}
+
+def get_index(data: List[str], index_name: str) -> VectorStoreIndex:
+    # Loaded from disk once per process, then kept in memory between turns
+    if index_name not in _indexes:
+        _indexes[index_name] = PersistentIndex(index_name)
+    return _indexes[index_name].sync(data)
 
 def analyze_twitter_feed(feed: List[str]) -> str:
-    index = create_index(feed, "twitter_index")
+    index = get_index(feed, "twitter_index")
     query_engine = index.as_query_engine()
     query = "Analyze the user's interests based on their tweets and provide a summary of their main interests."
     response = query_engine.query(query)
@@ -50,7 +91,7 @@ def analyze_twitter_feed(feed: List[str]) -> str:
 
 def recommend_products(interests: str, products: List[Dict]) -> str:
     product_data = [f"{p['name']} - {p['category']} - ${p['price']}" for p in products]
-    index = create_index(product_data, "product_index")
+    index = get_index(product_data, "product_index")
     query_engine = index.as_query_engine()
     query = f"Based on the user's interests: {interests}, recommend 3 products from the available list that would be most relevant."
     response = query_engine.query(query)
@@ -68,6 +109,7 @@ def update_twitter_feed(user_input: str, current_feed: List[str]) -> List[str]:
 
 def main():
     get_openai_key()
+    Settings.llm = OpenAI()
     global twitter_feed
 
     while True: